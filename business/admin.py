@@ -98,7 +98,8 @@ class OrderProductAdmin(admin.ModelAdmin):
     search_fields = ('order__id', 'variant__name', 'product_code')
     list_filter = ('created_at',)
     ordering = ('-created_at',)
-    readonly_fields = ('amount_display', 'created_at', 'updated_at')
+    # used_stocks 由下單、確認預訂與刪除流程隨庫存分配記錄一起維護，不開放手動修改
+    readonly_fields = ('used_stocks', 'amount_display', 'created_at', 'updated_at')
 
     fieldsets = (
         ('訂單產品資訊', {
@@ -0,0 +1,357 @@
+import json
+import logging
+import secrets
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import quote, unquote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+# 購物車
+class Cart:
+    """
+    購物車（每個請求解析一次 cookie，結果放在 request.cart）
+
+    資料格式與 cookie 相同：{
+        'variant_id': {
+            'product_name': str,
+            'variant_name': str,
+            'quantity': int,
+            'unit_price': float
+        }
+    }
+
+    異動方法（add / set_quantity / set_unit_price / remove / clear）會直接修改內容、
+    重新計算統計並標記 modified，由 CartMiddleware 在回應時透過 CartStore 寫回一次。
+    """
+    COOKIE_NAME = 'cart'
+    COOKIE_MAX_AGE = 30 * 24 * 60 * 60  # 30 天
+    MAX_QUANTITY = 999
+
+    def __init__(self, data=None):
+        self.data = data or {}
+        self.modified = False
+        self._recalculate()
+
+    @classmethod
+    def from_cookie(cls, cookie_value):
+        """
+        解析購物車 cookie（URL 編碼的 JSON），格式錯誤時回傳空購物車
+        """
+        if not cookie_value:
+            return cls()
+        try:
+            data = json.loads(unquote(cookie_value))
+            if not isinstance(data, dict):
+                raise ValueError('購物車格式錯誤')
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.warning(f'購物車 cookie 解析失敗：{str(e)}，將建立新購物車')
+            return cls()
+
+        items = {}
+        for variant_id, item in data.items():
+            item = cls._clean_item(item)
+            if item is None:
+                logger.warning(f'購物車 cookie 商品 {variant_id} 格式錯誤，已移除')
+                continue
+            items[variant_id] = item
+        return cls(items)
+
+    @staticmethod
+    def _clean_item(item):
+        """
+        檢查 cookie 中的單一商品（cookie 可被用戶端修改）
+
+        Args:
+            item: cookie 中的商品資料
+
+        Returns:
+            dict: 數量轉為整數、單價轉為數值後的商品，格式錯誤時為 None
+        """
+        if not isinstance(item, dict):
+            return None
+        unit_price = item.get('unit_price', 0)
+        try:
+            quantity = int(item.get('quantity', 0))
+            price = Decimal(str(unit_price))
+        except (TypeError, ValueError, ArithmeticError):
+            return None
+        if quantity < 0 or not price.is_finite():
+            return None
+        if not isinstance(unit_price, (int, float)):
+            unit_price = float(price)
+        return {**item, 'quantity': quantity, 'unit_price': unit_price}
+
+    @classmethod
+    def from_request(cls, request):
+        """取得請求的購物車（有 CartMiddleware 時直接使用 request.cart）"""
+        cart = getattr(request, 'cart', None)
+        if cart is None:
+            cart = get_cart_store().load(request)
+        return cart
+
+    def to_cookie(self):
+        """序列化為 cookie 值（使用 ensure_ascii=False 後 URL 編碼，確保中文正確存儲）"""
+        return quote(json.dumps(self.data, ensure_ascii=False))
+
+    def _recalculate(self):
+        """重新計算商品總數與總金額"""
+        self.count = sum(int(item.get('quantity', 0)) for item in self.data.values())
+        self.total = sum(
+            (int(item.get('quantity', 0)) * Decimal(str(item.get('unit_price', 0))) for item in self.data.values()),
+            Decimal('0')
+        )
+
+    def _changed(self):
+        self.modified = True
+        self._recalculate()
+
+    def __contains__(self, variant_id):
+        return str(variant_id) in self.data
+
+    def __getitem__(self, variant_id):
+        return self.data[str(variant_id)]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def get(self, variant_id, default=None):
+        return self.data.get(str(variant_id), default)
+
+    def items(self):
+        return self.data.items()
+
+    def values(self):
+        return self.data.values()
+
+    def active_variants(self):
+        """
+        一次查詢購物車內所有上架中的變體（含產品）
+
+        Returns:
+            dict: {variant_id(str): Variant}，已下架或不存在的變體不包含在內
+        """
+        from products.models import Variant
+        from products.constant import VariantStatus
+
+        variant_ids = [int(key) for key in self.data if str(key).isdigit()]
+        return {
+            str(variant.id): variant
+            for variant in Variant.objects.select_related('product').filter(
+                id__in=variant_ids,
+                status=VariantStatus.ACTIVE,
+                product__status='ACTIVE'
+            )
+        }
+
+    def subtotal(self, variant_id):
+        """單一商品小計"""
+        item = self[variant_id]
+        return int(item['quantity']) * Decimal(str(item['unit_price']))
+
+    def add(self, variant_id, product_name, variant_name, quantity, unit_price):
+        """
+        新增商品或累加數量（同時更新單價）
+
+        Returns:
+            str: 'added' 或 'updated'
+        """
+        key = str(variant_id)
+        if key in self.data:
+            item = self.data[key]
+            item['quantity'] = min(item['quantity'] + quantity, self.MAX_QUANTITY)
+            item['unit_price'] = unit_price
+            action = 'updated'
+        else:
+            self.data[key] = {
+                'product_name': product_name,
+                'variant_name': variant_name,
+                'quantity': quantity,
+                'unit_price': unit_price
+            }
+            action = 'added'
+        self._changed()
+        return action
+
+    def set_quantity(self, variant_id, quantity, unit_price=None):
+        """設定商品數量（可同時更新單價）"""
+        item = self[variant_id]
+        item['quantity'] = quantity
+        if unit_price is not None:
+            item['unit_price'] = unit_price
+        self._changed()
+
+    def set_unit_price(self, variant_id, unit_price):
+        """設定商品單價"""
+        self[variant_id]['unit_price'] = unit_price
+        self._changed()
+
+    def remove(self, variant_id):
+        """
+        移除商品
+
+        Returns:
+            dict: 被移除的商品，不存在時為 None
+        """
+        item = self.data.pop(str(variant_id), None)
+        if item is not None:
+            self._changed()
+        return item
+
+    def clear(self):
+        """清空購物車"""
+        self.data = {}
+        self._changed()
+
+
+# 購物車儲存後端
+class CartStore:
+    """
+    購物車儲存後端介面（由 settings.CART_STORE 選擇，見 get_cart_store）
+
+    load 於請求第一次使用購物車時呼叫；save 只在購物車有異動時由 CartMiddleware 呼叫一次。
+    """
+
+    def load(self, request):
+        """
+        Returns:
+            Cart: 請求的購物車
+        """
+        raise NotImplementedError
+
+    def save(self, request, response, cart):
+        """將購物車寫回（空購物車則清除）"""
+        raise NotImplementedError
+
+
+class CookieCartStore(CartStore):
+    """整個購物車以 URL 編碼的 JSON 存於 cookie（受瀏覽器 4KB 限制）"""
+
+    def load(self, request):
+        return Cart.from_cookie(request.COOKIES.get(Cart.COOKIE_NAME))
+
+    def save(self, request, response, cart):
+        if cart:
+            response.set_cookie(
+                Cart.COOKIE_NAME,
+                cart.to_cookie(),
+                max_age=Cart.COOKIE_MAX_AGE,
+                httponly=False,
+                samesite='Lax'
+            )
+        else:
+            response.delete_cookie(Cart.COOKIE_NAME, samesite='Lax')
+
+
+class TokenCartStore(CartStore):
+    """
+    購物車內容存於伺服器端，cookie 只存放 token
+
+    沒有 token 但帶有舊版購物車 cookie 時，會沿用其內容並在回應時轉存，
+    切換儲存後端不會遺失購物車。
+    """
+    TOKEN_COOKIE_NAME = 'cart_token'
+
+    def read(self, token):
+        """Returns: dict 或 None（不存在或已過期）"""
+        raise NotImplementedError
+
+    def write(self, token, data):
+        raise NotImplementedError
+
+    def delete(self, token):
+        raise NotImplementedError
+
+    def load(self, request):
+        token = request.COOKIES.get(self.TOKEN_COOKIE_NAME)
+        data = self.read(token) if token else None
+        if data is not None:
+            return Cart(data)
+
+        # 沿用舊版 cookie 購物車
+        legacy_cookie = request.COOKIES.get(Cart.COOKIE_NAME)
+        cart = Cart.from_cookie(legacy_cookie)
+        if legacy_cookie:
+            cart.modified = True
+        return cart
+
+    def save(self, request, response, cart):
+        token = request.COOKIES.get(self.TOKEN_COOKIE_NAME)
+        if cart:
+            if not token:
+                token = secrets.token_urlsafe(16)
+            self.write(token, cart.data)
+            response.set_cookie(
+                self.TOKEN_COOKIE_NAME,
+                token,
+                max_age=Cart.COOKIE_MAX_AGE,
+                httponly=True,
+                samesite='Lax'
+            )
+        else:
+            if token:
+                self.delete(token)
+            response.delete_cookie(self.TOKEN_COOKIE_NAME, samesite='Lax')
+
+        # 清除舊版購物車 cookie
+        if Cart.COOKIE_NAME in request.COOKIES:
+            response.delete_cookie(Cart.COOKIE_NAME, samesite='Lax')
+
+
+class DatabaseCartStore(TokenCartStore):
+    """購物車存於 StoredCart 資料表（過期資料由 clear_expired_carts 指令清除）"""
+
+    def read(self, token):
+        from business.models import StoredCart
+
+        expired_before = timezone.now() - timedelta(seconds=Cart.COOKIE_MAX_AGE)
+        return StoredCart.objects.filter(
+            token=token, updated_at__gte=expired_before
+        ).values_list('data', flat=True).first()
+
+    def write(self, token, data):
+        from business.models import StoredCart
+
+        StoredCart.objects.update_or_create(token=token, defaults={'data': data})
+
+    def delete(self, token):
+        from business.models import StoredCart
+
+        StoredCart.objects.filter(token=token).delete()
+
+
+class CacheCartStore(TokenCartStore):
+    """購物車存於 Django 快取（預設為本機記憶體快取，重啟後清空）"""
+    KEY_PREFIX = 'cart:'
+
+    def read(self, token):
+        return cache.get(f'{self.KEY_PREFIX}{token}')
+
+    def write(self, token, data):
+        cache.set(f'{self.KEY_PREFIX}{token}', data, timeout=Cart.COOKIE_MAX_AGE)
+
+    def delete(self, token):
+        cache.delete(f'{self.KEY_PREFIX}{token}')
+
+
+CART_STORES = {
+    'cookie': CookieCartStore,
+    'db': DatabaseCartStore,
+    'cache': CacheCartStore,
+}
+
+
+def get_cart_store():
+    """依 settings.CART_STORE 取得購物車儲存後端"""
+    return CART_STORES[getattr(settings, 'CART_STORE', 'cookie')]()
@@ -22,6 +22,15 @@ SUBMIT_ORDER_REPLY_TYPE = 1
 SITE_HOST = "https://db3c.net"
 WAREHOUSE = "上海仓库"
 
+# 收據編號：R + YYYYMMDD + 流水號（最少位數，超過時自動加長）
+RECEIPT_NUMBER_PREFIX = "R"
+RECEIPT_NUMBER_WIDTH = int(os.getenv('RECEIPT_NUMBER_WIDTH', 3))
+
+# 卡號匯入工作：每批筆數、每次請求處理時間上限（秒，需小於 gunicorn timeout）、保留的錯誤列數
+IMPORT_JOB_CHUNK_SIZE = int(os.getenv('IMPORT_JOB_CHUNK_SIZE', 500))
+IMPORT_JOB_TIME_BUDGET = float(os.getenv('IMPORT_JOB_TIME_BUDGET', 10))
+IMPORT_JOB_MAX_ERROR_ROWS = int(os.getenv('IMPORT_JOB_MAX_ERROR_ROWS', 200))
+
 # 訂單狀態
 class OrderStatus(models.TextChoices):
     HOLDING = "HOLDING", "保留中"
@@ -67,6 +76,13 @@ class ReceiptType(models.TextChoices):
     ORDER = "ORDER", "訂單"
     MANUAL = "MANUAL", "手動"
 
+# 匯入工作狀態 ImportJobStatus
+class ImportJobStatus(models.TextChoices):
+    PENDING = "PENDING", "等待處理"
+    RUNNING = "RUNNING", "處理中"
+    COMPLETED = "COMPLETED", "已完成"
+    FAILED = "FAILED", "失敗"
+
 # 儲值類型 TopupType
 class TopupType(models.TextChoices):
     DEPOSIT = "DEPOSIT", "儲值"
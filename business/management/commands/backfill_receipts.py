@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from business.models import Order, Receipt
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '為尚未產生收據的歷史訂單補建收據'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--order',
+            type=str,
+            action='append',
+            help='指定訂單編號，可重複指定，預設為全部缺少收據的訂單'
+        )
+        
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='每批處理的訂單數，預設為500'
+        )
+        
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='只列出缺少收據的訂單數，不實際建立'
+        )
+    
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        
+        # 1. 找出缺少收據的訂單
+        orders = Order.objects.filter(receipts__isnull=True)
+        if options['order']:
+            orders = orders.filter(id__in=options['order'])
+        order_ids = list(orders.order_by('created_at', 'id').values_list('id', flat=True))
+        
+        self.stdout.write(f"缺少收據的訂單：{len(order_ids)} 筆")
+        if options['dry_run'] or not order_ids:
+            return
+        
+        # 2. 分批建立收據（每批一次保留收據編號、兩次 bulk_create）
+        created = 0
+        for start in range(0, len(order_ids), batch_size):
+            chunk = order_ids[start:start + batch_size]
+            receipts = Receipt.create_for_orders(
+                Order.objects.filter(id__in=chunk, receipts__isnull=True).order_by('created_at', 'id'),
+                batch_size=batch_size
+            )
+            created += len(receipts)
+            self.stdout.write(f"  已處理 {min(start + batch_size, len(order_ids))}/{len(order_ids)} 筆訂單")
+        
+        self.stdout.write(self.style.SUCCESS(f"✅ 已補建 {created} 張收據"))
+        logger.info(f"補建訂單收據完成，共 {created} 張")
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from business.models import Order
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '檢查訂單金額彙總（商品總額、商品數量、訂單總額）與訂單產品是否一致'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--order',
+            type=str,
+            action='append',
+            help='指定訂單編號，可重複指定，預設為全部訂單'
+        )
+        
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='只檢查不修正'
+        )
+    
+    def handle(self, *args, **options):
+        order_ids = options['order']
+        dry_run = options['dry_run']
+        
+        if order_ids:
+            self.stdout.write(f"開始檢查訂單金額彙總：訂單 {order_ids}")
+        else:
+            self.stdout.write("開始檢查所有訂單的金額彙總...")
+        
+        with transaction.atomic():
+            changed = Order.rebuild_totals(order_ids)
+            if dry_run:
+                transaction.set_rollback(True)
+        
+        if not changed:
+            self.stdout.write(self.style.SUCCESS("訂單金額彙總與訂單產品一致"))
+            return
+        
+        for order_id in changed[:20]:
+            self.stdout.write(f"  - 訂單 #{order_id}")
+        if len(changed) > 20:
+            self.stdout.write(f"  ...（共 {len(changed)} 筆）")
+        
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f"發現 {len(changed)} 筆訂單金額彙總偏差（未修正）"))
+        else:
+            self.stdout.write(self.style.WARNING(f"已修正 {len(changed)} 筆訂單金額彙總偏差"))
+        
+        logger.info(f"檢查訂單金額彙總完成，偏差 {len(changed)} 筆，{'未修正' if dry_run else '已修正'}")
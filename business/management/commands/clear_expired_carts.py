@@ -0,0 +1,19 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from business.cart import Cart
+from business.models import StoredCart
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '清除過期的伺服器端購物車（CART_STORE = db）'
+    
+    def handle(self, *args, **options):
+        expired_before = timezone.now() - timedelta(seconds=Cart.COOKIE_MAX_AGE)
+        deleted, _ = StoredCart.objects.filter(updated_at__lt=expired_before).delete()
+        
+        self.stdout.write(self.style.SUCCESS(f"✅ 已清除 {deleted} 個過期購物車"))
+        logger.info(f"清除過期購物車完成，共 {deleted} 個")
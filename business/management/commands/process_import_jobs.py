@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from business.constant import ImportJobStatus
+from business.models import ImportJob
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '處理尚未完成的卡號匯入工作（前端停止輪詢時由排程接續）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--job',
+            type=int,
+            action='append',
+            help='指定匯入工作 ID，可重複指定，預設為全部未完成的工作'
+        )
+    
+    def handle(self, *args, **options):
+        jobs = ImportJob.objects.filter(
+            status__in=[ImportJobStatus.PENDING, ImportJobStatus.RUNNING]
+        ).order_by('id')
+        if options['job']:
+            jobs = jobs.filter(id__in=options['job'])
+        
+        jobs = list(jobs)
+        if not jobs:
+            self.stdout.write("沒有未完成的匯入工作")
+            return
+        
+        for job in jobs:
+            # 不限時間，一次處理到結束
+            job.run(time_budget=float('inf'))
+            style = self.style.SUCCESS if job.status == ImportJobStatus.COMPLETED else self.style.WARNING
+            self.stdout.write(style(f"匯入工作 #{job.id}（{job.file_name}）{job.get_status_display()}：{job.message}"))
+            logger.info(f"匯入工作 #{job.id} 處理結束：{job.get_status_display()}")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from business.models import Order, OrderSearchTerm
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '重建訂單搜尋索引（OrderSearchTerm）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--order',
+            type=str,
+            action='append',
+            help='指定訂單編號，可重複指定，預設為全部訂單'
+        )
+        
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='每批處理的訂單數，預設為500'
+        )
+    
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['order']:
+            orders = orders.filter(id__in=options['order'])
+            self.stdout.write(f"開始重建訂單搜尋索引：訂單 {options['order']}")
+        else:
+            self.stdout.write("開始重建所有訂單的搜尋索引...")
+        
+        count = OrderSearchTerm.rebuild(orders, batch_size=options['batch_size'])
+        
+        self.stdout.write(self.style.SUCCESS(f"✅ 已重建 {count} 筆訂單的搜尋索引"))
+        logger.info(f"重建訂單搜尋索引完成，共 {count} 筆")
@@ -0,0 +1,27 @@
+from django.utils.functional import SimpleLazyObject, empty
+
+from business.cart import get_cart_store
+
+
+# 購物車 Middleware
+class CartMiddleware:
+    """
+    將購物車掛在 request.cart
+
+    - 延遲載入：只有實際使用購物車的請求才會讀取儲存後端，且每個請求只讀取一次
+    - 回應時若購物車有異動，統一透過 CartStore 寫回一次（見 settings.CART_STORE）
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.store = get_cart_store()
+
+    def __call__(self, request):
+        request.cart = SimpleLazyObject(lambda: self.store.load(request))
+
+        response = self.get_response(request)
+
+        cart = request.cart._wrapped
+        if cart is not empty and cart.modified:
+            self.store.save(request, response, cart)
+        return response
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:31
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_order_totals(apps, schema_editor):
+    """從現有訂單產品計算訂單金額彙總"""
+    Order = apps.get_model('business', 'Order')
+    OrderProduct = apps.get_model('business', 'OrderProduct')
+
+    lines = OrderProduct.objects.filter(
+        order=models.OuterRef('pk')
+    ).order_by().values('order')
+    amount = lines.annotate(
+        total=models.Sum(models.F('unit_price') * models.F('quantity'))
+    ).values('total')
+    quantity = lines.annotate(total=models.Sum('quantity')).values('total')
+
+    Order.objects.update(
+        items_amount=Coalesce(models.Subquery(amount), 0, output_field=models.DecimalField()),
+        items_quantity=Coalesce(models.Subquery(quantity), 0, output_field=models.IntegerField()),
+    )
+    Order.objects.update(
+        total_amount=models.F('items_amount') + Coalesce('shipping_fee', 0, output_field=models.DecimalField())
+    )
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0017_alter_order_order_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_amount',
+            field=models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='商品總額'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_quantity',
+            field=models.IntegerField(default=0, verbose_name='商品總數量'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='訂單總額(含運費)'),
+        ),
+        migrations.RunPython(populate_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_search_documents(apps, schema_editor):
+    """為現有訂單建立搜尋文件"""
+    Order = apps.get_model('business', 'Order')
+    OrderSearchDocument = apps.get_model('business', 'OrderSearchDocument')
+
+    orders = Order.objects.select_related('account').prefetch_related(
+        'order_products__variant'
+    ).order_by('pk')
+
+    documents = []
+    for order in orders.iterator(chunk_size=500):
+        account = order.account
+        parts = [order.id, account.username, account.fullname, account.company, order.remark]
+        for order_product in order.order_products.all():
+            parts.append(order_product.product_code)
+            if order_product.variant:
+                parts.append(order_product.variant.name)
+        content = '\n'.join((part or '').strip().lower() for part in parts if part)
+        documents.append(OrderSearchDocument(order_id=order.id, content=content))
+        if len(documents) >= 500:
+            OrderSearchDocument.objects.bulk_create(documents)
+            documents = []
+    OrderSearchDocument.objects.bulk_create(documents)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0018_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSearchDocument',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='business.order', verbose_name='訂單')),
+                ('content', models.TextField(blank=True, verbose_name='搜尋內容')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '訂單搜尋索引',
+                'verbose_name_plural': '訂單搜尋索引',
+            },
+        ),
+        migrations.RunPython(populate_search_documents, migrations.RunPython.noop),
+    ]
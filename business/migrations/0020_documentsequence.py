@@ -0,0 +1,28 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0019_ordersearchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=20, verbose_name='前綴')),
+                ('period', models.CharField(blank=True, max_length=20, verbose_name='期間')),
+                ('last_value', models.BigIntegerField(default=0, verbose_name='最後使用號碼')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '單據流水號',
+                'verbose_name_plural': '單據流水號',
+                'unique_together': {('prefix', 'period')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:35
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_receipt_totals(apps, schema_editor):
+    """從現有收據明細計算收據總額"""
+    Receipt = apps.get_model('business', 'Receipt')
+    ReceiptItem = apps.get_model('business', 'ReceiptItem')
+
+    amount = ReceiptItem.objects.filter(
+        receipt=models.OuterRef('pk')
+    ).order_by().values('receipt').annotate(
+        total=models.Sum(models.F('unit_price') * models.F('quantity'))
+    ).values('total')
+
+    Receipt.objects.update(
+        total_amount=Coalesce(models.Subquery(amount), 0, output_field=models.DecimalField())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0020_documentsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='收據總額'),
+        ),
+        migrations.RunPython(populate_receipt_totals, migrations.RunPython.noop),
+    ]
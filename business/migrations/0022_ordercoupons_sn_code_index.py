@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0021_receipt_total_amount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ordercoupons',
+            name='sn_code',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('business', '0022_ordercoupons_sn_code_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(blank=True, upload_to='imports/%Y%m%d/', verbose_name='匯入檔案')),
+                ('file_name', models.CharField(max_length=255, verbose_name='原始檔名')),
+                ('encoding', models.CharField(blank=True, max_length=20, verbose_name='檔案編碼')),
+                ('status', models.CharField(choices=[('PENDING', '等待處理'), ('RUNNING', '處理中'), ('COMPLETED', '已完成'), ('FAILED', '失敗')], default='PENDING', max_length=20, verbose_name='狀態')),
+                ('rows_processed', models.IntegerField(default=0, verbose_name='已讀取列數')),
+                ('chunks_processed', models.IntegerField(default=0, verbose_name='已處理批次')),
+                ('codes_imported', models.IntegerField(default=0, verbose_name='已匯入卡號數')),
+                ('updated_count', models.IntegerField(default=0, verbose_name='已變更卡號數')),
+                ('error_count', models.IntegerField(default=0, verbose_name='錯誤列數')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='錯誤列')),
+                ('last_coupon_id', models.IntegerField(default=0, verbose_name='最後分配的兌換碼 ID')),
+                ('message', models.TextField(blank=True, verbose_name='訊息')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完成時間')),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='建立人')),
+                ('order_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='business.orderproduct', verbose_name='訂單產品')),
+            ],
+            options={
+                'verbose_name': '匯入工作',
+                'verbose_name_plural': '匯入工作',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
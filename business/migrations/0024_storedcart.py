@@ -0,0 +1,26 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0023_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredCart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, unique=True, verbose_name='Token')),
+                ('data', models.JSONField(blank=True, default=dict, verbose_name='購物車內容')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': '購物車',
+                'verbose_name_plural': '購物車',
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.24 on 2026-10-16 20:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_allocations(apps, schema_editor):
+    """由既有訂單產品的 used_stocks 建立分配記錄（分配時間使用訂單產品建立時間）"""
+    OrderProduct = apps.get_model('business', 'OrderProduct')
+    StockAllocation = apps.get_model('business', 'StockAllocation')
+
+    batch = []
+    for order_product in OrderProduct.objects.exclude(used_stocks=[]).only(
+        'id', 'used_stocks', 'created_at'
+    ).iterator(chunk_size=500):
+        for entry in order_product.used_stocks or []:
+            if not isinstance(entry, dict) or not entry.get('stock_id'):
+                continue
+            batch.append(StockAllocation(
+                order_product_id=order_product.id,
+                stock_id=entry['stock_id'],
+                quantity=entry.get('deducted_quantity') or 0,
+                stock_quantity_before=entry.get('stock_quantity_before'),
+                allocated_at=order_product.created_at
+            ))
+        if len(batch) >= 500:
+            StockAllocation.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        StockAllocation.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_qr_content_store'),
+        ('business', '0024_storedcart'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='扣除數量')),
+                ('stock_quantity_before', models.IntegerField(blank=True, null=True, verbose_name='扣除前庫存')),
+                ('allocated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='分配時間')),
+                ('released_at', models.DateTimeField(blank=True, null=True, verbose_name='恢復時間')),
+                ('order_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='business.orderproduct', verbose_name='訂單產品')),
+                ('stock', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='allocations', to='products.stock', verbose_name='庫存')),
+            ],
+            options={
+                'verbose_name': '庫存分配記錄',
+                'verbose_name_plural': '庫存分配記錄',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['stock', 'released_at'], name='business_st_stock_i_89cbe9_idx'), models.Index(fields=['order_product', 'released_at'], name='business_st_order_p_7e2e46_idx'), models.Index(fields=['allocated_at'], name='business_st_allocat_8301c1_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_allocations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.24 on 2026-10-16 20:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0025_stockallocation'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='ordersearchdocument',
+            options={'verbose_name': '訂單搜尋文件', 'verbose_name_plural': '訂單搜尋文件'},
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.24 on 2026-10-16 20:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_order_and_variant(apps, schema_editor):
+    """由訂單產品補上既有分配記錄的訂單與變體 ID"""
+    StockAllocation = apps.get_model('business', 'StockAllocation')
+    OrderProduct = apps.get_model('business', 'OrderProduct')
+
+    StockAllocation.objects.filter(order__isnull=True).update(
+        order_id=models.Subquery(
+            OrderProduct.objects.filter(pk=models.OuterRef('order_product_id')).values('order_id')[:1]
+        ),
+        variant_id=models.Subquery(
+            OrderProduct.objects.filter(pk=models.OuterRef('order_product_id')).values('variant_id')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_qr_content_store'),
+        ('business', '0026_order_search_document_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockallocation',
+            name='order',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='stock_allocations', to='business.order', verbose_name='訂單'),
+        ),
+        migrations.AddField(
+            model_name='stockallocation',
+            name='variant',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='stock_allocations', to='products.variant', verbose_name='產品變體'),
+        ),
+        migrations.AlterField(
+            model_name='stockallocation',
+            name='order_product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='allocations', to='business.orderproduct', verbose_name='訂單產品'),
+        ),
+        migrations.RunPython(fill_order_and_variant, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-16 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0027_stock_allocation_keep_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='byte_offset',
+            field=models.BigIntegerField(default=0, verbose_name='已讀取位元組'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.24 on 2026-10-16 20:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_search_terms(apps, schema_editor):
+    """為現有訂單建立搜尋索引詞"""
+    from products.catalogue import tokenize
+
+    Order = apps.get_model('business', 'Order')
+    OrderSearchTerm = apps.get_model('business', 'OrderSearchTerm')
+
+    orders = Order.objects.select_related('account').prefetch_related(
+        'order_products__variant'
+    ).order_by('pk')
+
+    terms = []
+    for order in orders.iterator(chunk_size=500):
+        account = order.account
+        parts = [order.id, order.remark, account.username, account.fullname, account.company]
+        for order_product in order.order_products.all():
+            parts.append(order_product.product_code)
+            if order_product.variant:
+                parts.append(order_product.variant.name)
+        text = ' '.join(str(part) for part in parts if part)
+        terms.extend(
+            OrderSearchTerm(order_id=order.id, term=term)
+            for term in {term[:64] for term in tokenize(text)}
+        )
+        if len(terms) >= 5000:
+            OrderSearchTerm.objects.bulk_create(terms)
+            terms = []
+    OrderSearchTerm.objects.bulk_create(terms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0028_importjob_byte_offset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64, verbose_name='詞')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='business.order', verbose_name='訂單')),
+            ],
+            options={
+                'verbose_name': '訂單搜尋索引',
+                'verbose_name_plural': '訂單搜尋索引',
+            },
+        ),
+        migrations.DeleteModel(
+            name='OrderSearchDocument',
+        ),
+        migrations.AddConstraint(
+            model_name='ordersearchterm',
+            constraint=models.UniqueConstraint(fields=('term', 'order'), name='unique_order_search_term'),
+        ),
+        migrations.RunPython(populate_search_terms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.24 on 2026-10-16 20:31
+
+import os
+import shutil
+
+import business.storage
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_upload_files(apps, schema_editor):
+    """將未結束工作的上傳檔案由公開的 MEDIA_ROOT 移至 PRIVATE_MEDIA_ROOT"""
+    ImportJob = apps.get_model('business', 'ImportJob')
+
+    for name in ImportJob.objects.exclude(file='').values_list('file', flat=True):
+        source = os.path.join(settings.MEDIA_ROOT, name)
+        if not os.path.exists(source):
+            continue
+        target = os.path.join(settings.PRIVATE_MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(source, target)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0029_order_search_term'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importjob',
+            name='file',
+            field=models.FileField(blank=True, storage=business.storage.PrivateFileStorage(), upload_to='imports/%Y%m%d/', verbose_name='匯入檔案'),
+        ),
+        migrations.RunPython(move_upload_files, migrations.RunPython.noop),
+    ]
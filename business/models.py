@@ -1,15 +1,29 @@
+import io
 import os
+import csv
+import time
+import zipfile
+import tempfile
+import logging
+import threading
 import qrcode
+from itertools import islice
+from xml.etree import ElementTree
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.files import File
+from django.db import models, transaction, IntegrityError
 from products.models import Supplier, Category, Product, Variant, Stock
-from business.constant import OrderStatus, PaymentType, OrderSource, OrderProductStatus, ReceiptType, TopupType, IncomeItem, ExpenseItem, CUSTOM_CODE, CUSTOM_AUTH, SUBMIT_ORDER_TYPE, SUBMIT_ORDER_REPLY_TYPE, \
+from business.constant import OrderStatus, PaymentType, OrderSource, OrderProductStatus, ReceiptType, TopupType, IncomeItem, ExpenseItem, CUSTOM_CODE, CUSTOM_AUTH, SUBMIT_ORDER_TYPE, SUBMIT_ORDER_REPLY_TYPE, RECEIPT_NUMBER_PREFIX, RECEIPT_NUMBER_WIDTH, \
+    ImportJobStatus, IMPORT_JOB_CHUNK_SIZE, IMPORT_JOB_TIME_BUDGET, IMPORT_JOB_MAX_ERROR_ROWS, \
     SUBMIT_ORDER_REPLY_TYPE
-from business.utils import gen_order_tid, get_timestamp_by_datetime, sha1_encrypt
+from business.storage import PrivateFileStorage
+from business.utils import gen_order_tid, get_timestamp_by_datetime, sha1_encrypt, sniff_encoding, iter_csv_rows, iter_xlsx_rows
 from accounts.models import CustomUser
 from products.constant import ProductType
 from django.utils import timezone
 
+logger = logging.getLogger(__name__)
+
 
 # 訂單
 class Order(models.Model):
@@ -52,6 +66,20 @@ class Order(models.Model):
         blank=True, 
         default=0,
         verbose_name="運費")
+    # 訂單金額彙總（由訂單產品異動時維護，見 refresh_totals）
+    items_amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        default=0,
+        verbose_name="商品總額")
+    items_quantity = models.IntegerField(
+        default=0,
+        verbose_name="商品總數量")
+    total_amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        default=0,
+        verbose_name="訂單總額(含運費)")
     payment_type = models.CharField(
         max_length=50, 
         choices=PaymentType.choices, 
@@ -121,14 +149,77 @@ class Order(models.Model):
 
     @property
     def amount(self):
-        # 訂單總額
-        return sum([p.unit_price * p.quantity for p in self.order_products.all()])
+        # 訂單總額（不含運費）
+        return self.items_amount
 
-    @property
-    def total_amount(self):
-        # 訂單總額(含運費)
+    def save(self, *args, **kwargs):
+        # 訂單總額(含運費)隨商品總額與運費同步
         shipping = self.shipping_fee if self.shipping_fee is not None else 0
-        return self.amount + shipping
+        self.total_amount = (self.items_amount or 0) + shipping
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'shipping_fee' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'total_amount'}
+        super().save(*args, **kwargs)
+
+    def refresh_totals(self):
+        """
+        依訂單產品重新計算並儲存商品總額、商品數量與訂單總額
+
+        由 OrderProduct 的 post_save / post_delete signal 呼叫；
+        批次建立訂單產品（bulk_create）後由呼叫端直接呼叫一次。
+        """
+        totals = self.order_products.aggregate(
+            amount_sum=models.Sum(models.F('unit_price') * models.F('quantity')),
+            quantity_sum=models.Sum('quantity')
+        )
+        self.items_amount = totals['amount_sum'] or 0
+        self.items_quantity = totals['quantity_sum'] or 0
+        self.save(update_fields=['items_amount', 'items_quantity', 'total_amount', 'updated_at'])
+
+    @classmethod
+    def rebuild_totals(cls, order_ids=None):
+        """
+        從訂單產品完整重新計算訂單金額彙總（一致性檢查與修正）
+
+        Args:
+            order_ids: 指定訂單 ID 列表，None 表示全部
+
+        Returns:
+            list: 數值有偏差並已修正的訂單 ID
+        """
+        orders = cls.objects.all()
+        lines = OrderProduct.objects.all()
+        if order_ids is not None:
+            orders = orders.filter(id__in=order_ids)
+            lines = lines.filter(order_id__in=order_ids)
+
+        line_totals = {
+            row['order_id']: row
+            for row in lines.order_by().values('order_id').annotate(
+                amount_sum=models.Sum(models.F('unit_price') * models.F('quantity')),
+                quantity_sum=models.Sum('quantity')
+            )
+        }
+
+        changed = []
+        for order in orders.only('id', 'shipping_fee', 'items_amount', 'items_quantity', 'total_amount').iterator(chunk_size=2000):
+            totals = line_totals.get(order.id, {})
+            items_amount = totals.get('amount_sum') or 0
+            items_quantity = totals.get('quantity_sum') or 0
+            shipping = order.shipping_fee if order.shipping_fee is not None else 0
+            total_amount = items_amount + shipping
+            if (order.items_amount, order.items_quantity, order.total_amount) != (items_amount, items_quantity, total_amount):
+                order.items_amount = items_amount
+                order.items_quantity = items_quantity
+                order.total_amount = total_amount
+                changed.append(order)
+
+        cls.objects.bulk_update(
+            changed,
+            ['items_amount', 'items_quantity', 'total_amount'],
+            batch_size=500
+        )
+        return [order.id for order in changed]
 
     @property
     def order_time_stamp(self):
@@ -182,6 +273,287 @@ class OrderProduct(models.Model):
         # 訂單產品總額
         return self.unit_price * self.quantity
     
+# 庫存分配記錄
+class StockAllocation(models.Model):
+    """
+    庫存分配帳（訂單產品使用了哪些庫存，每筆 used_stocks 記錄一列）
+
+    與 OrderProduct.used_stocks 同時寫入，可用索引查詢「哪些訂單使用了某筆庫存」
+    或依供應商、時間區間對帳，不必載入並解析每個訂單產品的 JSON。
+    記錄只新增不刪除：恢復庫存時標記 released_at，訂單或訂單產品刪除後仍保留，
+    訂單、變體與庫存只保留 ID（不建立資料庫外鍵約束），與 used_stocks 的行為一致。
+    """
+    order_product = models.ForeignKey(
+        'OrderProduct',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='allocations',
+        verbose_name="訂單產品"
+    )
+    order = models.ForeignKey(
+        'Order',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='stock_allocations',
+        verbose_name="訂單"
+    )
+    variant = models.ForeignKey(
+        'products.Variant',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='stock_allocations',
+        verbose_name="產品變體"
+    )
+    stock = models.ForeignKey(
+        'products.Stock',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='allocations',
+        verbose_name="庫存"
+    )
+    quantity = models.PositiveIntegerField(verbose_name="扣除數量")
+    stock_quantity_before = models.IntegerField(null=True, blank=True, verbose_name="扣除前庫存")
+    allocated_at = models.DateTimeField(default=timezone.now, verbose_name="分配時間")
+    released_at = models.DateTimeField(null=True, blank=True, verbose_name="恢復時間")
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = "庫存分配記錄"
+        verbose_name_plural = "庫存分配記錄"
+        indexes = [
+            models.Index(fields=['stock', 'released_at']),  # 某筆庫存被哪些訂單使用
+            models.Index(fields=['order_product', 'released_at']),  # 訂單產品使用的庫存
+            models.Index(fields=['allocated_at']),  # 依時間區間對帳
+        ]
+
+    def __str__(self):
+        return f'{self.order_id} ← 庫存 {self.stock_id} x {self.quantity}'
+
+    @classmethod
+    def record(cls, order_products, allocated_at=None):
+        """
+        依訂單產品的 used_stocks 建立分配記錄（一次 bulk_create）
+
+        必須與扣除庫存在同一交易中呼叫。
+
+        Args:
+            order_products: 已寫入 used_stocks 的 OrderProduct 列表
+            allocated_at: 分配時間，預設為現在
+        """
+        allocated_at = allocated_at or timezone.now()
+        cls.objects.bulk_create(
+            [
+                cls(
+                    order_product=order_product,
+                    order_id=order_product.order_id,
+                    variant_id=order_product.variant_id,
+                    stock_id=entry['stock_id'],
+                    quantity=entry['deducted_quantity'],
+                    stock_quantity_before=entry.get('stock_quantity_before'),
+                    allocated_at=allocated_at
+                )
+                for order_product in order_products
+                for entry in (order_product.used_stocks or [])
+            ],
+            batch_size=500
+        )
+
+    @classmethod
+    def release(cls, order_products, released_at=None):
+        """
+        標記訂單產品的分配記錄為已恢復（記錄本身保留，之後刪除訂單產品也不會刪除）
+
+        Returns:
+            int: 更新筆數
+        """
+        return cls.objects.filter(
+            order_product__in=order_products,
+            released_at__isnull=True
+        ).update(released_at=released_at or timezone.now())
+
+    @classmethod
+    def used_stocks_for(cls, order_products):
+        """
+        由分配記錄取得訂單產品目前使用的庫存（格式同 used_stocks，一次查詢）
+
+        沒有任何分配記錄的訂單產品（例如尚未回填的舊資料）改用 used_stocks。
+
+        Returns:
+            dict: {order_product_id: used_stocks 列表}
+        """
+        order_products = list(order_products)
+        result = {order_product.id: [] for order_product in order_products}
+        recorded = set()
+
+        for allocation in cls.objects.filter(order_product__in=order_products).order_by('id'):
+            recorded.add(allocation.order_product_id)
+            if allocation.released_at is None:
+                result[allocation.order_product_id].append({
+                    'stock_id': allocation.stock_id,
+                    'deducted_quantity': allocation.quantity,
+                    'stock_quantity_before': allocation.stock_quantity_before,
+                })
+
+        for order_product in order_products:
+            if order_product.id not in recorded:
+                result[order_product.id] = list(order_product.used_stocks or [])
+        return result
+
+# 訂單搜尋索引
+class OrderSearchTerm(models.Model):
+    """
+    訂單搜尋索引（詞表）
+
+    將訂單編號、帳號、姓名、公司、備註、產品代碼與產品名稱斷詞，每個詞一列，
+    (詞, 訂單) 建有唯一索引，搜尋只查詢此索引，不掃描或關聯訂單、帳號與訂單產品：
+    - 英文與數字詞以前綴比對（例如訂單編號或產品代碼的開頭），
+      以索引範圍查詢 term >= 'jp3' AND term < 'jp4'
+    - 中文以單字與雙字建立索引，搜尋時以雙字完全比對，效果等同子字串比對
+    由 business.signals 在訂單與帳號異動時於交易提交後同步（同一交易內的多次異動只重建一次），
+    可用 rebuild_order_search 指令完整重建。
+    """
+    # 帳號中列入索引的欄位（只有這些欄位異動時才需要重建該帳號的訂單）
+    ACCOUNT_FIELDS = ('username', 'fullname', 'company')
+    TERM_MAX_LENGTH = 64
+
+    order = models.ForeignKey(
+        'Order',
+        on_delete=models.CASCADE,
+        related_name='search_terms',
+        verbose_name="訂單"
+    )
+    term = models.CharField(max_length=TERM_MAX_LENGTH, verbose_name="詞")
+
+    class Meta:
+        verbose_name = "訂單搜尋索引"
+        verbose_name_plural = "訂單搜尋索引"
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'order'], name='unique_order_search_term')
+        ]
+
+    def __str__(self):
+        return f"{self.term} - {self.order_id}"
+
+    @classmethod
+    def terms_for(cls, order):
+        """
+        訂單的索引詞（order 需已載入 account 與 order_products__variant）
+
+        Returns:
+            set: 小寫的詞，超過長度上限的詞截斷（前綴比對仍然有效）
+        """
+        from products.catalogue import tokenize
+
+        account = order.account
+        parts = [order.id, order.remark]
+        parts.extend(getattr(account, field) for field in cls.ACCOUNT_FIELDS)
+        for order_product in order.order_products.all():
+            parts.append(order_product.product_code)
+            if order_product.variant:
+                parts.append(order_product.variant.name)
+        text = ' '.join(str(part) for part in parts if part)
+        return {term[:cls.TERM_MAX_LENGTH] for term in tokenize(text)}
+
+    @classmethod
+    def rebuild(cls, orders, batch_size=500):
+        """
+        重建指定訂單的索引詞
+
+        Args:
+            orders: Order QuerySet
+            batch_size: 每批處理的訂單數
+
+        Returns:
+            int: 重建的訂單數量
+        """
+        orders = orders.select_related('account').prefetch_related(
+            'order_products__variant'
+        ).order_by('pk')
+
+        count = 0
+        batch = []
+        for order in orders.iterator(chunk_size=batch_size):
+            batch.append(order)
+            if len(batch) >= batch_size:
+                count += cls._save_terms(batch)
+                batch = []
+        if batch:
+            count += cls._save_terms(batch)
+        return count
+
+    @classmethod
+    def _save_terms(cls, orders):
+        with transaction.atomic():
+            cls.objects.filter(order_id__in=[order.pk for order in orders]).delete()
+            cls.objects.bulk_create(
+                [cls(order_id=order.pk, term=term) for order in orders for term in cls.terms_for(order)],
+                batch_size=1000
+            )
+        return len(orders)
+
+    # 各執行緒（資料庫連線）待重建的訂單 ID
+    _pending = threading.local()
+
+    @classmethod
+    def schedule_rebuild(cls, order_ids):
+        """
+        於交易提交後重建訂單的索引詞（同一交易內重複排程的訂單只重建一次）
+
+        不在交易中時立即重建。
+
+        Args:
+            order_ids: 訂單 ID 列表
+        """
+        pending = getattr(cls._pending, 'order_ids', None)
+        if pending is None:
+            pending = cls._pending.order_ids = set()
+        pending.update(order_ids)
+        transaction.on_commit(cls._rebuild_pending)
+
+    @classmethod
+    def _rebuild_pending(cls, batch_size=500):
+        # 第一個提交回呼重建全部待處理訂單，其餘回呼取得空集合直接返回
+        order_ids = getattr(cls._pending, 'order_ids', None)
+        if not order_ids:
+            return
+        cls._pending.order_ids = set()
+        order_ids = sorted(order_ids)
+        for start in range(0, len(order_ids), batch_size):
+            cls.rebuild(Order.objects.filter(pk__in=order_ids[start:start + batch_size]), batch_size)
+
+    @classmethod
+    def search(cls, query):
+        """
+        搜尋訂單（所有詞都要符合；英文與數字詞為前綴比對，中文為雙字比對）
+
+        Args:
+            query: 搜尋字串
+
+        Returns:
+            QuerySet: 符合的訂單 ID（可直接用於 id__in）
+        """
+        from products.catalogue import query_terms
+
+        matched = None
+        for term, partial in query_terms(query):
+            term = term[:cls.TERM_MAX_LENGTH]
+            if partial:
+                # 前綴比對改寫為範圍查詢（LIKE 'x%' 在 SQLite 無法使用索引）
+                condition = models.Q(term__gte=term, term__lt=term[:-1] + chr(ord(term[-1]) + 1))
+            else:
+                condition = models.Q(term=term)
+            order_ids = cls.objects.filter(condition).values('order_id')
+            matched = order_ids if matched is None else order_ids.filter(order_id__in=matched)
+
+        if matched is None:
+            return cls.objects.none().values('order_id')
+        return matched
+
 # 訂單兌換二維碼
 class OrderCoupons(models.Model):
     id = models.AutoField(primary_key=True)
@@ -193,7 +565,7 @@ class OrderCoupons(models.Model):
         verbose_name="關聯訂單產品"
     )
     sn_pin = models.CharField(max_length=255, null=True, blank=True)
-    sn_code = models.CharField(max_length=255, null=True, blank=True)
+    sn_code = models.CharField(max_length=255, null=True, blank=True, db_index=True)
     product_expire_date = models.DateTimeField(null=True, blank=True, verbose_name="產品過期時間")
     # product = models.ForeignKey('products.Variant', on_delete=models.CASCADE)
     trans_id = models.CharField(max_length=255, null=True, blank=True)
@@ -207,6 +579,461 @@ class OrderCoupons(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(default=timezone.now)
 
+    # sn_code__in 每批查詢的卡號數
+    lookup_chunk_size = 500
+
+    @classmethod
+    def find_existing_sn_codes(cls, sn_codes, queryset=None):
+        """
+        一次找出已被使用的卡號（分批以 sn_code__in 查詢）
+
+        Args:
+            sn_codes: 卡號列表
+            queryset: 比對範圍，預設為全部兌換碼（例如排除即將覆寫的兌換碼）
+
+        Returns:
+            set: 已存在的卡號
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        sn_codes = list({code for code in sn_codes if code})
+
+        existing = set()
+        for start in range(0, len(sn_codes), cls.lookup_chunk_size):
+            existing.update(
+                queryset.filter(
+                    sn_code__in=sn_codes[start:start + cls.lookup_chunk_size]
+                ).values_list('sn_code', flat=True)
+            )
+        return existing
+
+    @staticmethod
+    def find_repeated_sn_codes(sn_codes):
+        """
+        找出列表中重複出現的卡號（保留首次重複的順序）
+        """
+        seen = set()
+        repeated = {}
+        for code in sn_codes:
+            if not code:
+                continue
+            if code in seen:
+                repeated.setdefault(code, None)
+            seen.add(code)
+        return list(repeated)
+
+
+# 卡號匯入工作
+class ImportJob(models.Model):
+    """
+    充值卡卡號匯入工作（CSV / XLSX）
+
+    上傳檔案先存於私有儲存（PRIVATE_MEDIA_ROOT，不經由 MEDIA_URL 提供），工作結束時刪除，
+    再以固定筆數分批串流讀取、驗證並寫入：
+    1. 每批在同一個交易內寫入卡號並更新進度，中斷後由下一批的位元組位置（byte_offset）
+       直接 seek 繼續讀取；XLSX 是壓縮的 XML，無法從中間開始解析，
+       第一次處理時先整份串流轉為 UTF-8 CSV（只解析一次），之後與 CSV 相同方式接續
+    2. 每次處理有時間上限（IMPORT_JOB_TIME_BUDGET），未完成的部分由輪詢端點
+       或 process_import_jobs 指令繼續處理
+    3. 驗證失敗的列記錄於 errors（最多 IMPORT_JOB_MAX_ERROR_ROWS 筆），其餘列照常匯入
+    """
+    HEADER_KEYWORDS = ('序號', '卡號', 'sn_code', 'sequence')
+
+    order_product = models.ForeignKey(
+        'OrderProduct',
+        on_delete=models.CASCADE,
+        related_name='import_jobs',
+        verbose_name="訂單產品"
+    )
+    file = models.FileField(
+        upload_to='imports/%Y%m%d/',
+        storage=PrivateFileStorage(),
+        blank=True,
+        verbose_name="匯入檔案"
+    )
+    file_name = models.CharField(max_length=255, verbose_name="原始檔名")
+    encoding = models.CharField(max_length=20, blank=True, verbose_name="檔案編碼")
+    status = models.CharField(
+        max_length=20,
+        choices=ImportJobStatus.choices,
+        default=ImportJobStatus.PENDING,
+        verbose_name="狀態"
+    )
+    rows_processed = models.IntegerField(default=0, verbose_name="已讀取列數")
+    # 下一批的起始位元組位置（XLSX 為轉換後的 CSV 檔案中的位置）
+    byte_offset = models.BigIntegerField(default=0, verbose_name="已讀取位元組")
+    chunks_processed = models.IntegerField(default=0, verbose_name="已處理批次")
+    codes_imported = models.IntegerField(default=0, verbose_name="已匯入卡號數")
+    updated_count = models.IntegerField(default=0, verbose_name="已變更卡號數")
+    error_count = models.IntegerField(default=0, verbose_name="錯誤列數")
+    # 格式：[{'row': 3, 'sn_code': 'ABC123', 'error': '卡號重複'}, ...]
+    errors = models.JSONField(default=list, blank=True, verbose_name="錯誤列")
+    # 已分配卡號的最後一個兌換碼（依 ID 順序分配）
+    last_coupon_id = models.IntegerField(default=0, verbose_name="最後分配的兌換碼 ID")
+    message = models.TextField(blank=True, verbose_name="訊息")
+    created_by = models.ForeignKey(
+        'accounts.CustomUser',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='import_jobs',
+        verbose_name="建立人"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="完成時間")
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "匯入工作"
+        verbose_name_plural = "匯入工作"
+
+    def __str__(self):
+        return f"{self.file_name} - {self.get_status_display()}"
+
+    @property
+    def is_finished(self):
+        return self.status in (ImportJobStatus.COMPLETED, ImportJobStatus.FAILED)
+
+    @property
+    def is_xlsx(self):
+        """上傳的原始檔案是否為 XLSX"""
+        return self.file_name.lower().endswith('.xlsx')
+
+    @property
+    def needs_conversion(self):
+        """儲存的檔案是否仍為尚未轉換為 CSV 的 XLSX"""
+        return self.file.name.lower().endswith('.xlsx')
+
+    @classmethod
+    def create_for_upload(cls, order_product, uploaded_file, user=None):
+        """
+        儲存上傳檔案並建立匯入工作（CSV 只讀取開頭樣本判斷編碼）
+
+        Args:
+            order_product: 訂單產品
+            uploaded_file: 上傳的檔案
+            user: 建立人
+
+        Returns:
+            ImportJob
+        """
+        job = cls(
+            order_product=order_product,
+            file_name=uploaded_file.name,
+            created_by=user
+        )
+        if not job.is_xlsx:
+            job.encoding = sniff_encoding(uploaded_file)
+        job.file.save(uploaded_file.name, uploaded_file, save=False)
+        job.save()
+        return job
+
+    def to_dict(self):
+        """輪詢端點回傳的進度資料"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'status_display': self.get_status_display(),
+            'finished': self.is_finished,
+            'file_name': self.file_name,
+            'rows_processed': self.rows_processed,
+            'chunks_processed': self.chunks_processed,
+            'codes_imported': self.codes_imported,
+            'updated_count': self.updated_count,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'message': self.message,
+        }
+
+    def run(self, time_budget=IMPORT_JOB_TIME_BUDGET, chunk_size=IMPORT_JOB_CHUNK_SIZE):
+        """
+        分批處理匯入工作，直到檔案讀取完畢或用完時間上限
+
+        每次至少處理一批，因此重複呼叫一定會有進度。
+
+        Args:
+            time_budget: 時間上限（秒）
+            chunk_size: 每批列數
+
+        Returns:
+            bool: 工作是否已結束（完成或失敗）
+        """
+        if self.is_finished:
+            return True
+
+        deadline = time.monotonic() + time_budget
+        try:
+            if self.needs_conversion:
+                self._convert_xlsx()
+            with self.file.open('rb') as fileobj:
+                reached_end = self._process(fileobj, deadline, chunk_size)
+        except (OSError, ValueError, csv.Error, zipfile.BadZipFile, ElementTree.ParseError) as e:
+            # ValueError 包含 UnicodeDecodeError（編碼判斷錯誤或檔案損壞）
+            logger.warning(f'匯入工作 #{self.id} 讀取檔案失敗：{str(e)}')
+            self._finalize(ImportJobStatus.FAILED, f'檔案讀取失敗：{str(e)}')
+            return True
+
+        if reached_end:
+            if self.codes_imported == 0 and self.error_count == 0:
+                self._finalize(ImportJobStatus.FAILED, '檔案中沒有有效的卡號')
+            else:
+                self._finalize(
+                    ImportJobStatus.COMPLETED,
+                    f'成功匯入 {self.codes_imported} 個卡號，更新 {self.updated_count} 筆'
+                    + (f'，{self.error_count} 列錯誤' if self.error_count else '')
+                )
+        return self.is_finished
+
+    def _process(self, fileobj, deadline, chunk_size):
+        """
+        串流讀取並分批寫入
+
+        Returns:
+            bool: 是否由此次處理讀取到檔案結尾
+        """
+        # 1. 接續先前的進度：直接移到下一批的位置
+        fileobj.seek(self.byte_offset)
+        rows = iter_csv_rows(fileobj, self.encoding or 'utf-8')
+
+        # 2. 分批處理
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return True
+            if not self._apply_chunk(chunk, fileobj.tell()):
+                # 其他請求已接手處理此工作
+                return False
+            if time.monotonic() >= deadline:
+                return False
+
+    def _convert_xlsx(self):
+        """
+        將 XLSX 串流轉為 UTF-8 CSV 並取代儲存的檔案（每個工作只轉換一次）
+
+        其他請求已先完成轉換時，捨棄此次的結果並改用資料庫中的檔案。
+        """
+        xlsx_name = self.file.name
+        with tempfile.TemporaryFile() as converted:
+            text = io.TextIOWrapper(converted, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            with self.file.open('rb') as source:
+                for row in iter_xlsx_rows(source):
+                    writer.writerow(row)
+            text.flush()
+            text.detach()
+            converted.seek(0)
+            csv_name = self.file.storage.save(
+                f'{os.path.splitext(xlsx_name)[0]}.csv', File(converted)
+            )
+
+        updated = ImportJob.objects.filter(pk=self.pk, file=xlsx_name).update(
+            file=csv_name, encoding='utf-8', updated_at=timezone.now()
+        )
+        if updated:
+            self.file.storage.delete(xlsx_name)
+            self.file = csv_name
+            self.encoding = 'utf-8'
+            logger.info(f'匯入工作 #{self.id} 已將 XLSX 轉換為 CSV')
+        else:
+            self.file.storage.delete(csv_name)
+            self.refresh_from_db()
+
+    def parse_row(self, row, row_num):
+        """
+        由單列取出卡號（支援「序號,卡號」或「卡號」兩種格式，第一列若為標題則略過）
+
+        Returns:
+            str: 卡號，空白列或標題列為空字串
+        """
+        if not row or not any(str(value).strip() for value in row):
+            return ''
+        if row_num == 1 and any(keyword in str(row).lower() for keyword in self.HEADER_KEYWORDS):
+            return ''
+        return str(row[1] if len(row) >= 2 else row[0]).strip()
+
+    def _apply_chunk(self, rows, byte_offset=0):
+        """
+        驗證並寫入一批資料列，並在同一交易內更新進度
+
+        Args:
+            rows: 原始資料列
+            byte_offset: 下一批的起始位元組位置（CSV）
+
+        Returns:
+            bool: False 表示進度已被其他請求更新，此批未處理
+        """
+        with transaction.atomic():
+            # 確認進度未被其他請求更新（避免重複處理同一批）
+            current = ImportJob.objects.select_for_update().get(pk=self.pk)
+            if current.rows_processed != self.rows_processed or current.is_finished:
+                self.refresh_from_db()
+                return False
+
+            errors = []
+
+            # 1. 取出卡號並檢查本批內重複
+            codes = []
+            seen = set()
+            for offset, row in enumerate(rows):
+                row_num = self.rows_processed + offset + 1
+                sn_code = self.parse_row(row, row_num)
+                if not sn_code:
+                    continue
+                if sn_code in seen:
+                    errors.append({'row': row_num, 'sn_code': sn_code, 'error': '檔案內卡號重複'})
+                    continue
+                seen.add(sn_code)
+                codes.append((row_num, sn_code))
+
+            # 2. 與現有卡號重複（其他兌換碼，或本檔案先前批次已寫入的卡號）
+            existing = OrderCoupons.find_existing_sn_codes(
+                [sn_code for _, sn_code in codes],
+                queryset=OrderCoupons.objects.exclude(
+                    order_product_id=self.order_product_id,
+                    id__gt=self.last_coupon_id
+                )
+            )
+            valid = []
+            for row_num, sn_code in codes:
+                if sn_code in existing:
+                    errors.append({'row': row_num, 'sn_code': sn_code, 'error': '卡號已存在或檔案內重複'})
+                else:
+                    valid.append((row_num, sn_code))
+
+            # 3. 依 ID 順序分配到尚未分配的兌換碼
+            coupons = list(
+                OrderCoupons.objects.filter(
+                    order_product_id=self.order_product_id,
+                    id__gt=self.last_coupon_id
+                ).order_by('id')[:len(valid)]
+            )
+            for row_num, sn_code in valid[len(coupons):]:
+                errors.append({'row': row_num, 'sn_code': sn_code, 'error': '卡號數量超過訂單產品數量'})
+
+            now = timezone.now()
+            changed = []
+            for coupon, (_, sn_code) in zip(coupons, valid):
+                if coupon.sn_code != sn_code:
+                    coupon.sn_code = sn_code
+                    coupon.updated_at = now
+                    changed.append(coupon)
+            OrderCoupons.objects.bulk_update(changed, ['sn_code', 'updated_at'], batch_size=500)
+
+            # 4. 更新進度
+            self.status = ImportJobStatus.RUNNING
+            self.rows_processed += len(rows)
+            self.byte_offset = byte_offset
+            self.chunks_processed += 1
+            self.codes_imported += len(coupons)
+            self.updated_count += len(changed)
+            self.error_count += len(errors)
+            self.errors = (self.errors + errors)[:IMPORT_JOB_MAX_ERROR_ROWS]
+            if coupons:
+                self.last_coupon_id = coupons[-1].id
+            self.save(update_fields=[
+                'status', 'rows_processed', 'byte_offset', 'chunks_processed', 'codes_imported',
+                'updated_count', 'error_count', 'errors', 'last_coupon_id', 'updated_at'
+            ])
+
+        logger.info(
+            f'匯入工作 #{self.id} 第 {self.chunks_processed} 批完成：'
+            f'已讀取 {self.rows_processed} 列，匯入 {self.codes_imported} 個卡號，錯誤 {self.error_count} 列'
+        )
+        return True
+
+    def _finalize(self, status, message):
+        """結束工作並刪除暫存的上傳檔案"""
+        if self.file:
+            self.file.delete(save=False)
+        self.status = status
+        self.message = message
+        self.finished_at = timezone.now()
+        self.save(update_fields=['file', 'status', 'message', 'finished_at', 'updated_at'])
+        logger.info(f'匯入工作 #{self.id} {self.get_status_display()}：{message}')
+
+
+# 伺服器端購物車
+class StoredCart(models.Model):
+    """
+    伺服器端購物車（CART_STORE = 'db' 時使用）
+
+    cookie 只存放 token，內容格式與 business.cart.Cart.data 相同。
+    """
+    token = models.CharField(max_length=64, unique=True, verbose_name="Token")
+    data = models.JSONField(default=dict, blank=True, verbose_name="購物車內容")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name = "購物車"
+        verbose_name_plural = "購物車"
+
+    def __str__(self):
+        return f"{self.token} - {len(self.data)} 項商品"
+
+
+# 單據流水號
+class DocumentSequence(models.Model):
+    """
+    單據流水號計數器
+
+    每個 (前綴, 期間) 一筆，以 F() 原子遞增取號，不需查詢既有單據的最大編號，
+    並行取號不會重複。支援一次保留多個號碼（批次建立單據時使用）。
+    """
+    prefix = models.CharField(max_length=20, verbose_name="前綴")
+    period = models.CharField(max_length=20, blank=True, verbose_name="期間")  # 例如：20251118
+    last_value = models.BigIntegerField(default=0, verbose_name="最後使用號碼")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "單據流水號"
+        verbose_name_plural = "單據流水號"
+        unique_together = ('prefix', 'period')
+
+    def __str__(self):
+        return f"{self.prefix}{self.period} - {self.last_value}"
+
+    @classmethod
+    def allocate(cls, prefix, period='', count=1, seed=None):
+        """
+        保留連續的流水號
+
+        先以 UPDATE 遞增（同時取得資料列鎖），再讀回結果，因此並行取號不會重複。
+
+        Args:
+            prefix: 前綴
+            period: 期間
+            count: 保留數量
+            seed: 計數器不存在時呼叫，回傳目前已使用的最大號碼（用於銜接既有單據）
+
+        Returns:
+            range: 保留的號碼
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(prefix=prefix, period=period).update(
+                last_value=models.F('last_value') + count,
+                updated_at=timezone.now()
+            )
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(
+                            prefix=prefix,
+                            period=period,
+                            last_value=(seed() if seed else 0) + count
+                        )
+                except IntegrityError:
+                    # 其他交易已建立計數器，改為遞增
+                    cls.objects.filter(prefix=prefix, period=period).update(
+                        last_value=models.F('last_value') + count,
+                        updated_at=timezone.now()
+                    )
+
+            last_value = cls.objects.filter(
+                prefix=prefix, period=period
+            ).values_list('last_value', flat=True).get()
+
+        return range(last_value - count + 1, last_value + 1)
+
 
 # 收據
 class Receipt(models.Model):
@@ -257,6 +1084,13 @@ class Receipt(models.Model):
         blank=True,
         verbose_name="備註"
     )
+    # 收據總金額（由收據明細異動時維護，見 refresh_total）
+    total_amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        default=0,
+        verbose_name="收據總額"
+    )
     created_by = models.ForeignKey(
         'accounts.CustomUser',
         on_delete=models.SET_NULL,
@@ -275,70 +1109,156 @@ class Receipt(models.Model):
     def __str__(self):
         return f"{self.receipt_number} - {self.receipt_to or '（無抬頭）'}"
     
-    @property
-    def total_amount(self):
-        """收據總金額"""
-        return sum(item.subtotal for item in self.items.all())
-    
     @property
     def item_count(self):
         """收據項目數"""
         return self.items.count()
     
-    def generate_receipt_number(self):
+    @classmethod
+    def allocate_receipt_numbers(cls, count=1, date=None):
         """
-        自動生成收據編號
-        格式：R + YYYYMMDD + 流水號（3位）
+        保留收據編號
+        格式：R + YYYYMMDD + 流水號（至少 RECEIPT_NUMBER_WIDTH 位）
         例如：R20251118001
+
+        Args:
+            count: 保留數量
+            date: 收據編號日期，預設為今天（本地時區）
+
+        Returns:
+            list: 收據編號列表
         """
-        from django.utils import timezone
-        from datetime import datetime
-        
-        today = timezone.now().date()
-        date_str = today.strftime('%Y%m%d')
-        
-        # 查詢今日最後一筆收據編號
-        last_receipt = Receipt.objects.filter(
-            receipt_number__startswith=f'R{date_str}'
-        ).order_by('-receipt_number').first()
-        
-        if last_receipt:
-            # 取得最後的流水號並 +1
-            last_number = int(last_receipt.receipt_number[-3:])
-            new_number = last_number + 1
-        else:
-            new_number = 1
-        
-        return f'R{date_str}{new_number:03d}'
+        date_str = (date or timezone.localdate()).strftime('%Y%m%d')
+        prefix = f'{RECEIPT_NUMBER_PREFIX}{date_str}'
+
+        def seed():
+            # 計數器建立前已存在的收據（例如舊版編號），從最大流水號接續
+            numbers = cls.objects.filter(
+                receipt_number__startswith=prefix
+            ).values_list('receipt_number', flat=True)
+            return max(
+                (int(number[len(prefix):]) for number in numbers if number[len(prefix):].isdigit()),
+                default=0
+            )
+
+        values = DocumentSequence.allocate(RECEIPT_NUMBER_PREFIX, date_str, count, seed=seed)
+        return [f'{prefix}{value:0{RECEIPT_NUMBER_WIDTH}d}' for value in values]
+
+    def refresh_total(self):
+        """
+        依收據明細重新計算並儲存收據總額
+
+        由 ReceiptItem 的 post_save / post_delete signal 呼叫。
+        """
+        self.total_amount = self.items.aggregate(
+            amount_sum=models.Sum(models.F('unit_price') * models.F('quantity'))
+        )['amount_sum'] or 0
+        self.save(update_fields=['total_amount', 'updated_at'])
+
+    @classmethod
+    def create_for_orders(cls, orders, batch_size=500):
+        """
+        批次為訂單建立收據與收據明細（含運費）
+
+        查詢數不隨訂單產品數增加：
+        1. 一次預先載入訂單帳號與訂單產品（含變體、產品）
+        2. 一次保留所有收據編號
+        3. bulk_create 收據主表（總額於記憶體中計算）
+        4. bulk_create 所有收據明細
+
+        Args:
+            orders: 訂單 QuerySet
+            batch_size: bulk_create 每批筆數
+
+        Returns:
+            list: 已建立的收據
+        """
+        orders = list(
+            orders.select_related('account').prefetch_related(
+                models.Prefetch(
+                    'order_products',
+                    queryset=OrderProduct.objects.select_related('variant__product').order_by('id')
+                )
+            )
+        )
+        if not orders:
+            return []
+
+        with transaction.atomic():
+            receipt_numbers = cls.allocate_receipt_numbers(len(orders))
+
+            receipts = []
+            items_by_receipt = []
+            for order, receipt_number in zip(orders, receipt_numbers):
+                items = cls._build_order_items(order)
+                account = order.account
+                receipts.append(cls(
+                    order=order,
+                    receipt_number=receipt_number,
+                    receipt_to=account.company or account.fullname or account.username,
+                    taxid=account.tax_id or '',
+                    date=timezone.localtime(order.created_at).date(),
+                    remark=f'訂單 #{order.id}',
+                    created_by_id=order.created_by_id,
+                    receipt_type=ReceiptType.ORDER,
+                    total_amount=sum(item.subtotal for item in items),
+                ))
+                items_by_receipt.append(items)
+
+            cls.objects.bulk_create(receipts, batch_size=batch_size)
+
+            receipt_items = []
+            for receipt, items in zip(receipts, items_by_receipt):
+                for item in items:
+                    item.receipt = receipt
+                    receipt_items.append(item)
+            ReceiptItem.objects.bulk_create(receipt_items, batch_size=batch_size)
+
+        return receipts
+
+    @staticmethod
+    def _build_order_items(order):
+        """
+        由訂單產品（與運費）建立未儲存的收據明細
+        """
+        items = []
+        for order_product in order.order_products.all():
+            if order_product.variant:
+                product_name = f"{order_product.variant.product.name} - {order_product.variant.name}"
+            else:
+                product_name = f"產品代碼: {order_product.product_code}"
+
+            items.append(ReceiptItem(
+                order_product=order_product,
+                product_name=product_name,
+                product_code=order_product.product_code or '',
+                quantity=order_product.quantity,
+                unit_price=order_product.unit_price
+            ))
+
+        # 如果有運費，也加入收據明細
+        if order.shipping_fee and order.shipping_fee > 0:
+            items.append(ReceiptItem(
+                order_product=None,
+                product_name='運費',
+                product_code='SHIPPING',
+                quantity=1,
+                unit_price=order.shipping_fee
+            ))
+        return items
+
+    def generate_receipt_number(self):
+        """
+        自動生成收據編號（見 allocate_receipt_numbers）
+        """
+        return self.allocate_receipt_numbers()[0]
     
     def save(self, *args, **kwargs):
         """
         儲存前自動生成收據編號（如果沒有）
         """
         if not self.receipt_number:
-            from django.utils import timezone
-            from django.db.models import Max
-            
-            # 獲取今天的日期
-            today = timezone.now().date()
-            date_str = today.strftime('%Y%m%d')
-            
-            # 查找今天最大的流水號
-            max_receipt = Receipt.objects.filter(
-                receipt_number__startswith=f'R{date_str}'
-            ).aggregate(
-                max_number=Max('receipt_number')
-            )['max_number']
-            
-            if max_receipt:
-                # 提取流水號並加 1
-                last_seq = int(max_receipt[-3:])
-                new_seq = last_seq + 1
-            else:
-                new_seq = 1
-            
-            # 生成新的收據編號
-            self.receipt_number = f'R{date_str}{new_seq:03d}'
+            self.receipt_number = self.generate_receipt_number()
         
         super().save(*args, **kwargs)
 
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.db import transaction
-from business.models import Order, Receipt, ReceiptItem
+from business.models import Order, OrderProduct, OrderSearchTerm, Receipt, ReceiptItem
+from accounts.models import CustomUser
 from business.constant import OrderStatus, ReceiptType
 import logging
 
@@ -21,68 +22,111 @@ def create_receipt_for_order(sender, instance, created, **kwargs):
     if created:
         def create_receipt():
             try:
-                # 獲取訂單帳號的統一編號（優先使用 tax_id）
-                taxid = ''
-                if hasattr(instance.account, 'tax_id') and instance.account.tax_id:
-                    taxid = instance.account.tax_id
-                
-                # 1. 建立收據主表
-                receipt = Receipt.objects.create(
-                    order=instance,
-                    receipt_to=instance.account.company or instance.account.fullname or instance.account.username,
-                    taxid=taxid,
-                    date=instance.created_at.date(),
-                    remark=f'訂單 #{instance.id}',
-                    created_by=instance.created_by,
-                    receipt_type=ReceiptType.ORDER
-                )
-                
-                logger.info(
-                    f'自動建立收據：{receipt.receipt_number}（訂單 #{instance.id}），'
-                    f'類型：{receipt.get_receipt_type_display()}，'
-                    f'抬頭：{receipt.receipt_to}，'
-                    f'統編：{taxid or "無"}'
-                )
-                
-                # 2. 建立收據明細（從訂單產品）
-                created_count = 0
-                for order_product in instance.order_products.all():
-                    # 獲取產品名稱
-                    if order_product.variant:
-                        product_name = f"{order_product.variant.product.name} - {order_product.variant.name}"
-                    else:
-                        product_name = f"產品代碼: {order_product.product_code}"
-                    
-                    ReceiptItem.objects.create(
-                        receipt=receipt,
-                        order_product=order_product,
-                        product_name=product_name,
-                        product_code=order_product.product_code or '',
-                        quantity=order_product.quantity,
-                        unit_price=order_product.unit_price
-                    )
-                    created_count += 1
-                
-                # 3. 如果有運費，也加入收據明細
-                if instance.shipping_fee and instance.shipping_fee > 0:
-                    ReceiptItem.objects.create(
-                        receipt=receipt,
-                        order_product=None,
-                        product_name='運費',
-                        product_code='SHIPPING',
-                        quantity=1,
-                        unit_price=instance.shipping_fee
+                # 預先載入訂單產品並批次建立收據與明細（含運費）
+                receipts = Receipt.create_for_orders(Order.objects.filter(pk=instance.pk))
+                for receipt in receipts:
+                    logger.info(
+                        f'自動建立收據：{receipt.receipt_number}（訂單 #{instance.id}），'
+                        f'類型：{receipt.get_receipt_type_display()}，'
+                        f'抬頭：{receipt.receipt_to}，'
+                        f'統編：{receipt.taxid or "無"}，'
+                        f'總額：${receipt.total_amount:,.0f}'
                     )
-                    created_count += 1
-                    logger.info(f'添加運費項目：${instance.shipping_fee}')
-                
-                logger.info(
-                    f'收據 {receipt.receipt_number} 建立了 {created_count} 筆明細，'
-                    f'總額：${receipt.total_amount:,.0f}'
-                )
                 
             except Exception as e:
                 logger.error(f'自動建立收據失敗：{str(e)}', exc_info=True)
         
         # ✅ 在 transaction 提交後才執行（確保 OrderProduct 都已創建）
-        transaction.on_commit(create_receipt)
\ No newline at end of file
+        transaction.on_commit(create_receipt)
+
+
+@receiver(post_save, sender=OrderProduct)
+@receiver(post_delete, sender=OrderProduct)
+def update_order_totals_on_order_product_change(sender, instance, **kwargs):
+    """
+    訂單產品建立、修改或刪除時，重新計算訂單金額彙總
+    
+    訂單本身被刪除時（級聯刪除訂單產品）不需重新計算；
+    只更新數量與單價以外欄位（例如 used_stocks）時也不需重新計算。
+    批次建立（bulk_create）不會觸發此 signal，由呼叫端寫入後呼叫一次 Order.refresh_totals。
+    """
+    if isinstance(kwargs.get('origin'), Order):
+        return
+    
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'quantity', 'unit_price', 'order'} & set(update_fields):
+        return
+    
+    if OrderProduct.order.is_cached(instance):
+        order = instance.order
+    else:
+        order = Order.objects.filter(pk=instance.order_id).first()
+    
+    if order is not None:
+        order.refresh_totals()
+
+
+@receiver(post_save, sender=ReceiptItem)
+@receiver(post_delete, sender=ReceiptItem)
+def update_receipt_total_on_item_change(sender, instance, **kwargs):
+    """
+    收據明細建立、修改或刪除時，重新計算收據總額
+    
+    收據本身被刪除時（級聯刪除收據明細）不需重新計算。
+    批次建立（bulk_create）不會觸發此 signal，總額由 Receipt.create_for_orders 直接寫入。
+    """
+    if isinstance(kwargs.get('origin'), Receipt):
+        return
+    
+    if ReceiptItem.receipt.is_cached(instance):
+        receipt = instance.receipt
+    else:
+        receipt = Receipt.objects.filter(pk=instance.receipt_id).first()
+    
+    if receipt is not None:
+        receipt.refresh_total()
+
+
+@receiver(post_save, sender=Order)
+def update_order_search_terms(sender, instance, **kwargs):
+    """
+    訂單儲存時同步搜尋索引
+    
+    訂單產品異動會經由 refresh_totals 儲存訂單，因此也會觸發此同步。
+    重建延後到交易提交後執行，同一交易內多次儲存同一訂單只重建一次。
+    """
+    OrderSearchTerm.schedule_rebuild([instance.pk])
+
+
+@receiver(pre_save, sender=CustomUser)
+def remember_account_search_fields(sender, instance, update_fields=None, **kwargs):
+    """
+    記錄帳號儲存前的索引欄位（帳號名稱、姓名、公司），供 post_save 判斷是否異動
+    
+    新帳號或只更新其他欄位（例如登入時的 last_login）時不查詢。
+    """
+    instance._search_fields_before = None
+    if instance.pk is None:
+        return
+    if update_fields is not None and not set(OrderSearchTerm.ACCOUNT_FIELDS) & set(update_fields):
+        return
+    
+    instance._search_fields_before = CustomUser.objects.filter(pk=instance.pk).values_list(
+        *OrderSearchTerm.ACCOUNT_FIELDS
+    ).first()
+
+
+@receiver(post_save, sender=CustomUser)
+def update_order_search_terms_on_account_change(sender, instance, created, **kwargs):
+    """
+    帳號名稱、姓名或公司實際異動時，於交易提交後重建該帳號所有訂單的搜尋索引
+    """
+    before = getattr(instance, '_search_fields_before', None)
+    if created or before is None:
+        return
+    if before == tuple(getattr(instance, field) for field in OrderSearchTerm.ACCOUNT_FIELDS):
+        return
+    
+    OrderSearchTerm.schedule_rebuild(
+        Order.objects.filter(account=instance).values_list('pk', flat=True)
+    )
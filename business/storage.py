@@ -0,0 +1,27 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+# 私有檔案儲存
+@deconstructible
+class PrivateFileStorage(FileSystemStorage):
+    """
+    不對外提供的檔案儲存（settings.PRIVATE_MEDIA_ROOT）
+
+    用於匯入的卡號檔案等敏感資料：位置不在 MEDIA_ROOT 之下，不會經由 MEDIA_URL 提供，
+    也不產生網址，只能由程式讀取。
+    """
+
+    @property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.PRIVATE_MEDIA_ROOT)
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    def url(self, name):
+        raise ValueError('私有檔案沒有網址')
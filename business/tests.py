@@ -1,3 +1,472 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import quote
+from xml.sax.saxutils import escape
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from accounts.constant import AccountRole
+from accounts.models import CustomUser
+from business.cart import Cart, TokenCartStore
+from business.constant import ImportJobStatus, OrderStatus, PaymentType
+from business.models import (
+    Order, OrderProduct, OrderCoupons, StockAllocation, DocumentSequence, ImportJob, Receipt, AccountTopUP,
+    StoredCart, OrderSearchTerm
+)
+from products.constant import ProductType
+from products.derivatives import QRContactSheet
+from products.models import Stock, VariantStockLevel
+from products.tests import create_variant, create_stock
+
+
+def create_headquarter(username='hq'):
+    return CustomUser.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password',
+        role=AccountRole.HEADQUARTER,
+        is_staff=True,
+        is_superuser=True
+    )
+
+
+def build_xlsx(rows):
+    """產生只有一個工作表（行內字串）的最小 XLSX"""
+    sheet_rows = ''.join(
+        '<row>' + ''.join(
+            f'<c t="inlineStr"><is><t>{escape(value)}</t></is></c>' for value in row
+        ) + '</row>'
+        for row in rows
+    )
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as workbook:
+        workbook.writestr(
+            'xl/worksheets/sheet1.xml',
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            f'<sheetData>{sheet_rows}</sheetData></worksheet>'
+        )
+    return output.getvalue()
+
+
+class DocumentSequenceTests(TestCase):
+    """單據流水號"""
+
+    def test_allocate_reserves_consecutive_ranges(self):
+        self.assertEqual(list(DocumentSequence.allocate('T', '20261016')), [1])
+        self.assertEqual(list(DocumentSequence.allocate('T', '20261016', count=3)), [2, 3, 4])
+        # 不同期間各自計數
+        self.assertEqual(list(DocumentSequence.allocate('T', '20261017', count=2)), [1, 2])
+
+    def test_seed_only_used_when_counter_missing(self):
+        calls = []
+
+        def seed():
+            calls.append(1)
+            return 41
+
+        self.assertEqual(list(DocumentSequence.allocate('T', '', seed=seed)), [42])
+        self.assertEqual(list(DocumentSequence.allocate('T', '', seed=seed)), [43])
+        self.assertEqual(len(calls), 1)
+
+    def test_receipt_numbers_continue_after_legacy_receipts(self):
+        user = create_headquarter()
+        receipt_date = date(2026, 10, 16)
+        for number in ('R20261016003', 'R20261016007', 'R20261016LEGACY'):
+            Receipt.objects.create(receipt_number=number, date=receipt_date, created_by=user)
+
+        self.assertEqual(
+            Receipt.allocate_receipt_numbers(count=2, date=receipt_date),
+            ['R20261016008', 'R20261016009']
+        )
+        self.assertEqual(Receipt.allocate_receipt_numbers(date=receipt_date), ['R20261016010'])
+
+
+class CartCookieTests(TestCase):
+    """購物車 cookie 解析（cookie 可被用戶端修改）"""
+
+    def test_invalid_items_are_dropped(self):
+        cart = Cart.from_cookie(quote(json.dumps({
+            '1': 'x',
+            '2': {'quantity': 'a', 'unit_price': 100},
+            '3': {'quantity': 1, 'unit_price': [1]},
+            '4': {'product_name': '日本', 'quantity': '2', 'unit_price': '150.5'},
+            '5': {'quantity': 1, 'unit_price': 300},
+        })))
+
+        self.assertEqual(list(cart), ['4', '5'])
+        self.assertEqual(cart['4']['quantity'], 2)
+        self.assertEqual(cart.count, 3)
+        self.assertEqual(cart.total, Decimal('601'))
+
+    def test_non_object_cookie_gives_empty_cart(self):
+        self.assertFalse(Cart.from_cookie(quote('[1, 2]')))
+        self.assertFalse(Cart.from_cookie('not json'))
+
+    @override_settings(CART_STORE='cookie')
+    def test_tampered_cookie_does_not_break_pages(self):
+        self.client.force_login(create_headquarter())
+        self.client.cookies[Cart.COOKIE_NAME] = quote(json.dumps({'1': {'quantity': 'a'}, '2': 'x'}))
+
+        self.assertEqual(self.client.get(reverse('business:cart_view')).status_code, 200)
+
+
+class CartStoreTests(TestCase):
+    """購物車儲存後端"""
+
+    def setUp(self):
+        self.client.force_login(create_headquarter())
+        self.variant = create_variant('日本 5G')
+        create_stock(self.variant, 10)
+
+    def add_to_cart(self):
+        self.client.post(reverse('business:add_to_cart', args=[self.variant.id]), {'quantity': 2})
+
+    def test_cookie_store_is_default(self):
+        self.add_to_cart()
+
+        cart = Cart.from_cookie(self.client.cookies[Cart.COOKIE_NAME].value)
+        self.assertEqual(cart[self.variant.id]['quantity'], 2)
+        self.assertFalse(StoredCart.objects.exists())
+
+    @override_settings(CART_STORE='db')
+    def test_db_store_keeps_only_token_in_cookie(self):
+        self.client.cookies[Cart.COOKIE_NAME] = quote(json.dumps({
+            str(self.variant.id): {'product_name': '日本 5G', 'variant_name': '日本 5G', 'quantity': 1, 'unit_price': 100}
+        }))
+        self.add_to_cart()
+
+        # 舊版 cookie 購物車轉存到資料表後清除
+        token = self.client.cookies[TokenCartStore.TOKEN_COOKIE_NAME].value
+        self.assertEqual(StoredCart.objects.get(token=token).data[str(self.variant.id)]['quantity'], 3)
+        self.assertEqual(self.client.cookies[Cart.COOKIE_NAME].value, '')
+
+
+class OrderSearchTermTests(TestCase):
+    """訂單搜尋索引"""
+
+    def setUp(self):
+        self.user = create_headquarter('agent01')
+        self.user.fullname = '王小明'
+        self.user.company = '環球旅遊'
+        self.user.save()
+        variant = create_variant('日本 5G 吃到飽', product_code='JP30D')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = Order.objects.create(account=self.user, created_by=self.user, payment_type=PaymentType.TOPUP)
+            OrderProduct.objects.create(order=self.order, variant=variant, product_code='JP30D', quantity=1, unit_price=100)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other = Order.objects.create(account=create_headquarter('hq2'), created_by=self.user, remark='韓國團')
+
+    def search(self, query):
+        return set(Order.objects.filter(id__in=OrderSearchTerm.search(query)).values_list('id', flat=True))
+
+    def test_prefix_and_bigram_matching(self):
+        self.assertEqual(self.search(self.order.id[:6]), {self.order.id, self.other.id})
+        self.assertEqual(self.search(self.order.id), {self.order.id})
+        self.assertEqual(self.search('jp3'), {self.order.id})
+        self.assertEqual(self.search('AGENT'), {self.order.id})
+        self.assertEqual(self.search('小明'), {self.order.id})
+        self.assertEqual(self.search('吃到飽 jp30d'), {self.order.id})
+        self.assertEqual(self.search('韓國'), {self.other.id})
+        self.assertEqual(self.search('30d'), set())
+        self.assertEqual(self.search('!!'), set())
+
+    def test_account_rename_rebuilds_after_commit(self):
+        self.user.fullname = '陳大文'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+        self.assertEqual(self.search('大文'), {self.order.id})
+        self.assertEqual(self.search('小明'), set())
+
+    def test_unchanged_account_save_does_not_rebuild(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.note = '只修改備註'
+            self.user.save()
+        self.assertEqual(callbacks, [])
+
+        # 只更新其他欄位時不另外查詢
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=['last_login'])
+
+
+# 結帳送出的查詢數（預設 cookie 購物車、當日報表列已存在時，與購物車項目數無關）
+SUBMIT_ORDER_QUERIES = 39
+
+
+class SubmitOrderTests(TestCase):
+    """結帳（儲值付款）"""
+
+    def setUp(self):
+        self.user = create_headquarter()
+        AccountTopUP.objects.create(account=self.user, balance=10 ** 8)
+        self.client.force_login(self.user)
+
+    def fill_cart(self, variant_count):
+        """將 variant_count 個變體各 15 件加入購物車（每個變體跨兩筆庫存）"""
+        for index in range(variant_count):
+            variant = create_variant(f'變體 {variant_count}-{index}')
+            create_stock(variant, 10)
+            create_stock(variant, 10)
+            self.client.post(reverse('business:add_to_cart', args=[variant.id]), {'quantity': 15})
+
+    def test_order_lines_totals_and_allocations(self):
+        self.fill_cart(3)
+        response = self.client.post(reverse('business:submit_order'))
+
+        self.assertEqual(response.status_code, 302)
+        order = Order.objects.get()
+        self.assertEqual(order.status, OrderStatus.PAID)
+        self.assertEqual(order.payment_type, PaymentType.TOPUP)
+        self.assertEqual(order.items_quantity, 45)
+        self.assertEqual(order.items_amount, sum(line.amount for line in order.order_products.all()))
+        self.assertEqual(StockAllocation.objects.filter(order=order).count(), 6)
+        self.assertEqual(VariantStockLevel.rebuild(), 0)
+
+    def test_query_count_does_not_grow_with_order_lines(self):
+        # 訂單產品以 bulk_create 寫入，訂單金額、搜尋文件與庫存彙總不會逐項更新
+        # 先結帳一次，讓當日報表列已存在，後續兩次結帳走相同的查詢路徑
+        self.fill_cart(1)
+        self.client.post(reverse('business:submit_order'))
+
+        self.fill_cart(2)
+        with self.assertNumQueries(SUBMIT_ORDER_QUERIES):
+            self.client.post(reverse('business:submit_order'))
+
+        self.fill_cart(30)
+        with self.assertNumQueries(SUBMIT_ORDER_QUERIES):
+            self.client.post(reverse('business:submit_order'))
+
+        self.assertEqual(Order.objects.get(items_quantity=450).order_products.count(), 30)
+
+
+class StockAllocationTests(TestCase):
+    """庫存分配記錄"""
+
+    def setUp(self):
+        self.user = create_headquarter()
+        AccountTopUP.objects.create(account=self.user, balance=10 ** 8)
+        self.client.force_login(self.user)
+        self.variant = create_variant('日本 5G')
+        create_stock(self.variant, 10)
+        self.client.post(reverse('business:add_to_cart', args=[self.variant.id]), {'quantity': 4})
+        self.client.post(reverse('business:submit_order'))
+        self.order = Order.objects.get()
+
+    def test_rows_are_kept_after_order_deletion(self):
+        order_id = self.order.id
+        self.client.post(reverse('business:order_delete', args=[order_id]))
+
+        self.assertFalse(Order.objects.filter(id=order_id).exists())
+        allocation = StockAllocation.objects.get(order_id=order_id)
+        self.assertIsNone(allocation.order_product_id)
+        self.assertEqual(allocation.variant_id, self.variant.id)
+        self.assertIsNotNone(allocation.released_at)
+        self.assertEqual(VariantStockLevel.get_available([self.variant.id])[self.variant.id], 10)
+
+
+class ImportJobTests(TestCase):
+    """充值卡卡號匯入工作"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.private_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, PRIVATE_MEDIA_ROOT=self.private_root)
+        self.settings_override.enable()
+
+        user = create_headquarter()
+        variant = create_variant('充值卡', product_type=ProductType.RECHARGEABLE)
+        order = Order.objects.create(account=user, created_by=user, payment_type=PaymentType.TOPUP)
+        self.order_product = OrderProduct.objects.create(
+            order=order, variant=variant, product_code='RC', quantity=6, unit_price=100
+        )
+        OrderCoupons.objects.bulk_create([
+            OrderCoupons(order=order, order_product=self.order_product) for _ in range(6)
+        ])
+        self.user = user
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        shutil.rmtree(self.private_root, ignore_errors=True)
+
+    def create_job(self, content, name='codes.csv'):
+        return ImportJob.create_for_upload(self.order_product, SimpleUploadedFile(name, content), self.user)
+
+    def imported_codes(self):
+        return list(
+            OrderCoupons.objects.filter(order_product=self.order_product).order_by('id').values_list('sn_code', flat=True)
+        )
+
+    def test_resume_after_partial_run(self):
+        content = '序號,卡號\r\n1,"A\r\n1"\r\n2,A2\r\n3,A3\r\n4,"A,4"\r\n5,A5\r\n'.encode('utf-8-sig')
+        job = self.create_job(content)
+
+        # 每次只處理一批（時間上限為 0），進度由資料庫重新讀取後接續
+        self.assertFalse(job.run(time_budget=0, chunk_size=2))
+        job = ImportJob.objects.get(pk=job.pk)
+        self.assertEqual(job.status, ImportJobStatus.RUNNING)
+        self.assertEqual(job.rows_processed, 2)
+        self.assertEqual(job.byte_offset, len('序號,卡號\r\n1,"A\r\n1"\r\n'.encode('utf-8-sig')))
+
+        while not job.run(time_budget=0, chunk_size=2):
+            job = ImportJob.objects.get(pk=job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJobStatus.COMPLETED)
+        self.assertEqual(job.codes_imported, 5)
+        self.assertEqual(self.imported_codes(), ['A\r\n1', 'A2', 'A3', 'A,4', 'A5', None])
+
+    def test_stale_job_does_not_repeat_processed_rows(self):
+        job = self.create_job('B1\nB2\nB3\n'.encode())
+        stale = ImportJob.objects.get(pk=job.pk)
+        job.run(time_budget=0, chunk_size=2)
+
+        # 另一個請求持有舊進度時不處理同一批，改由資料庫中的進度接續
+        self.assertFalse(stale.run(time_budget=0, chunk_size=2))
+        self.assertEqual(stale.rows_processed, 2)
+        while not stale.run(time_budget=0, chunk_size=2):
+            pass
+
+        stale.refresh_from_db()
+        self.assertEqual(stale.codes_imported, 3)
+        self.assertEqual(stale.error_count, 0)
+        self.assertEqual(self.imported_codes()[:3], ['B1', 'B2', 'B3'])
+
+    def test_big5_file(self):
+        job = self.create_job('序號,卡號\n1,甲一\n2,乙二\n'.encode('big5'))
+        self.assertTrue(job.run())
+        self.assertEqual(self.imported_codes()[:2], ['甲一', '乙二'])
+
+    def test_upload_is_private_and_deleted_when_finished(self):
+        job = self.create_job('C1\nC2\n'.encode())
+        path = job.file.path
+
+        self.assertTrue(path.startswith(self.private_root))
+        self.assertEqual(os.listdir(self.media_root), [])
+        with self.assertRaises(ValueError):
+            job.file.url
+
+        self.assertTrue(job.run())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(job.file)
+
+    def test_xlsx_is_converted_once_and_resumed(self):
+        rows = [['序號', '卡號'], ['1', 'X1'], ['2', 'X\n2'], ['3', 'X3']]
+        job = self.create_job(build_xlsx(rows), name='codes.xlsx')
+
+        self.assertFalse(job.run(time_budget=0, chunk_size=2))
+        job = ImportJob.objects.get(pk=job.pk)
+        self.assertTrue(job.file.name.endswith('.csv'))
+        self.assertEqual(job.rows_processed, 2)
+
+        with mock.patch('business.models.iter_xlsx_rows') as iter_xlsx_rows:
+            while not job.run(time_budget=0, chunk_size=2):
+                job = ImportJob.objects.get(pk=job.pk)
+        iter_xlsx_rows.assert_not_called()
+
+        self.assertEqual(job.status, ImportJobStatus.COMPLETED)
+        self.assertEqual(self.imported_codes()[:3], ['X1', 'X\n2', 'X3'])
+
+    def test_only_headquarter_can_import(self):
+        agent = CustomUser.objects.create_user(
+            username='agent', email='agent@example.com', password='password', role=AccountRole.AGENT
+        )
+        self.client.force_login(agent)
+        response = self.client.post(
+            reverse('business:import_rechargeable_codes_csv', args=[self.order_product.order_id, self.order_product.id]),
+            {'csv_file': SimpleUploadedFile('codes.csv', b'D1\n')}
+        )
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(ImportJob.objects.exists())
+
+
+class OrderProductQRSheetTests(TestCase):
+    """ESIMIMG 聯絡表由指令預先產生，請求中只提供已產生的聯絡表"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.user = create_headquarter()
+        self.client.force_login(self.user)
+        variant = create_variant('日本 圖庫', product_type=ProductType.ESIMIMG)
+        variant.sku = 'JP-IMG'
+        variant.save()
+
+        image = io.BytesIO()
+        Image.new('RGB', (320, 320), 'black').save(image, 'PNG')
+        self.stock = Stock.objects.create(
+            name='圖庫', product=variant, code='QR-1', quantity=0, is_used=True,
+            qr_img=ContentFile(image.getvalue(), name='qr.png')
+        )
+        order = Order.objects.create(account=self.user, created_by=self.user, payment_type=PaymentType.TOPUP)
+        self.order_product = OrderProduct.objects.create(
+            order=order, variant=variant, quantity=1, unit_price=100,
+            used_stocks=[{'stock_id': self.stock.id, 'deducted_quantity': 1, 'stock_quantity_before': 1}]
+        )
+        self.sheet_url = reverse(
+            'business:order_product_qr_sheet', args=[order.id, self.order_product.id]
+        )
+        self.detail_url = reverse(
+            'business:order_product_detail', args=[order.id, self.order_product.id]
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def generate(self):
+        call_command('generate_qr_thumbnails', stdout=io.StringIO())
+
+    def sheet_files(self):
+        directory = os.path.join(
+            self.media_root, QRContactSheet.directory,
+            str(self.order_product.id // 1000), str(self.order_product.id)
+        )
+        return sorted(os.listdir(directory))
+
+    def test_sheet_is_served_only_after_generation(self):
+        with mock.patch.object(QRContactSheet, 'render', side_effect=AssertionError('請求中不應產生聯絡表')):
+            self.assertEqual(self.client.get(self.sheet_url).status_code, 404)
+            response = self.client.get(self.detail_url)
+            self.assertEqual(list(response.context['qr_sheet_pages']), [])
+            self.assertTrue(response.context['qr_sheet_pending'])
+
+        self.generate()
+
+        with mock.patch.object(QRContactSheet, 'render', side_effect=AssertionError('請求中不應產生聯絡表')):
+            response = self.client.get(self.sheet_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'\x89PNG'))
+            response = self.client.get(self.detail_url)
+            self.assertEqual(list(response.context['qr_sheet_pages']), [1])
+            self.assertFalse(response.context['qr_sheet_pending'])
+
+    def test_changed_page_is_regenerated(self):
+        self.generate()
+        before = self.sheet_files()
+
+        Stock.objects.filter(pk=self.stock.pk).update(code='QR-2')
+        self.assertEqual(self.client.get(self.sheet_url).status_code, 404)
+
+        self.generate()
+        after = self.sheet_files()
+
+        self.assertEqual(len(after), 1)
+        self.assertNotEqual(after, before)
+        self.assertEqual(self.client.get(self.sheet_url).status_code, 200)
@@ -44,6 +44,13 @@ urlpatterns = [
     path('orders/<str:order_id>/products/<int:product_id>/', 
          views.OrderProductDetailView.as_view(), 
          name='order_product_detail'),
+    # ESIMIMG QR 聯絡表與打包下載
+    path('orders/<str:order_id>/products/<int:product_id>/qr-sheet/',
+         views.OrderProductQRSheetView.as_view(),
+         name='order_product_qr_sheet'),
+    path('orders/<str:order_id>/products/<int:product_id>/qr-archive/',
+         views.OrderProductQRArchiveView.as_view(),
+         name='order_product_qr_archive'),
      
     # RECHARGEABLE 卡號管理
     path(
@@ -62,6 +69,12 @@ urlpatterns = [
         views.import_rechargeable_codes_csv,
         name='import_rechargeable_codes_csv'
     ),
+    # 卡號匯入工作進度（輪詢）
+    path(
+        'import-jobs/<int:job_id>/',
+        views.import_job_status,
+        name='import_job_status'
+    ),
 
     # 刪除訂單產品
     path('orders/<str:order_id>/products/<int:product_id>/delete/', 
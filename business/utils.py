@@ -1,8 +1,13 @@
+import codecs
+import csv
 import hashlib
 import json
 import os
 import random
+import re
 import time
+import zipfile
+from xml.etree import ElementTree
 from datetime import datetime
 from functools import wraps
 from django.shortcuts import redirect
@@ -42,3 +47,143 @@ def get_order_id_by_ordertid(order_tid):
     return order_tid.replace(CUSTOM_CODE, '')
 
 
+
+def get_facet_counts(queryset, field):
+    """
+    以單一分組查詢統計欄位各值的筆數（用於列表頁的篩選統計）
+
+    Args:
+        queryset: 已套用篩選條件的 QuerySet
+        field: 分組欄位，例如 'status'、'payment_type'、'order_source'
+
+    Returns:
+        dict: {欄位值: 筆數}
+    """
+    from django.db.models import Count
+
+    return dict(
+        queryset.order_by().values(field).annotate(
+            facet_count=Count('pk', distinct=True)
+        ).values_list(field, 'facet_count')
+    )
+
+
+def sniff_encoding(fileobj, sample_size=64 * 1024):
+    """
+    由檔案開頭判斷文字編碼（UTF-8 BOM、UTF-8，否則視為 Big5）
+
+    只讀取開頭的樣本，讀取後將檔案指標移回開頭。
+
+    Args:
+        fileobj: 以二進位模式開啟的檔案
+        sample_size: 樣本位元組數
+
+    Returns:
+        str: 編碼名稱
+    """
+    sample = fileobj.read(sample_size)
+    fileobj.seek(0)
+
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # 樣本結尾可能切在多位元組字元中間，以增量解碼器忽略未完成的位元組
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        # 繁體中文 Excel 常用
+        return 'big5'
+
+
+def iter_csv_rows(fileobj, encoding):
+    """
+    逐列讀取 CSV（逐行讀取並解碼，不會一次讀入整個檔案）
+
+    csv.reader 只在需要時才讀取下一行，因此每產生一列後 fileobj.tell()
+    即為下一列的起始位元組位置，可記錄下來以 seek 接續讀取。
+    支援的編碼（UTF-8、Big5）多位元組字元都不含換行位元組，可安全依行切割。
+
+    Args:
+        fileobj: 以二進位模式開啟的檔案（已移至要開始讀取的位置）
+        encoding: 文字編碼（見 sniff_encoding）
+
+    Yields:
+        list: 每列的欄位值
+    """
+    lines = (line.decode(encoding) for line in iter(fileobj.readline, b''))
+    yield from csv.reader(lines)
+
+
+_XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def iter_xlsx_rows(fileobj):
+    """
+    逐列讀取 XLSX 第一個工作表（以 iterparse 串流解析，不需額外套件）
+
+    共用字串表（sharedStrings）會先載入，工作表內容則逐列解析並釋放。
+
+    Args:
+        fileobj: 以二進位模式開啟的檔案
+
+    Yields:
+        list: 每列的儲存格文字（依欄位位置補齊空白儲存格）
+    """
+    with zipfile.ZipFile(fileobj) as workbook:
+        names = workbook.namelist()
+
+        # 1. 共用字串表
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in names:
+            with workbook.open('xl/sharedStrings.xml') as stream:
+                for _, element in ElementTree.iterparse(stream):
+                    if element.tag == f'{_XLSX_NS}si':
+                        shared_strings.append(''.join(
+                            node.text or '' for node in element.iter(f'{_XLSX_NS}t')
+                        ))
+                        element.clear()
+
+        # 2. 第一個工作表
+        sheets = sorted(
+            name for name in names
+            if name.startswith('xl/worksheets/') and name.endswith('.xml')
+        )
+        if not sheets:
+            return
+        sheet = 'xl/worksheets/sheet1.xml' if 'xl/worksheets/sheet1.xml' in sheets else sheets[0]
+
+        with workbook.open(sheet) as stream:
+            for _, element in ElementTree.iterparse(stream):
+                if element.tag != f'{_XLSX_NS}row':
+                    continue
+
+                row = []
+                for cell in element.iter(f'{_XLSX_NS}c'):
+                    cell_type = cell.get('t')
+                    if cell_type == 'inlineStr':
+                        value = ''.join(node.text or '' for node in cell.iter(f'{_XLSX_NS}t'))
+                    else:
+                        node = cell.find(f'{_XLSX_NS}v')
+                        value = (node.text or '') if node is not None else ''
+                        if cell_type == 's' and value:
+                            value = shared_strings[int(value)]
+
+                    # 依儲存格位置（例如 C3）補齊中間的空白欄位
+                    column = _xlsx_column_index(cell.get('r'))
+                    if column is not None:
+                        row.extend([''] * (column - len(row)))
+                    row.append(value)
+
+                yield row
+                element.clear()
+
+
+def _xlsx_column_index(reference):
+    """將儲存格位置（例如 'C3'）轉為從 0 起算的欄位索引"""
+    match = re.match(r'([A-Z]+)', reference or '')
+    if not match:
+        return None
+    index = 0
+    for letter in match.group(1):
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
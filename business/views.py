@@ -3,7 +3,7 @@ import csv
 import io
 from decimal import Decimal
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponseRedirect, HttpResponse, FileResponse, Http404
 from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
@@ -13,15 +13,16 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import CreateView, UpdateView, DetailView, DeleteView
 from django.views.generic.list import ListView
 from django.views.generic.base import View
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.db.models import Q, Sum
 from django.db import transaction
-from business.models import Order, OrderProduct, OrderCoupons, Receipt, ReceiptItem, AccountTopUP, AccountTopUPLog, Expense, Income
+from business.models import Order, OrderProduct, StockAllocation, OrderSearchTerm, OrderCoupons, ImportJob, Receipt, ReceiptItem, AccountTopUP, AccountTopUPLog, Expense, Income
 from business.forms import TopupCreateForm
-from business.constant import OrderStatus, PaymentType, OrderSource, ReceiptType, TopupType, IncomeItem, ExpenseItem, CUSTOM_CODE, CUSTOM_AUTH, SUBMIT_ORDER_TYPE, SUBMIT_ORDER_REPLY_TYPE, WAREHOUSE
+from business.utils import get_facet_counts
+from business.constant import OrderStatus, PaymentType, OrderSource, ReceiptType, ImportJobStatus, TopupType, IncomeItem, ExpenseItem, CUSTOM_CODE, CUSTOM_AUTH, SUBMIT_ORDER_TYPE, SUBMIT_ORDER_REPLY_TYPE, WAREHOUSE
 from accounts.models import CustomUser
 from accounts.constant import AccountStatus, AccountRole
-from products.models import Supplier, Category, Product, Variant, Stock
+from products.models import Supplier, Category, Product, Variant, Stock, VariantStockLevel
 from products.constant import VariantStatus, ProductType
 from products.views import CatalogueDetailView
 from accounts.utils import (
@@ -36,7 +37,9 @@ from accounts.utils import (
     get_variant_display_price,
     get_user_price_field
 )
-from products.utils import get_variant_price_for_user
+from products.utils import PriceBook
+from products.services import StockAllocator, StockAllocationError, UsedStockResolver
+from products.derivatives import QRThumbnail, QRContactSheet, build_qr_archive, stock_label
 from django import forms
 import logging
 logger = logging.getLogger(__name__)
@@ -265,7 +268,6 @@ def add_to_cart(request, variant_id):
     Returns JSON with cart_count and total
     """
     import logging
-    from urllib.parse import quote, unquote
     
     logger = logging.getLogger(__name__)
     
@@ -285,9 +287,9 @@ def add_to_cart(request, variant_id):
         if quantity > 999:
             quantity = 999
         
-        # 3. 使用 products/utils.py 的統一定價函數根據用戶角色決定價格
+        # 3. 使用 products/utils.py 的價格簿根據用戶角色決定價格
         user = request.user
-        display_price, original_price, has_sale = get_variant_price_for_user(variant, user)
+        display_price, original_price, has_sale = PriceBook(user).get_price(variant)
         unit_price = float(display_price)
         
         logger.info(f'用戶 {user.username} (角色: {user.get_role_display()}) 的價格：${unit_price}')
@@ -298,85 +300,32 @@ def add_to_cart(request, variant_id):
                 'error': '此商品暫無價格，請聯絡客服'
             }, status=400, json_dumps_params={'ensure_ascii': False})
         
-        # 4. 從 cookie 獲取購物車
-        cart = {}
-        cart_cookie = request.COOKIES.get('cart', '{}')
-        try:
-            # 先解碼 URL 編碼
-            decoded_cookie = unquote(cart_cookie)
-            cart = json.loads(decoded_cookie)
-            logger.debug(f'成功解析購物車，共 {len(cart)} 項商品')
-        except (json.JSONDecodeError, ValueError) as e:
-            cart = {}
-            logger.warning(f'購物車 cookie 解析失敗：{str(e)}，將建立新購物車')
-        
-        # 5. 添加或更新商品
-        variant_key = str(variant_id)
+        # 4. 添加或更新商品（request.cart 由 CartMiddleware 提供，回應時寫回 cookie）
+        cart = request.cart
         
         # 安全處理名稱（移除特殊字符）
         product_name = str(variant.product.name).replace('\x00', '').replace('\n', ' ').replace('\r', '').strip()
         variant_name = str(variant.name).replace('\x00', '').replace('\n', ' ').replace('\r', '').strip()
         
-        if variant_key in cart:
-            # 更新數量（累加）
-            old_quantity = cart[variant_key]['quantity']
-            cart[variant_key]['quantity'] += quantity
-            
-            # 限制最大數量
-            if cart[variant_key]['quantity'] > 999:
-                cart[variant_key]['quantity'] = 999
-            
-            # 更新價格（以防價格有變動）
-            cart[variant_key]['unit_price'] = unit_price
-            
-            action = 'updated'
-            logger.info(f'更新購物車：變體 {variant_id}，數量 {old_quantity} → {cart[variant_key]["quantity"]}')
-        else:
-            # 新增商品
-            cart[variant_key] = {
-                'product_name': product_name,
-                'variant_name': variant_name,
-                'quantity': quantity,
-                'unit_price': unit_price
-            }
-            action = 'added'
-            logger.info(f'新增至購物車：變體 {variant_id}，數量 {quantity}')
-        
-        # 6. 計算購物車統計
-        cart_count = sum(item['quantity'] for item in cart.values())
-        cart_total = sum(item['quantity'] * item['unit_price'] for item in cart.values())
+        action = cart.add(variant_id, product_name, variant_name, quantity, unit_price)
+        logger.info(f'{"新增至" if action == "added" else "更新"}購物車：變體 {variant_id}，數量 {cart[variant_id]["quantity"]}')
         
-        logger.info(f'購物車統計：共 {cart_count} 件商品，總計 ${cart_total:.2f}')
+        logger.info(f'購物車統計：共 {cart.count} 件商品，總計 ${cart.total:.2f}')
         
-        # 7. 準備回應（確保所有值都是可序列化的）
+        # 5. 準備回應（確保所有值都是可序列化的）
         response_data = {
             'success': True,
             'action': action,
-            'cart_count': cart_count,
-            'total': float(cart_total),
-            'item_quantity': cart[variant_key]['quantity'],
+            'cart_count': cart.count,
+            'total': float(cart.total),
+            'item_quantity': cart[variant_id]['quantity'],
             'message': f'已將 {variant_name} 加入購物車'
         }
         
         # 使用 ensure_ascii=False 處理中文
         response = JsonResponse(response_data, json_dumps_params={'ensure_ascii': False})
         
-        # 8. 設定 cookie（30 天過期）
-        # 使用 ensure_ascii=False 確保中文正確存儲
-        cart_json = json.dumps(cart, ensure_ascii=False)
-        
-        # 對包含中文的 JSON 進行 URL 編碼
-        encoded_cart = quote(cart_json)
-        
-        response.set_cookie(
-            'cart',
-            encoded_cart,
-            max_age=30*24*60*60,  # 30 天
-            httponly=False,  # 允許 JavaScript 讀取
-            samesite='Lax'
-        )
-        
-        logger.info(f'成功加入購物車：variant_id={variant_id}, quantity={quantity}, cart_count={cart_count}')
+        logger.info(f'成功加入購物車：variant_id={variant_id}, quantity={quantity}, cart_count={cart.count}')
         
         return response
         
@@ -408,7 +357,6 @@ def update_cart(request, variant_id):
     更新購物車中商品的數量
     POST: quantity (required)
     """
-    from urllib.parse import quote, unquote
     import logging
     
     logger = logging.getLogger(__name__)
@@ -421,24 +369,16 @@ def update_cart(request, variant_id):
         if quantity > 999:
             quantity = 999
         
-        # 2. 從 cookie 獲取購物車
-        cart = {}
-        cart_cookie = request.COOKIES.get('cart', '{}')
-        try:
-            decoded_cookie = unquote(cart_cookie)
-            cart = json.loads(decoded_cookie)
-        except (json.JSONDecodeError, ValueError):
-            cart = {}
-        
-        variant_key = str(variant_id)
+        # 2. 獲取購物車
+        cart = request.cart
         
-        if variant_key not in cart:
+        if variant_id not in cart:
             return JsonResponse({
                 'success': False,
                 'error': '購物車中沒有此商品'
             }, status=404)
         
-        # 3. 獲取變體並更新價格（使用 products/utils.py 的統一定價函數）
+        # 3. 獲取變體並更新價格（使用 products/utils.py 的價格簿）
         try:
             variant = Variant.objects.select_related('product').get(
                 id=variant_id,
@@ -447,52 +387,32 @@ def update_cart(request, variant_id):
             )
             
             user = request.user
-            display_price, original_price, has_sale = get_variant_price_for_user(variant, user)
+            display_price, original_price, has_sale = PriceBook(user).get_price(variant)
             unit_price = float(display_price)
             
             # 更新數量和價格
-            cart[variant_key]['quantity'] = quantity
-            cart[variant_key]['unit_price'] = unit_price
+            cart.set_quantity(variant_id, quantity, unit_price)
             
             logger.info(f'更新購物車：變體 {variant_id}，數量 {quantity}，單價 ${unit_price}')
             
         except Variant.DoesNotExist:
             logger.warning(f'變體 {variant_id} 已下架，從購物車移除')
-            cart.pop(variant_key)
+            cart.remove(variant_id)
             return JsonResponse({
                 'success': False,
                 'error': '此商品已下架',
                 'removed': True
             }, status=404)
         
-        # 4. 計算購物車統計
-        item_subtotal = cart[variant_key]['quantity'] * cart[variant_key]['unit_price']
-        cart_count = sum(item['quantity'] for item in cart.values())
-        cart_total = sum(item['quantity'] * item['unit_price'] for item in cart.values())
-        
-        # 5. 準備回應
-        response = JsonResponse({
+        # 4. 準備回應
+        return JsonResponse({
             'success': True,
-            'cart_count': cart_count,
-            'total': cart_total,
+            'cart_count': cart.count,
+            'total': float(cart.total),
             'item_quantity': quantity,
-            'item_subtotal': item_subtotal
+            'item_subtotal': float(cart.subtotal(variant_id))
         })
         
-        # 6. 更新 cookie
-        cart_json = json.dumps(cart, ensure_ascii=False)
-        encoded_cart = quote(cart_json)
-        
-        response.set_cookie(
-            'cart',
-            encoded_cart,
-            max_age=30*24*60*60,
-            httponly=False,
-            samesite='Lax'
-        )
-        
-        return response
-        
     except ValueError as e:
         logger.error(f'數量格式錯誤：{str(e)}')
         return JsonResponse({
@@ -517,7 +437,6 @@ def update_cart_price(request, variant_id):
     
     注意：此功能允許總公司管理員自訂單價，不受角色定價限制
     """
-    from urllib.parse import quote, unquote
     import logging
     
     logger = logging.getLogger(__name__)
@@ -540,62 +459,30 @@ def update_cart_price(request, variant_id):
                 'error': '單價不能為負數'
             }, status=400)
         
-        # 3. 從 cookie 獲取購物車
-        cart = {}
-        cart_cookie = request.COOKIES.get('cart', '{}')
-        try:
-            decoded_cookie = unquote(cart_cookie)
-            cart = json.loads(decoded_cookie)
-        except (json.JSONDecodeError, ValueError):
-            cart = {}
-        
-        variant_key = str(variant_id)
+        # 3. 獲取購物車
+        cart = request.cart
         
-        if variant_key not in cart:
+        if variant_id not in cart:
             return JsonResponse({
                 'success': False,
                 'error': '購物車中沒有此商品'
             }, status=404)
         
         # 4. 更新單價（整數）
-        cart[variant_key]['unit_price'] = int(unit_price)  # 儲存為整數
+        cart.set_unit_price(variant_id, int(unit_price))  # 儲存為整數
         
         logger.info(f'總公司管理員 {request.user.username} 修改單價：變體 {variant_id}，新單價 ${unit_price}')
         
-        # 5. 計算購物車統計
-        quantity = cart[variant_key]['quantity']
-        item_subtotal = quantity * unit_price
-        
-        cart_count = sum(item['quantity'] for item in cart.values())
-        cart_total = sum(
-            item['quantity'] * Decimal(str(item['unit_price'])) 
-            for item in cart.values()
-        )
-        
-        # 6. 準備回應（返回整數）
-        response = JsonResponse({
+        # 5. 準備回應（返回整數）
+        return JsonResponse({
             'success': True,
-            'cart_count': cart_count,
-            'total': int(cart_total),  # 整數
-            'item_quantity': quantity,
-            'item_subtotal': int(item_subtotal),  # 整數
+            'cart_count': cart.count,
+            'total': int(cart.total),  # 整數
+            'item_quantity': cart[variant_id]['quantity'],
+            'item_subtotal': int(cart.subtotal(variant_id)),  # 整數
             'unit_price': int(unit_price)  # 整數
         })
         
-        # 7. 更新 cookie
-        cart_json = json.dumps(cart, ensure_ascii=False)
-        encoded_cart = quote(cart_json)
-        
-        response.set_cookie(
-            'cart',
-            encoded_cart,
-            max_age=30*24*60*60,
-            httponly=False,
-            samesite='Lax'
-        )
-        
-        return response
-        
     except (ValueError, TypeError) as e:
         logger.error(f'單價格式錯誤：{str(e)}')
         return JsonResponse({
@@ -617,55 +504,27 @@ def remove_from_cart(request, variant_id):
     """
     從購物車移除商品
     """
-    from urllib.parse import quote, unquote
-    
     try:
-        # 1. 從 cookie 獲取購物車
-        cart = {}
-        cart_cookie = request.COOKIES.get('cart', '{}')
-        try:
-            decoded_cookie = unquote(cart_cookie)
-            cart = json.loads(decoded_cookie)
-        except (json.JSONDecodeError, ValueError):
-            cart = {}
-        
-        variant_key = str(variant_id)
+        # 1. 獲取購物車
+        cart = request.cart
         
-        if variant_key not in cart:
+        if variant_id not in cart:
             return JsonResponse({
                 'success': False,
                 'error': '購物車中沒有此商品'
             }, status=404)
         
         # 2. 移除商品
-        removed_item = cart.pop(variant_key)
+        removed_item = cart.remove(variant_id)
         
-        # 3. 計算購物車統計
-        cart_count = sum(item['quantity'] for item in cart.values())
-        cart_total = sum(item['quantity'] * item['unit_price'] for item in cart.values())
-        
-        # 4. 準備回應
-        response = JsonResponse({
+        # 3. 準備回應
+        return JsonResponse({
             'success': True,
-            'cart_count': cart_count,
-            'total': cart_total,
+            'cart_count': cart.count,
+            'total': float(cart.total),
             'message': f'已移除 {removed_item["variant_name"]}'
         })
         
-        # 5. 更新 cookie
-        cart_json = json.dumps(cart, ensure_ascii=False)
-        encoded_cart = quote(cart_json)
-        
-        response.set_cookie(
-            'cart',
-            encoded_cart,
-            max_age=30*24*60*60,
-            httponly=False,
-            samesite='Lax'
-        )
-        
-        return response
-        
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -685,35 +544,25 @@ def cart_view(request):
     3. 總公司管理員可修改單價
     4. 顯示產品類型標識
     """
-    import json
     import logging
-    from urllib.parse import unquote
     from decimal import Decimal
     
     logger = logging.getLogger(__name__)
     user = request.user
     
-    # 從 cookie 獲取購物車
-    cart = {}
-    cart_cookie = request.COOKIES.get('cart', '{}')
-    try:
-        decoded_cookie = unquote(cart_cookie)
-        cart = json.loads(decoded_cookie)
-    except (json.JSONDecodeError, ValueError) as e:
-        logger.error(f'購物車 cookie 解析失敗：{str(e)}')
-        cart = {}
+    # 獲取購物車
+    cart = request.cart
     
-    # 構建購物車項目列表
+    # 構建購物車項目列表（一次查詢所有變體）
     cart_items = []
     total = Decimal('0')
+    variants = cart.active_variants()
     
     for variant_id, item_data in cart.items():
         try:
-            variant = Variant.objects.select_related('product').get(
-                id=variant_id,
-                status=VariantStatus.ACTIVE,
-                product__status='ACTIVE'
-            )
+            variant = variants.get(str(variant_id))
+            if variant is None:
+                raise Variant.DoesNotExist
             
             quantity = item_data.get('quantity', 1)
             unit_price = Decimal(str(item_data.get('unit_price', 0)))
@@ -756,18 +605,11 @@ def checkout_view(request):
     結帳頁面
     """
     import logging
-    from urllib.parse import unquote
     
     logger = logging.getLogger(__name__)
     
-    # 1. 從 cookie 獲取購物車
-    cart = {}
-    cart_cookie = request.COOKIES.get('cart', '{}')
-    try:
-        decoded_cookie = unquote(cart_cookie)
-        cart = json.loads(decoded_cookie)
-    except (json.JSONDecodeError, ValueError):
-        cart = {}
+    # 1. 獲取購物車
+    cart = request.cart
     
     # 2. 檢查購物車是否為空
     if not cart:
@@ -815,14 +657,13 @@ def checkout_view(request):
     current_order_account = order_for_account if order_for_account else user
     logger.info(f'當前訂單帳號：{current_order_account.username} (角色: {current_order_account.get_role_display()})')
     
-    # 4. 使用購物車中的價格（不重新計算）
+    # 4. 使用購物車中的價格（不重新計算，一次查詢所有變體）
+    variants = cart.active_variants()
     for variant_id, item_data in cart.items():
         try:
-            variant = Variant.objects.select_related('product').get(
-                id=variant_id,
-                status=VariantStatus.ACTIVE,
-                product__status='ACTIVE'
-            )
+            variant = variants.get(str(variant_id))
+            if variant is None:
+                raise Variant.DoesNotExist
             
             # 直接使用購物車中儲存的價格（已經是總公司管理員修改過的價格）
             unit_price = Decimal(str(item_data['unit_price']))
@@ -863,20 +704,14 @@ def checkout_view(request):
             f'以下商品已下架或不存在：{invalid_names}，已自動移除'
         )
         
-        # 從購物車 cookie 中移除無效商品
+        # 從購物車中移除無效商品（回應時寫回 cookie）
         for item in invalid_items:
-            cart.pop(str(item['variant_id']), None)
+            cart.remove(item['variant_id'])
         
         if not cart_items:
             messages.error(request, '購物車中所有商品都已失效，請重新選購')
-            response = redirect('products:catalogue_list')
-            response.delete_cookie('cart')
-            return response
-        
-        # 更新 cookie（移除無效商品後）
-        from urllib.parse import quote
-        cart_json = json.dumps(cart, ensure_ascii=False)
-        encoded_cart = quote(cart_json)
+            cart.clear()
+            return redirect('products:catalogue_list')
     
     # 6. 獲取訂單帳號的儲值餘額
     try:
@@ -921,18 +756,7 @@ def checkout_view(request):
         'is_headquarter': is_headquarter_admin(user), 
     }
     
-    # 如果有移除無效商品，需要更新 cookie
-    response = render(request, 'business/checkout.html', context)
-    if invalid_items:
-        response.set_cookie(
-            'cart',
-            encoded_cart,
-            max_age=30*24*60*60,
-            httponly=False,
-            samesite='Lax'
-        )
-    
-    return response
+    return render(request, 'business/checkout.html', context)
 
 
 # 提交預訂
@@ -984,32 +808,23 @@ def submit_reservation(request):
                 order_account = user
                 logger.info(f'為自己 {order_account.username} 建立預訂')
             
-            # 3. 從 cookie 獲取購物車
-            cart = {}
-            cart_cookie = request.COOKIES.get('cart', '{}')
-            try:
-                from urllib.parse import unquote
-                decoded_cookie = unquote(cart_cookie)
-                cart = json.loads(decoded_cookie)
-            except (json.JSONDecodeError, ValueError):
-                messages.error(request, '購物車資料錯誤')
-                return redirect('business:cart_view')
+            # 3. 獲取購物車（cookie 格式錯誤時為空購物車）
+            cart = request.cart
             
             if not cart:
                 messages.error(request, '購物車是空的')
                 return redirect('business:cart_view')
             
-            # 4. 驗證購物車商品（不檢查庫存）
+            # 4. 驗證購物車商品（不檢查庫存，一次查詢所有變體）
             order_items = []
             total_amount = Decimal('0')
+            variants = cart.active_variants()
             
             for variant_id, item_data in cart.items():
                 try:
-                    variant = Variant.objects.select_related('product').get(
-                        id=variant_id,
-                        status=VariantStatus.ACTIVE,
-                        product__status='ACTIVE'
-                    )
+                    variant = variants.get(str(variant_id))
+                    if variant is None:
+                        raise Variant.DoesNotExist
                     
                     # 直接使用購物車中儲存的價格
                     unit_price = Decimal(str(item_data['unit_price']))
@@ -1056,21 +871,29 @@ def submit_reservation(request):
             )
 
             # 6. ✅ 建立訂單項目（不扣除庫存，不記錄 used_stocks）
+            reservation_products = []
             for item in order_items:
-                OrderProduct.objects.create(
+                reservation_products.append(OrderProduct(
                     order=order,
                     variant=item['variant'],
                     product_code=item['product_code'],
                     quantity=item['quantity'],
                     unit_price=item['unit_price'],
                     used_stocks=[]  # ✅ 預訂訂單暫不記錄庫存使用
-                )
+                ))
                 
                 logger.info(
                     f'✅ 建立預訂項目：{item["variant"].name} x {item["quantity"]} 件，'
                     f'單價 ${item["unit_price"]}（未扣庫存）'
                 )
             
+            # 一次寫入所有訂單項目，訂單金額彙總於最後計算一次
+            OrderProduct.objects.bulk_create(reservation_products)
+            order.refresh_totals()
+            
+            # 更新預訂保留數量
+            VariantStockLevel.refresh_reserved(item['variant'].id for item in order_items)
+            
             # 7. ✅ 不扣除儲值（預訂不扣款）
             logger.info('⚠️ 預訂訂單不扣除儲值，待後續確認')
             
@@ -1108,10 +931,9 @@ def submit_reservation(request):
             request.session.pop('order_for_account_role', None)
             request.session.pop('order_for_account_balance', None)
             
-            # 清除購物車 cookie 並跳轉到訂單詳情頁
-            response = redirect('business:order_detail', pk=order.id)
-            response.delete_cookie('cart')
-            return response
+            # 清除購物車（回應時刪除 cookie）並跳轉到訂單詳情頁
+            cart.clear()
+            return redirect('business:order_detail', pk=order.id)
             
     except Exception as e:
         logger.error(f'❌ 提交預訂失敗：{str(e)}', exc_info=True)
@@ -1159,16 +981,8 @@ def submit_order(request):
                 order_account = user
                 logger.info(f'為自己 {order_account.username} 下單')
             
-            # 3. 從 cookie 獲取購物車
-            cart = {}
-            cart_cookie = request.COOKIES.get('cart', '{}')
-            try:
-                from urllib.parse import unquote
-                decoded_cookie = unquote(cart_cookie)
-                cart = json.loads(decoded_cookie)
-            except (json.JSONDecodeError, ValueError):
-                messages.error(request, '購物車資料錯誤')
-                return redirect('business:cart_view')
+            # 3. 獲取購物車（cookie 格式錯誤時為空購物車）
+            cart = request.cart
             
             if not cart:
                 messages.error(request, '購物車是空的')
@@ -1179,13 +993,17 @@ def submit_order(request):
             total_amount = Decimal('0')
             stock_insufficient_items = []  # 記錄庫存不足的商品
             
+            # 一次查詢購物車內所有變體及其可用庫存
+            variants = cart.active_variants()
+            available_stocks = StockAllocator.available_quantities(
+                int(variant_id) for variant_id in cart if str(variant_id).isdigit()
+            )
+            
             for variant_id, item_data in cart.items():
                 try:
-                    variant = Variant.objects.select_related('product').get(
-                        id=variant_id,
-                        status=VariantStatus.ACTIVE,
-                        product__status='ACTIVE'
-                    )
+                    variant = variants.get(str(variant_id))
+                    if variant is None:
+                        raise Variant.DoesNotExist
                     
                     # 直接使用購物車中儲存的價格
                     unit_price = Decimal(str(item_data['unit_price']))
@@ -1197,12 +1015,7 @@ def submit_order(request):
                     quantity = item_data['quantity']
                     
                     # 檢查庫存（只統計未使用的庫存）
-                    available_stock = Stock.objects.filter(
-                        product=variant,
-                        is_used=False
-                    ).aggregate(
-                        total=Sum('quantity')
-                    )['total'] or 0
+                    available_stock = available_stocks.get(variant.id, 0)
                     
                     logger.info(f'變體 {variant.id} ({variant.name}) - 需要數量：{quantity}，可用庫存：{available_stock}')
                     
@@ -1276,76 +1089,48 @@ def submit_order(request):
                 f'來源：{order.get_order_source_display()}'
             )
 
-            # 7. 建立訂單項目並扣除庫存
+            # 7. 扣除庫存（按 FIFO 原則，優先扣除最早的庫存）並建立訂單項目
+            try:
+                allocations = StockAllocator.allocate({
+                    item['variant'].id: item['quantity'] for item in order_items
+                })
+            except StockAllocationError as e:
+                shortage_names = [
+                    item['variant'].name for item in order_items
+                    if item['variant'].id in e.shortages
+                ]
+                logger.error(f'庫存扣除失敗：{e.shortages}')
+                raise StockAllocationError(
+                    f'庫存不足：{"、".join(shortage_names)}' if shortage_names else str(e),
+                    shortages=e.shortages
+                )
+            
+            order_products = []
             for item in order_items:
-                # 記錄使用的庫存
-                used_stocks_data = []
-                
-                # 扣除庫存（按 FIFO 原則，優先扣除最早的庫存）
                 variant = item['variant']
-                remaining_quantity = item['quantity']
-                
-                # 獲取該變體的所有未使用庫存（按建立時間排序）
-                stocks = Stock.objects.filter(
-                    product=variant,
-                    is_used=False,
-                    quantity__gt=0
-                ).select_for_update().order_by('created_at')
-                
-                logger.info(f'開始扣除庫存：變體 {variant.id} ({variant.name})，需扣除 {remaining_quantity} 件')
-                
-                for stock in stocks:
-                    if remaining_quantity <= 0:
-                        break
-                    
-                    # 計算本次可扣除的數量
-                    deduct_quantity = min(stock.quantity, remaining_quantity)
-                    
-                    # 記錄使用的庫存（在修改之前）
-                    used_stocks_data.append({
-                        'stock_id': stock.id,
-                        'deducted_quantity': deduct_quantity,
-                        'stock_quantity_before': stock.quantity  # 扣除前的數量
-                    })
-                    
-                    # 更新庫存
-                    stock.quantity -= deduct_quantity
-                    
-                    # 如果庫存扣完，標記為已使用
-                    if stock.quantity <= 0:
-                        stock.is_used = True
-                        stock.exchange_time = timezone.now()
-                    
-                    stock.save()
-                    
-                    remaining_quantity -= deduct_quantity
-                    
-                    logger.info(
-                        f'庫存 #{stock.id} 扣除 {deduct_quantity} 件，'
-                        f'剩餘 {stock.quantity} 件，'
-                        f'{"已用完" if stock.is_used else "仍有庫存"}'
-                    )
-                
-                # 檢查是否成功扣除所有庫存
-                if remaining_quantity > 0:
-                    logger.error(
-                        f'庫存扣除失敗：變體 {variant.id} ({variant.name})，'
-                        f'仍需扣除 {remaining_quantity} 件'
-                    )
-                    raise Exception(f'庫存不足：{variant.name}')
+                used_stocks_data = allocations[variant.id]
                 
                 # 建立訂單項目（包含使用的庫存記錄）
-                OrderProduct.objects.create(
+                order_products.append(OrderProduct(
                     order=order,
-                    variant=item['variant'],
+                    variant=variant,
                     product_code=item['product_code'],
                     quantity=item['quantity'],
                     unit_price=item['unit_price'],
                     used_stocks=used_stocks_data  # 儲存使用的庫存記錄
-                )
+                ))
                 
-                logger.info(f'✅ 成功扣除庫存：變體 {variant.id} ({variant.name})，共 {item["quantity"]} 件')
-                logger.info(f'使用的庫存記錄：{used_stocks_data}')
+                logger.info(
+                    f'✅ 成功扣除庫存：變體 {variant.id} ({variant.name})，'
+                    f'共 {item["quantity"]} 件，使用 {len(used_stocks_data)} 筆庫存'
+                )
+            
+            # 一次寫入所有訂單項目（bulk_create 不觸發 signal，訂單金額彙總於最後計算一次）
+            OrderProduct.objects.bulk_create(order_products)
+            order.refresh_totals()
+            
+            # 寫入庫存分配記錄
+            StockAllocation.record(order_products)
             
             # 8. 如果使用儲值支付，扣款並記錄
             if payment_type == PaymentType.TOPUP:
@@ -1404,10 +1189,9 @@ def submit_order(request):
             request.session.pop('order_for_account_role', None)
             request.session.pop('order_for_account_balance', None)
             
-            # 清除購物車 cookie 並跳轉到訂單詳情頁
-            response = redirect('business:order_detail', pk=order.id)
-            response.delete_cookie('cart')
-            return response
+            # 清除購物車（回應時刪除 cookie）並跳轉到訂單詳情頁
+            cart.clear()
+            return redirect('business:order_detail', pk=order.id)
             
     except Exception as e:
         logger.error(f'提交訂單失敗：{str(e)}', exc_info=True)
@@ -1482,6 +1266,7 @@ def update_reservation_product_quantity(request, order_id, product_id):
             old_quantity = order_product.quantity
             order_product.quantity = new_quantity
             order_product.save()
+            VariantStockLevel.refresh_reserved([order_product.variant_id])
             
             # 6. 重新計算訂單總額
             order.refresh_from_db()
@@ -1587,6 +1372,7 @@ def add_reservation_product(request, order_id):
             if existing_product:
                 existing_product.quantity += quantity
                 existing_product.save()
+                VariantStockLevel.refresh_reserved([variant.id])
                 
                 logger.info(
                     f'✅ 累加預訂產品數量：訂單 #{order.id}，'
@@ -1622,6 +1408,7 @@ def add_reservation_product(request, order_id):
                 unit_price=unit_price,
                 used_stocks=[]  # 預訂訂單不記錄庫存
             )
+            VariantStockLevel.refresh_reserved([variant.id])
             
             logger.info(
                 f'✅ 新增預訂產品：訂單 #{order.id}，'
@@ -1705,6 +1492,10 @@ def confirm_reservation(request, order_id):
             
             # 3. 檢查庫存
             stock_insufficient_items = []
+            available_stocks = StockAllocator.available_quantities(
+                order_product.variant_id for order_product in order.order_products.all()
+                if order_product.variant_id
+            )
             
             for order_product in order.order_products.all():
                 variant = order_product.variant
@@ -1712,10 +1503,7 @@ def confirm_reservation(request, order_id):
                     continue
                 
                 # 計算可用庫存
-                available_stock = Stock.objects.filter(
-                    product=variant,
-                    is_used=False
-                ).aggregate(total=Sum('quantity'))['total'] or 0
+                available_stock = available_stocks.get(variant.id, 0)
                 
                 if available_stock < order_product.quantity:
                     stock_insufficient_items.append({
@@ -1755,53 +1543,43 @@ def confirm_reservation(request, order_id):
                     messages.error(request, '帳號未開通儲值功能')
                     return redirect('business:order_detail', pk=order_id)
             
-            # 5. 扣除庫存
-            for order_product in order.order_products.all():
-                variant = order_product.variant
-                if not variant:
-                    continue
+            # 5. 扣除庫存（按 FIFO）
+            # 同一變體可能出現在多個訂單產品，需依序分配
+            pending_products = [op for op in order.order_products.all() if op.variant]
+            
+            while pending_products:
+                batch = {}
+                next_round = []
+                for order_product in pending_products:
+                    if order_product.variant_id in batch:
+                        next_round.append(order_product)
+                    else:
+                        batch[order_product.variant_id] = order_product
                 
-                used_stocks_data = []
-                remaining_quantity = order_product.quantity
-                
-                # 獲取該變體的所有未使用庫存（按 FIFO）
-                stocks = Stock.objects.filter(
-                    product=variant,
-                    is_used=False,
-                    quantity__gt=0
-                ).select_for_update().order_by('created_at')
+                allocations = StockAllocator.allocate({
+                    variant_id: order_product.quantity
+                    for variant_id, order_product in batch.items()
+                })
                 
-                for stock in stocks:
-                    if remaining_quantity <= 0:
-                        break
+                for variant_id, order_product in batch.items():
+                    used_stocks_data = allocations.get(variant_id, [])
                     
-                    deduct_quantity = min(stock.quantity, remaining_quantity)
+                    # 更新訂單產品的 used_stocks（整批一次寫入）
+                    order_product.used_stocks = used_stocks_data
                     
-                    # 記錄使用的庫存
-                    used_stocks_data.append({
-                        'stock_id': stock.id,
-                        'deducted_quantity': deduct_quantity,
-                        'stock_quantity_before': stock.quantity
-                    })
-                    
-                    # 更新庫存
-                    stock.quantity -= deduct_quantity
-                    if stock.quantity <= 0:
-                        stock.is_used = True
-                        stock.exchange_time = timezone.now()
-                    stock.save()
-                    
-                    remaining_quantity -= deduct_quantity
+                    logger.info(
+                        f'✅ 扣除庫存：變體 {variant_id} ({order_product.variant.name})，'
+                        f'共 {order_product.quantity} 件，'
+                        f'使用 {len(used_stocks_data)} 筆庫存'
+                    )
                 
-                # 更新訂單產品的 used_stocks
-                order_product.used_stocks = used_stocks_data
-                order_product.save()
+                # 一次更新本批訂單產品的 used_stocks（數量與單價不變，不需重新計算訂單金額）
+                OrderProduct.objects.bulk_update(batch.values(), ['used_stocks'])
                 
-                logger.info(
-                    f'✅ 扣除庫存：變體 {variant.id} ({variant.name})，'
-                    f'共 {order_product.quantity} 件，'
-                    f'使用 {len(used_stocks_data)} 筆庫存'
-                )
+                # 寫入庫存分配記錄
+                StockAllocation.record(batch.values())
+                
+                pending_products = next_round
             
             # 6. 扣除儲值
             if payment_type == PaymentType.TOPUP:
@@ -1828,6 +1606,9 @@ def confirm_reservation(request, order_id):
             # 7. 更新訂單狀態
             order.status = OrderStatus.PAID
             order.save()
+            VariantStockLevel.refresh_reserved(
+                order_product.variant_id for order_product in order.order_products.all()
+            )
             
             messages.success(
                 request,
@@ -2024,18 +1805,12 @@ class OrderListView(LoginRequiredMixin, ListView):
             queryset = queryset.filter(order_source=order_source)
             logger.info(f'訂單來源篩選：{order_source}')
         
-        # 6. 搜尋功能（訂單編號、帳號名稱、產品代碼）
+        # 6. 搜尋功能（訂單編號、帳號、姓名、公司、產品代碼、產品名稱、備註）
         search_query = self.request.GET.get('q')
         if search_query:
             queryset = queryset.filter(
-                Q(id__icontains=search_query) |  # 訂單編號
-                Q(account__username__icontains=search_query) |  # 帳號
-                Q(account__fullname__icontains=search_query) |  # 姓名
-                Q(account__company__icontains=search_query) |  # 公司
-                Q(order_products__product_code__icontains=search_query) |  # 產品代碼
-                Q(order_products__variant__name__icontains=search_query) |  # 產品名稱
-                Q(remark__icontains=search_query)  # 備註
-            ).distinct()
+                id__in=OrderSearchTerm.search(search_query)
+            )
         
         # 7. 排序（使用 OrderStatus 定義的順序）
         from django.db.models import Case, When, IntegerField
@@ -2097,21 +1872,21 @@ class OrderListView(LoginRequiredMixin, ListView):
         context['date_from'] = self.request.GET.get('date_from', '')
         context['date_to'] = self.request.GET.get('date_to', '')
         
-        # 3. 統計資料（根據當前篩選條件）
-        orders = self.get_queryset()
+        # 3. 統計資料（根據當前篩選條件，沿用已建立的 queryset，一次分組查詢）
+        status_counts = get_facet_counts(self.object_list, 'status')
         
-        context['total_orders'] = orders.count()
+        context['total_orders'] = sum(status_counts.values())
         
         # ✅ 按所有狀態統計
-        context['holding_count'] = orders.filter(status=OrderStatus.HOLDING).count()  
-        context['pending_count'] = orders.filter(status=OrderStatus.PENDING).count()
-        context['wait_count'] = orders.filter(status=OrderStatus.WAIT).count()
-        context['paid_count'] = orders.filter(status=OrderStatus.PAID).count()
-        context['wait_ship_count'] = orders.filter(status=OrderStatus.WAIT_SHIP).count()
-        context['shipping_count'] = orders.filter(status=OrderStatus.SHIPPING).count()
-        context['wait_pickup_count'] = orders.filter(status=OrderStatus.WAIT_PICKUP).count()
-        context['done_count'] = orders.filter(status=OrderStatus.DONE).count()
-        context['cancelled_count'] = orders.filter(status=OrderStatus.CANCELLED).count()
+        context['holding_count'] = status_counts.get(OrderStatus.HOLDING, 0)
+        context['pending_count'] = status_counts.get(OrderStatus.PENDING, 0)
+        context['wait_count'] = status_counts.get(OrderStatus.WAIT, 0)
+        context['paid_count'] = status_counts.get(OrderStatus.PAID, 0)
+        context['wait_ship_count'] = status_counts.get(OrderStatus.WAIT_SHIP, 0)
+        context['shipping_count'] = status_counts.get(OrderStatus.SHIPPING, 0)
+        context['wait_pickup_count'] = status_counts.get(OrderStatus.WAIT_PICKUP, 0)
+        context['done_count'] = status_counts.get(OrderStatus.DONE, 0)
+        context['cancelled_count'] = status_counts.get(OrderStatus.CANCELLED, 0)
         
         # 4. 權限資訊
         context['is_headquarter'] = is_headquarter_admin(user)
@@ -2363,69 +2138,57 @@ class OrderProductDetailView(LoginRequiredMixin, DetailView):
         user = self.request.user
         context['is_headquarter'] = is_headquarter_admin(user)
         
-        # 解析 used_stocks JSON 資料，獲取詳細庫存資訊
-        used_stocks_details = []
-        if order_product.used_stocks:
-            for stock_record in order_product.used_stocks:
-                stock_id = stock_record.get('stock_id')
-                try:
-                    stock = Stock.objects.get(id=stock_id)
-                    used_stocks_details.append({
-                        'stock': stock,
-                        'deducted_quantity': stock_record.get('deducted_quantity'),
-                        'stock_quantity_before': stock_record.get('stock_quantity_before')
-                    })
-                except Stock.DoesNotExist:
-                    # 如果庫存已被刪除，顯示基本資訊
-                    used_stocks_details.append({
-                        'stock': None,
-                        'stock_id': stock_id,
-                        'deducted_quantity': stock_record.get('deducted_quantity'),
-                        'note': '庫存記錄已刪除'
-                    })
+        # 由庫存分配記錄獲取詳細庫存資訊（一次查詢所有庫存，兩種明細共用）
+        used_stocks = StockAllocation.used_stocks_for([order_product])[order_product.id]
+        resolver = UsedStockResolver(used_stocks)
+        used_stocks_details = resolver.details(used_stocks)
         
         context['used_stocks_details'] = used_stocks_details
         
         # 如果是 ESIMIMG 類型，提取 QR Code 資訊
         if order_product.variant and order_product.variant.product_type == ProductType.ESIMIMG:
             esimimg_details = []
+            qr_items = resolver.units(used_stocks)
+            product_name = order_product.variant.product.name
+            variant_name = order_product.variant.name
             
-            # 從 used_stocks 中獲取每個庫存的詳細資訊
-            for idx, stock_record in enumerate(order_product.used_stocks, start=1):
-                stock_id = stock_record.get('stock_id')
-                deducted_quantity = stock_record.get('deducted_quantity', 0)
-                
-                try:
-                    stock = Stock.objects.get(id=stock_id)
-                    
-                    # ESIMIMG 每個 Stock 應該對應一張圖片 (quantity=1)
-                    # 但為了相容舊資料，還是檢查 deducted_quantity
-                    for _ in range(int(deducted_quantity)):
-                        esimimg_details.append({
-                            'sequence': len(esimimg_details) + 1,  # 全域順序編號
-                            'stock': stock,
-                            'code': stock.code,  # QR Code 代碼
-                            'qr_img_url': stock.qr_img.url if stock.qr_img else None,  # QR 圖片 URL
-                            'product_name': order_product.variant.product.name,  # Product.name
-                            'variant_name': order_product.variant.name,  # Variant.name
-                            'exchange_time': stock.exchange_time,  # 兌換時間
-                            'is_used': stock.is_used,  # 是否已使用
-                        })
-                        
-                except Stock.DoesNotExist:
+            # 頁面只顯示縮圖，點擊時才載入原圖（尚未產生縮圖的改用原圖）
+            thumbnail_urls = QRThumbnail.urls_for([stock for _, stock, _ in qr_items])
+            
+            for sequence, stock, stock_id in qr_items:
+                if stock is not None:
+                    esimimg_details.append({
+                        'sequence': sequence,  # 全域順序編號
+                        'stock': stock,
+                        'code': stock.code,  # QR Code 代碼
+                        'qr_img_url': stock.qr_img.url if stock.qr_img else None,  # QR 圖片 URL
+                        'thumbnail_url': thumbnail_urls.get(stock.id),  # QR 縮圖 URL
+                        'product_name': product_name,  # Product.name
+                        'variant_name': variant_name,  # Variant.name
+                        'exchange_time': stock.exchange_time,  # 兌換時間
+                        'is_used': stock.is_used,  # 是否已使用
+                    })
+                else:
                     # 庫存已刪除，顯示佔位符
-                    for _ in range(int(deducted_quantity)):
-                        esimimg_details.append({
-                            'sequence': len(esimimg_details) + 1,
-                            'stock': None,
-                            'code': f'已刪除 (ID: {stock_id})',
-                            'qr_img_url': None,
-                            'product_name': order_product.variant.product.name if order_product.variant else '未知',
-                            'variant_name': order_product.variant.name if order_product.variant else '未知',
-                            'exchange_time': None,
-                            'is_used': False,
-                        })
+                    esimimg_details.append({
+                        'sequence': sequence,
+                        'stock': None,
+                        'code': f'已刪除 (ID: {stock_id})',
+                        'qr_img_url': None,
+                        'thumbnail_url': None,
+                        'product_name': product_name,
+                        'variant_name': variant_name,
+                        'exchange_time': None,
+                        'is_used': False,
+                    })
             
+            # 只列出已由 generate_qr_thumbnails 產生的聯絡表頁面
+            sheet_pages = QRContactSheet.pages(QRContactSheet.items_for(qr_items))
+            context['qr_sheet_pages'] = [
+                page for page, items in sheet_pages
+                if QRContactSheet.storage.exists(QRContactSheet.name_for(order_product.id, page, items))
+            ]
+            context['qr_sheet_pending'] = len(context['qr_sheet_pages']) < len(sheet_pages)
             context['esimimg_details'] = esimimg_details
             context['is_esimimg'] = True
             
@@ -2447,6 +2210,71 @@ class OrderProductDetailView(LoginRequiredMixin, DetailView):
         return context
 
 
+# ESIMIMG QR 聯絡表
+class OrderProductQRSheetView(OrderProductDetailView):
+    """
+    提供訂單產品的 QR Code 聯絡表 PNG（每頁 QR_CONTACT_SHEET_PAGE_SIZE 張，?page= 指定頁碼）
+
+    聯絡表由 generate_qr_thumbnails 指令預先產生，尚未產生時回傳 404，不在請求中產生。
+    權限同 OrderProductDetailView
+    """
+
+    def get(self, request, *args, **kwargs):
+        order_product = self.get_object()
+        if not order_product.variant or order_product.variant.product_type != ProductType.ESIMIMG:
+            raise Http404('此訂單產品不是圖庫 eSIM')
+
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 1
+
+        used_stocks = StockAllocation.used_stocks_for([order_product])[order_product.id]
+        units = UsedStockResolver(used_stocks).units(used_stocks)
+        page, items = QRContactSheet.page(QRContactSheet.items_for(units), page)
+
+        name = QRContactSheet.name_for(order_product.id, page, items)
+        if not items or not QRContactSheet.storage.exists(name):
+            raise Http404('聯絡表尚未產生，請稍後再試')
+
+        response = FileResponse(QRContactSheet.storage.open(name, 'rb'), content_type='image/png')
+        response['Content-Disposition'] = (
+            f'inline; filename="{order_product.order.id}_{order_product.id}_qr_sheet_{page}.png"'
+        )
+        return response
+
+
+# ESIMIMG QR 圖片打包下載
+class OrderProductQRArchiveView(OrderProductDetailView):
+    """
+    將訂單產品的所有 QR 原圖打包為 ZIP 下載（檔名：{順序編號}_{代碼}，沒有代碼時為 {順序編號}_ID{庫存 ID}）
+
+    權限同 OrderProductDetailView
+    """
+
+    def get(self, request, *args, **kwargs):
+        order_product = self.get_object()
+        if not order_product.variant or order_product.variant.product_type != ProductType.ESIMIMG:
+            raise Http404('此訂單產品不是圖庫 eSIM')
+
+        used_stocks = StockAllocation.used_stocks_for([order_product])[order_product.id]
+        units = UsedStockResolver(used_stocks).units(used_stocks)
+        entries = [
+            (f'{sequence:04d}_{stock_label(stock)}' if stock else f'{sequence:04d}_deleted_{stock_id}', stock)
+            for sequence, stock, stock_id in units
+        ]
+        archive_file, missing = build_qr_archive(entries)
+        if missing:
+            logger.warning(f'訂單產品 {order_product.id} 打包 QR 圖片時缺少 {len(missing)} 張圖片')
+
+        return FileResponse(
+            archive_file,
+            as_attachment=True,
+            filename=f'{order_product.order.id}_{order_product.id}_qr.zip',
+            content_type='application/zip'
+        )
+
+
 # RECHARGEABLE 卡號管理視圖
 class RechargeableCodesManageView(LoginRequiredMixin, DetailView):
     """
@@ -2597,42 +2425,54 @@ def save_rechargeable_codes(request, order_id, product_id):
                 messages.error(request, '此功能僅適用於充值卡（RECHARGEABLE）類型的產品')
                 return redirect('business:order_product_detail', order_id=order_id, product_id=product_id)
             
-            # 3. 解析 POST 資料
-            updated_count = 0
-            duplicate_codes = []
-            
+            # 3. 解析 POST 資料（依表單順序）
+            submitted = []
             for key, value in request.POST.items():
                 if key.startswith('sn_code_'):
                     # 提取 coupon_id
-                    coupon_id = key.replace('sn_code_', '')
-                    sn_code = value.strip()
-                    
-                    try:
-                        coupon = OrderCoupons.objects.get(
-                            id=coupon_id,
-                            order_product=order_product
-                        )
-                        
-                        # 檢查 sn_code 是否重複（如果有填寫）
-                        if sn_code:
-                            # 檢查是否與其他 Coupon 重複（排除自己）
-                            duplicate = OrderCoupons.objects.filter(
-                                sn_code=sn_code
-                            ).exclude(id=coupon.id).exists()
-                            
-                            if duplicate:
-                                duplicate_codes.append(sn_code)
-                                continue
-                        
-                        # 更新 sn_code
-                        if coupon.sn_code != sn_code:
-                            coupon.sn_code = sn_code
-                            coupon.save()
-                            updated_count += 1
-                            
-                    except OrderCoupons.DoesNotExist:
-                        logger.warning(f'OrderCoupon {coupon_id} 不存在')
+                    submitted.append((key.replace('sn_code_', ''), value.strip()))
+            
+            # 一次載入本訂單產品的所有相關 Coupon
+            coupon_ids = [coupon_id for coupon_id, _ in submitted if coupon_id.isdigit()]
+            coupons = OrderCoupons.objects.filter(
+                order_product=order_product
+            ).in_bulk(coupon_ids)
+            
+            # 檢查 sn_code 是否重複：
+            # - 與本次未提交的其他 Coupon 重複（一次 sn_code__in 查詢）
+            # - 本次提交的卡號彼此重複（保留第一個）
+            existing_codes = OrderCoupons.find_existing_sn_codes(
+                [sn_code for _, sn_code in submitted],
+                queryset=OrderCoupons.objects.exclude(id__in=list(coupons))
+            )
+            
+            duplicate_codes = []
+            seen_codes = set()
+            changed_coupons = []
+            now = timezone.now()
+            
+            for coupon_id, sn_code in submitted:
+                coupon = coupons.get(int(coupon_id)) if coupon_id.isdigit() else None
+                if coupon is None:
+                    logger.warning(f'OrderCoupon {coupon_id} 不存在')
+                    continue
+                
+                if sn_code:
+                    if sn_code in existing_codes or sn_code in seen_codes:
+                        duplicate_codes.append(sn_code)
                         continue
+                    seen_codes.add(sn_code)
+                
+                # 更新 sn_code
+                if coupon.sn_code != sn_code:
+                    coupon.sn_code = sn_code
+                    coupon.updated_at = now
+                    changed_coupons.append(coupon)
+            
+            OrderCoupons.objects.bulk_update(
+                changed_coupons, ['sn_code', 'updated_at'], batch_size=500
+            )
+            updated_count = len(changed_coupons)
             
             # 4. 顯示結果訊息
             if duplicate_codes:
@@ -2663,14 +2503,14 @@ def save_rechargeable_codes(request, order_id, product_id):
         return redirect('business:rechargeable_codes_manage', order_id=order_id, product_id=product_id)
 
 
-# 批量匯入 RECHARGEABLE 卡號（CSV）
+# 批量匯入 RECHARGEABLE 卡號（CSV / XLSX）
 @login_required
 @require_POST
 def import_rechargeable_codes_csv(request, order_id, product_id):
     """
-    透過 CSV 批量匯入 RECHARGEABLE 產品的卡號
+    透過 CSV 或 XLSX 批量匯入 RECHARGEABLE 產品的卡號
     
-    CSV 格式：
+    檔案格式：
     - 第一欄：序號（可選）
     - 第二欄：卡號 (sn_code)
     
@@ -2683,170 +2523,119 @@ def import_rechargeable_codes_csv(request, order_id, product_id):
     ABC123456789
     DEF987654321
     GHI456789123
+    
+    處理方式：
+    1. 上傳檔案存檔並建立 ImportJob
+    2. 在時間上限內分批匯入（見 ImportJob.run）
+    3. 回傳工作進度，未完成的部分由前端輪詢 import_job_status 繼續處理
     """
     logger = logging.getLogger(__name__)
     
-    # 權限檢查：只有總公司管理員可以編輯
-    # if not is_headquarter_admin(request.user):
-    #     return JsonResponse({
-    #         'success': False,
-    #         'error': '權限不足：只有總公司管理員可以匯入卡號'
-    #     }, status=403)
+    # 權限檢查：只有總公司管理員可以匯入
+    if not is_headquarter_admin(request.user):
+        return JsonResponse({
+            'success': False,
+            'error': '權限不足：只有總公司管理員可以匯入卡號'
+        }, status=403)
     
     # 檢查是否有上傳檔案
     if 'csv_file' not in request.FILES:
         return JsonResponse({
             'success': False,
-            'error': '請選擇 CSV 檔案'
+            'error': '請選擇 CSV 或 XLSX 檔案'
         }, status=400)
     
     csv_file = request.FILES['csv_file']
     
     # 檢查檔案類型
-    if not csv_file.name.endswith('.csv'):
+    if not csv_file.name.lower().endswith(('.csv', '.xlsx')):
         return JsonResponse({
             'success': False,
-            'error': '請上傳 CSV 格式的檔案'
+            'error': '請上傳 CSV 或 XLSX 格式的檔案'
         }, status=400)
     
     try:
-        with transaction.atomic():
-            # 1. 獲取訂單產品
-            try:
-                order_product = OrderProduct.objects.select_related(
-                    'order',
-                    'variant'
-                ).get(
-                    id=product_id,
-                    order__id=order_id
-                )
-            except OrderProduct.DoesNotExist:
-                return JsonResponse({
-                    'success': False,
-                    'error': f'訂單產品不存在'
-                }, status=404)
-            
-            # 2. 檢查產品類型
-            if not order_product.variant or order_product.variant.product_type != ProductType.RECHARGEABLE:
-                return JsonResponse({
-                    'success': False,
-                    'error': '此功能僅適用於充值卡（RECHARGEABLE）類型的產品'
-                }, status=400)
-            
-            # 3. 讀取 CSV 檔案
-            try:
-                # 嘗試使用 UTF-8 編碼讀取
-                decoded_file = csv_file.read().decode('utf-8')
-            except UnicodeDecodeError:
-                try:
-                    # 如果 UTF-8 失敗，嘗試 Big5（繁體中文 Excel 常用）
-                    csv_file.seek(0)
-                    decoded_file = csv_file.read().decode('big5')
-                except UnicodeDecodeError:
-                    return JsonResponse({
-                        'success': False,
-                        'error': 'CSV 檔案編碼錯誤，請使用 UTF-8 或 Big5 編碼'
-                    }, status=400)
-            
-            # 4. 解析 CSV
-            csv_reader = csv.reader(io.StringIO(decoded_file))
-            
-            # 讀取所有 sn_code（過濾空白行）
-            sn_codes = []
-            for row_num, row in enumerate(csv_reader, start=1):
-                if not row:  # 跳過空行
-                    continue
-                
-                # 檢查是否為標題行（包含 "序號" 或 "卡號" 等關鍵字）
-                if row_num == 1 and any(keyword in str(row).lower() for keyword in ['序號', '卡號', 'sn_code', 'sequence']):
-                    logger.info('跳過 CSV 標題行')
-                    continue
-                
-                # 提取卡號（支援兩種格式）
-                if len(row) >= 2:
-                    # 格式 1：序號,卡號
-                    sn_code = row[1].strip()
-                elif len(row) >= 1:
-                    # 格式 2：只有卡號
-                    sn_code = row[0].strip()
-                else:
-                    continue
-                
-                if sn_code:
-                    sn_codes.append(sn_code)
-            
-            if not sn_codes:
-                return JsonResponse({
-                    'success': False,
-                    'error': 'CSV 檔案中沒有有效的卡號'
-                }, status=400)
-            
-            logger.info(f'從 CSV 讀取到 {len(sn_codes)} 個卡號')
-            
-            # 5. 獲取所有 OrderCoupons（按序號排序）
-            coupons = OrderCoupons.objects.filter(
-                order_product=order_product
-            ).order_by('id')
-            
-            # 6. 檢查數量是否匹配
-            coupon_count = coupons.count()
-            if len(sn_codes) > coupon_count:
-                return JsonResponse({
-                    'success': False,
-                    'error': f'CSV 中的卡號數量（{len(sn_codes)}）超過訂單產品數量（{coupon_count}）'
-                }, status=400)
-            
-            # 7. 檢查卡號重複
-            duplicate_codes = []
-            for sn_code in sn_codes:
-                # 檢查是否與現有 Coupon 重複（排除即將更新的 Coupon）
-                existing_coupon = OrderCoupons.objects.filter(
-                    sn_code=sn_code
-                ).exclude(
-                    order_product=order_product
-                ).first()
-                
-                if existing_coupon:
-                    duplicate_codes.append(sn_code)
-            
-            if duplicate_codes:
-                return JsonResponse({
-                    'success': False,
-                    'error': f'以下卡號已存在於其他訂單：{", ".join(duplicate_codes[:5])}{"..." if len(duplicate_codes) > 5 else ""}'
-                }, status=400)
-            
-            # 8. 批量更新卡號（按順序匹配）
-            updated_count = 0
-            for idx, coupon in enumerate(coupons):
-                if idx < len(sn_codes):
-                    new_sn_code = sn_codes[idx]
-                    
-                    # 只更新有變化的卡號
-                    if coupon.sn_code != new_sn_code:
-                        coupon.sn_code = new_sn_code
-                        coupon.save()
-                        updated_count += 1
-            
-            logger.info(
-                f'✅ CSV 批量匯入完成：訂單 #{order_id}，產品 #{product_id}，'
-                f'更新 {updated_count} 筆卡號'
+        # 1. 獲取訂單產品
+        try:
+            order_product = OrderProduct.objects.select_related(
+                'order',
+                'variant'
+            ).get(
+                id=product_id,
+                order__id=order_id
             )
-            
+        except OrderProduct.DoesNotExist:
             return JsonResponse({
-                'success': True,
-                'updated_count': updated_count,
-                'total_codes': len(sn_codes),
-                'message': f'成功匯入 {len(sn_codes)} 個卡號，更新 {updated_count} 筆'
-            })
+                'success': False,
+                'error': f'訂單產品不存在'
+            }, status=404)
+        
+        # 2. 檢查產品類型
+        if not order_product.variant or order_product.variant.product_type != ProductType.RECHARGEABLE:
+            return JsonResponse({
+                'success': False,
+                'error': '此功能僅適用於充值卡（RECHARGEABLE）類型的產品'
+            }, status=400)
+        
+        # 3. 建立匯入工作並在時間上限內處理
+        job = ImportJob.create_for_upload(order_product, csv_file, request.user)
+        logger.info(
+            f'建立卡號匯入工作 #{job.id}：訂單 #{order_id}，產品 #{product_id}，'
+            f'檔案 {job.file_name}（編碼：{job.encoding or "XLSX"}）'
+        )
+        job.run()
+        
+        return JsonResponse({
+            'success': job.status != ImportJobStatus.FAILED,
+            'error': job.message if job.status == ImportJobStatus.FAILED else '',
+            'job': job.to_dict(),
+            'status_url': reverse('business:import_job_status', args=[job.id])
+        })
             
     except Exception as e:
-        logger.error(f'❌ CSV 匯入失敗：{str(e)}', exc_info=True)
+        logger.error(f'❌ 卡號匯入失敗：{str(e)}', exc_info=True)
         return JsonResponse({
             'success': False,
             'error': f'匯入失敗：{str(e)}'
         }, status=500)
 
 
+# 卡號匯入工作進度
+@login_required
+def import_job_status(request, job_id):
+    """
+    查詢卡號匯入工作進度（前端輪詢）
+    
+    工作尚未結束時，每次輪詢會在時間上限內繼續處理下一批。
+    """
+    logger = logging.getLogger(__name__)
+    
+    job = get_object_or_404(ImportJob, pk=job_id)
+    
+    # 權限檢查：建立人或總公司管理員
+    if job.created_by_id != request.user.id and not is_headquarter_admin(request.user):
+        return JsonResponse({
+            'success': False,
+            'error': '權限不足'
+        }, status=403)
+    
+    try:
+        job.run()
+    except Exception as e:
+        logger.error(f'❌ 匯入工作 #{job.id} 處理失敗：{str(e)}', exc_info=True)
+        return JsonResponse({
+            'success': False,
+            'error': f'匯入失敗：{str(e)}',
+            'job': job.to_dict()
+        }, status=500)
+    
+    return JsonResponse({
+        'success': job.status != ImportJobStatus.FAILED,
+        'error': job.message if job.status == ImportJobStatus.FAILED else '',
+        'job': job.to_dict()
+    })
+
+
 # 刪除訂單
 class DeleteOrderView(LoginRequiredMixin, UserPassesTestMixin, View):
     """
@@ -2919,8 +2708,17 @@ class DeleteOrderView(LoginRequiredMixin, UserPassesTestMixin, View):
                 order_total = order.total_amount
                 payment_type = order.payment_type
                 
-                # 4. 恢復庫存（根據 used_stocks 記錄）
+                # 4. 恢復庫存（根據庫存分配記錄，一次鎖定所有訂單產品使用的庫存）
                 restored_stocks = []
+                order_products = [
+                    order_product for order_product in order.order_products.all()
+                    if order_product.variant
+                ]
+                allocated_stocks = StockAllocation.used_stocks_for(order_products)
+                resolver = UsedStockResolver(
+                    [entry for entries in allocated_stocks.values() for entry in entries],
+                    lock=True
+                )
                 
                 for order_product in order.order_products.all():
                     variant = order_product.variant
@@ -2929,8 +2727,8 @@ class DeleteOrderView(LoginRequiredMixin, UserPassesTestMixin, View):
                         logger.warning(f'訂單產品 #{order_product.id} 的變體已被刪除，跳過庫存恢復')
                         continue
                     
-                    # 從 used_stocks 獲取使用的庫存記錄
-                    used_stocks_data = order_product.used_stocks
+                    # 從庫存分配記錄獲取使用的庫存
+                    used_stocks_data = allocated_stocks[order_product.id]
                     
                     if not used_stocks_data:
                         logger.warning(
@@ -2944,41 +2742,23 @@ class DeleteOrderView(LoginRequiredMixin, UserPassesTestMixin, View):
                         f'共 {len(used_stocks_data)} 筆庫存記錄'
                     )
                     
-                    # 按記錄逐一恢復庫存
-                    for stock_data in used_stocks_data:
-                        stock_id = stock_data['stock_id']
-                        deducted_quantity = stock_data['deducted_quantity']
-                        
-                        try:
-                            stock = Stock.objects.select_for_update().get(id=stock_id)
-                            
-                            # 恢復庫存數量
-                            stock.quantity += deducted_quantity
-                            
-                            # 如果庫存恢復到大於 0，取消已使用標記
-                            if stock.quantity > 0:
-                                stock.is_used = False
-                                stock.exchange_time = None
-                            
-                            stock.save()
-                            
-                            restored_stocks.append({
-                                'stock_id': stock.id,
-                                'variant_name': variant.name,
-                                'restored_quantity': deducted_quantity,
-                                'current_quantity': stock.quantity
-                            })
-                            
-                            logger.info(
-                                f'庫存 #{stock.id} 恢復 {deducted_quantity} 件，'
-                                f'當前數量：{stock.quantity} 件'
-                            )
-                            
-                        except Stock.DoesNotExist:
-                            logger.warning(
-                                f'❌ 庫存 #{stock_id} 已被刪除，無法恢復 {deducted_quantity} 件'
-                            )
-                            continue
+                    # 一次恢復該訂單產品使用的所有庫存
+                    restored, missing_stock_ids = StockAllocator.release(used_stocks_data, resolver=resolver)
+                    
+                    for entry in restored:
+                        restored_stocks.append({
+                            'stock_id': entry['stock_id'],
+                            'variant_name': variant.name,
+                            'restored_quantity': entry['restored_quantity'],
+                            'current_quantity': entry['current_quantity']
+                        })
+                    
+                    logger.info(f'恢復 {len(restored)} 筆庫存：變體 {variant.id} ({variant.name})')
+                    
+                    if missing_stock_ids:
+                        logger.warning(f'❌ 庫存 {missing_stock_ids} 已被刪除，無法恢復')
+                
+                StockAllocation.release(order_products)
                 
                 # 5. 如果使用儲值支付，退款並記錄異動
                 refund_log = None
@@ -3199,9 +2979,9 @@ def delete_order_product(request, order_id, product_id):
             payment_type = order.payment_type
             product_amount = order_product.amount
             
-            # 6. 恢復庫存（根據 used_stocks 記錄）
+            # 6. 恢復庫存（根據庫存分配記錄）
             variant = order_product.variant
-            used_stocks_data = order_product.used_stocks
+            used_stocks_data = StockAllocation.used_stocks_for([order_product])[order_product.id]
             restored_stocks = []
             
             if variant and used_stocks_data:
@@ -3210,41 +2990,22 @@ def delete_order_product(request, order_id, product_id):
                     f'共 {len(used_stocks_data)} 筆庫存記錄'
                 )
                 
-                # 按記錄逐一恢復庫存
-                for stock_data in used_stocks_data:
-                    stock_id = stock_data['stock_id']
-                    deducted_quantity = stock_data['deducted_quantity']
-                    
-                    try:
-                        stock = Stock.objects.select_for_update().get(id=stock_id)
-                        
-                        # 恢復庫存數量
-                        stock.quantity += deducted_quantity
-                        
-                        # 如果庫存恢復到大於 0，取消已使用標記
-                        if stock.quantity > 0:
-                            stock.is_used = False
-                            stock.exchange_time = None
-                        
-                        stock.save()
-                        
-                        restored_stocks.append({
-                            'stock_id': stock.id,
-                            'variant_name': variant.name,
-                            'restored_quantity': deducted_quantity,
-                            'current_quantity': stock.quantity
-                        })
-                        
-                        logger.info(
-                            f'✅ 庫存 #{stock.id} 恢復 {deducted_quantity} 件，'
-                            f'當前數量：{stock.quantity} 件'
-                        )
-                        
-                    except Stock.DoesNotExist:
-                        logger.warning(
-                            f'❌ 庫存 #{stock_id} 已被刪除，無法恢復 {deducted_quantity} 件'
-                        )
-                        continue
+                # 一次恢復所有使用的庫存
+                restored, missing_stock_ids = StockAllocator.release(used_stocks_data)
+                
+                for entry in restored:
+                    restored_stocks.append({
+                        'stock_id': entry['stock_id'],
+                        'variant_name': variant.name,
+                        'restored_quantity': entry['restored_quantity'],
+                        'current_quantity': entry['current_quantity']
+                    })
+                
+                StockAllocation.release([order_product])
+                logger.info(f'✅ 恢復 {len(restored)} 筆庫存')
+                
+                if missing_stock_ids:
+                    logger.warning(f'❌ 庫存 {missing_stock_ids} 已被刪除，無法恢復')
             else:
                 if not variant:
                     logger.warning(f'訂單產品的變體已被刪除，跳過庫存恢復')
@@ -3254,6 +3015,8 @@ def delete_order_product(request, order_id, product_id):
             # 7. 刪除訂單產品
             product_name = order_product.variant.name if order_product.variant else "已下架商品"
             order_product.delete()
+            if order.status == OrderStatus.HOLDING:
+                VariantStockLevel.refresh_reserved([order_product.variant_id])
             
             logger.info(f'✅ 已刪除訂單產品：{product_name}')
             
@@ -3474,7 +3237,7 @@ class ReceiptListView(LoginRequiredMixin, ListView):
         # 統計資料
         receipts = self.get_queryset()
         context['total_receipts'] = receipts.count()
-        context['total_amount'] = sum(r.total_amount for r in receipts)
+        context['total_amount'] = receipts.aggregate(amount_sum=Sum('total_amount'))['amount_sum'] or 0
         
         # ✅ 按收據類型統計
         context['order_receipt_count'] = receipts.filter(receipt_type=ReceiptType.ORDER).count()
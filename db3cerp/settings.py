@@ -91,6 +91,8 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    # 購物車：request.cart（每個請求解析 cookie 一次）
+    'business.middleware.CartMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # Add the account middleware:
     "allauth.account.middleware.AccountMiddleware",
@@ -174,12 +176,21 @@ STATICFILES_DIRS = [
 STATIC_ROOT = os.path.join(BASE_DIR, 'collectedstatic')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# 不對外提供的上傳檔案（匯入中的卡號檔案等），不可位於 MEDIA_ROOT 之下
+PRIVATE_MEDIA_ROOT = os.path.join(BASE_DIR, 'private_media')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 購物車儲存後端（見 business/cart.py）
+# - cookie：整個購物車存於 cookie（受瀏覽器 4KB 限制，預設，與原本行為相同）
+# - db：存於 StoredCart 資料表，cookie 只存 token（需設定 CART_STORE=db 啟用，
+#   並定期執行 clear_expired_carts 清除過期購物車）
+# - cache：存於 Django 快取（預設為本機記憶體快取），cookie 只存 token
+CART_STORE = os.getenv('CART_STORE', 'cookie')
+
 # Logging 日誌設定
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 LOGGING = {
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from products.models import Supplier, Category, Product, Variant, AgentDistributorPricing, Stock
+from django.db import transaction
+from products.models import Supplier, Category, Product, Variant, AgentDistributorPricing, Stock, VariantStockLevel
 
 # Register your models here.
 class SupplierAdmin(admin.ModelAdmin):
@@ -66,6 +67,24 @@ class StockAdmin(admin.ModelAdmin):
         ('Stock Info', {'fields': ('name', 'description', 'product', 'code', 'qr_img', 'initial_quantity', 'quantity', 'expire_date', 'is_used', 'exchange_time', 'created_at', 'updated_at')}),
     )
 
+    # 同步更新庫存彙總
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            before = Stock.objects.select_for_update().get(pk=obj.pk) if change else None
+            super().save_model(request, obj, form, change)
+            VariantStockLevel.apply_stock_change(before=before, after=obj)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            VariantStockLevel.apply_stock_change(before=obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            variant_ids = set(queryset.values_list('product_id', flat=True))
+            super().delete_queryset(request, queryset)
+            VariantStockLevel.rebuild(variant_ids)
+
 admin.site.register(Supplier, SupplierAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Product, ProductAdmin)
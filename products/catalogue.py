@@ -0,0 +1,448 @@
+import logging
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db.models import Prefetch, Q
+
+from products.constant import ProductStatus, VariantStatus, ProductType, CATALOGUE_CACHE_TIMEOUT
+from products.utils import parse_days, parse_data_amount
+
+logger = logging.getLogger(__name__)
+
+
+# 產品目錄快照
+class CatalogueSnapshot:
+    """
+    上架產品目錄的快取快照
+
+    依可見的產品類型分別快取（總公司看全部類型，其他角色不含成品卡），內容包含：
+    - products：有上架變體的上架產品（依 sort_order、id 排序），
+      已預載該類型範圍內的上架變體
+    - categories：上述產品所屬的分類（依 sort_order 排序）
+
+    產品、變體或分類異動時由 products.signals 呼叫 invalidate（遞增資料庫中的 CatalogueVersion），
+    快照只保存與角色無關、不常變動的資料：
+    可用庫存每次取得快照時由 VariantStockLevel 一次查詢覆寫（變體的 stock_quantity、has_stock），
+    價格仍由 PriceBook 依用戶角色即時計算。
+
+    使用方式：
+        snapshot = CatalogueSnapshot.get(CatalogueSnapshot.allowed_types_for(user))
+        products = snapshot.filter(category_id=..., product_type=..., search_query=...)
+    """
+    KEY_PREFIX = 'catalogue:'
+
+    # 非總公司角色可見的產品類型
+    RESTRICTED_TYPES = (ProductType.ESIM, ProductType.ESIMIMG, ProductType.RECHARGEABLE)
+
+    def __init__(self, products, categories, allowed_types=None):
+        self.products = products
+        self.categories = categories
+        self.allowed_types = allowed_types
+
+    @classmethod
+    def allowed_types_for(cls, user):
+        """
+        用戶可見的產品類型
+
+        Returns:
+            tuple 或 None（None 表示全部類型）
+        """
+        from accounts.utils import is_headquarter_admin
+
+        if user.is_authenticated and is_headquarter_admin(user):
+            return None
+        return cls.RESTRICTED_TYPES
+
+    @classmethod
+    def _cache_key(cls, allowed_types):
+        from products.models import CatalogueVersion
+
+        version = CatalogueVersion.current()
+        types_key = ','.join(sorted(allowed_types)) if allowed_types else 'all'
+        return f'{cls.KEY_PREFIX}{version}:{types_key}'
+
+    @classmethod
+    def get(cls, allowed_types=None):
+        """
+        取得快照，快取中沒有時重新建立，並覆寫目前的可用庫存
+
+        Args:
+            allowed_types: 可見的產品類型，None 表示全部
+
+        Returns:
+            CatalogueSnapshot: 每次呼叫都是獨立的副本，可直接在實例上附加價格等屬性
+        """
+        allowed_types = tuple(allowed_types) if allowed_types else None
+        key = cls._cache_key(allowed_types)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = cls.build(allowed_types)
+            cache.set(key, snapshot, timeout=CATALOGUE_CACHE_TIMEOUT)
+        snapshot.apply_stock_levels()
+        return snapshot
+
+    @classmethod
+    def build(cls, allowed_types=None):
+        """
+        從資料庫建立快照（產品、變體、分類共三次查詢，不含可用庫存）
+
+        Args:
+            allowed_types: 可見的產品類型，None 表示全部
+
+        Returns:
+            CatalogueSnapshot
+        """
+        from products.models import Product, Variant, Category
+
+        variants = Variant.objects.filter(status=VariantStatus.ACTIVE)
+        if allowed_types:
+            variants = variants.filter(product_type__in=allowed_types)
+
+        # 1. 上架產品與範圍內的上架變體
+        products = [
+            product
+            for product in Product.objects.filter(
+                status=ProductStatus.ACTIVE
+            ).select_related('category').prefetch_related(
+                Prefetch('variants', queryset=variants.order_by('sort_order'))
+            ).order_by('sort_order', 'id')
+            if product.variants.all()
+        ]
+
+        for product in products:
+            product.active_variants_count = len(product.variants.all())
+
+        # 2. 有產品的分類
+        category_ids = {product.category_id for product in products}
+        categories = list(Category.objects.filter(id__in=category_ids).order_by('sort_order'))
+
+        logger.info(
+            f'建立產品目錄快照：{len(products)} 個產品，'
+            f'類型 {",".join(allowed_types) if allowed_types else "全部"}'
+        )
+        return cls(products, categories, allowed_types)
+
+    @classmethod
+    def invalidate(cls):
+        """讓所有程序的快照失效（遞增資料庫中的版本，舊快照由快取自然過期）"""
+        from products.models import CatalogueVersion
+
+        CatalogueVersion.bump()
+
+    def apply_stock_levels(self):
+        """以庫存彙總覆寫變體的可用庫存（一次查詢，庫存異動不需讓快照失效）"""
+        from products.models import VariantStockLevel
+
+        variants = [variant for product in self.products for variant in product.variants.all()]
+        stock_levels = VariantStockLevel.get_available(variant.id for variant in variants)
+        for variant in variants:
+            variant.stock_quantity = stock_levels[variant.id]
+            variant.has_stock = variant.stock_quantity > 0
+
+    def filter(self, category_id=None, product_type=None, search_query=None, days=None, data_amount=None,
+               products=None):
+        """
+        篩選快照中的產品（不查詢資料庫）
+
+        Args:
+            category_id: 分類 ID（字串或整數，無效值忽略）
+            product_type: 產品類型，至少有一個該類型的上架變體
+            search_query: 搜尋字串，以 search_index 比對產品名稱、描述與變體名稱、描述、代碼
+            days: 方案天數（如 '1-3 天'），至少有一個該天數的上架變體
+            data_amount: 方案規格（如 '5G'），至少有一個該規格的上架變體
+            products: 要篩選的產品（例如前一次篩選的結果），預設為快照中的所有產品
+
+        Returns:
+            list: Product 列表
+        """
+        if products is None:
+            products = self.products
+
+        if category_id:
+            try:
+                category_id = int(category_id)
+            except (ValueError, TypeError):
+                category_id = None
+            if category_id is not None:
+                products = [product for product in products if product.category_id == category_id]
+
+        if product_type:
+            products = [
+                product for product in products
+                if any(variant.product_type == product_type for variant in product.variants.all())
+            ]
+
+        if search_query or days or data_amount:
+            matched = search_index.search(search_query, days=days, data_amount=data_amount)
+            products = [
+                product for product in products
+                if any(variant.id in matched for variant in product.variants.all())
+            ]
+
+        return products
+
+    @staticmethod
+    def facets(products):
+        """
+        統計產品中上架變體的方案天數與規格
+
+        Returns:
+            dict: {'days': [(天數, 變體數)], 'data_amount': [(規格, 變體數)]}，依解析後的數值排序
+        """
+        return search_index.facets(
+            variant.id for product in products for variant in product.variants.all()
+        )
+
+
+# 搜尋斷詞：連續英數字為一個詞，中日韓文字另外切成單字與雙字
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+')
+
+
+def tokenize(text):
+    """
+    斷詞
+
+    例如 '日本 5G Unlimited 1-3 天' → {'日', '本', '日本', '5g', 'unlimited', '1', '3', '天'}
+
+    Returns:
+        set: 詞集合（英文已轉小寫）
+    """
+    tokens = set()
+    for chunk in TOKEN_PATTERN.findall((text or '').lower()):
+        if chunk.isascii():
+            tokens.add(chunk)
+        else:
+            tokens.update(chunk)
+            tokens.update(chunk[i:i + 2] for i in range(len(chunk) - 1))
+    return tokens
+
+
+def query_terms(text):
+    """
+    將搜尋字串轉為必須全部符合的詞
+
+    Returns:
+        list: [(詞, 是否子字串比對)]；英文與數字詞以子字串比對（與 icontains 相同，
+              apan 可找到 japan、30 可找到 jp30d），中文詞須完全相同，
+              中文以雙字比對（單字時以單字比對），索引已包含所有單字與雙字，效果等同子字串比對
+    """
+    terms = []
+    for chunk in TOKEN_PATTERN.findall((text or '').lower()):
+        if chunk.isascii():
+            terms.append((chunk, True))
+        elif len(chunk) == 1:
+            terms.append((chunk, False))
+        else:
+            terms.extend((chunk[i:i + 2], False) for i in range(len(chunk) - 1))
+    return terms
+
+
+# 產品目錄搜尋索引
+class CatalogueSearchIndex:
+    """
+    上架變體的程序內搜尋索引（倒排索引）
+
+    每個上架產品的上架變體為一筆文件，內容為產品名稱、描述與變體名稱、描述、
+    產品代碼、天數、規格；同時保存解析後的天數與流量數值作為篩選與排序用的 facet。
+
+    - 第一次搜尋時以一次查詢建立，並記錄資料庫中的 CatalogueVersion
+    - 本程序內的變體或產品異動由 products.signals 逐筆更新（同時遞增 CatalogueVersion）
+    - 其他程序的異動同樣會遞增 CatalogueVersion，版本與本程序記錄的不同時整個重建
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = defaultdict(set)
+        self.version = None
+        self._terms = None
+        self._lock = threading.RLock()
+
+    def _ensure_current(self):
+        """確認索引與其他程序的異動同步（一次主鍵查詢）"""
+        from products.models import CatalogueVersion
+
+        version = CatalogueVersion.current()
+        if version != self.version:
+            self.rebuild(version)
+
+    def rebuild(self, version=None):
+        """
+        從資料庫重建整個索引（一次查詢）
+
+        Args:
+            version: 重建前讀取的 CatalogueVersion，None 時讀取目前的版本
+        """
+        from products.models import CatalogueVersion
+
+        with self._lock:
+            # 先讀版本再讀資料：期間若有其他異動，索引內容只會比記錄的版本新，下次搜尋時再重建
+            if version is None:
+                version = CatalogueVersion.current()
+            self.documents = {}
+            self.postings = defaultdict(set)
+            self._terms = None
+            for variant in self._active_variants():
+                self._add(variant)
+            self.version = version
+
+        logger.info(f'重建產品目錄搜尋索引：{len(self.documents)} 個變體')
+
+    @staticmethod
+    def _active_variants():
+        from products.models import Variant
+
+        return Variant.objects.filter(
+            status=VariantStatus.ACTIVE,
+            product__status=ProductStatus.ACTIVE
+        ).select_related('product')
+
+    def _add(self, variant):
+        product = variant.product
+        tokens = tokenize(' '.join([
+            product.name, product.description,
+            variant.name, variant.description, variant.product_code,
+            variant.days, variant.data_amount,
+        ]))
+        self.documents[variant.id] = {
+            'product_id': variant.product_id,
+            'tokens': tokens,
+            'days': variant.days,
+            'days_value': parse_days(variant.days),
+            'data_amount': variant.data_amount,
+            'data_value': parse_data_amount(variant.data_amount),
+        }
+        for token in tokens:
+            self.postings[token].add(variant.id)
+        self._terms = None
+
+    def _remove(self, variant_id):
+        document = self.documents.pop(variant_id, None)
+        if document is None:
+            return
+        for token in document['tokens']:
+            postings = self.postings.get(token)
+            if postings is not None:
+                postings.discard(variant_id)
+                if not postings:
+                    del self.postings[token]
+        self._terms = None
+
+    def update_variants(self, variant_ids=None, product_ids=None):
+        """
+        重新索引指定的變體或產品的所有變體（已下架或刪除者會移出索引）
+
+        由 products.signals 於交易提交後呼叫，並遞增 CatalogueVersion（同時讓產品目錄快照失效）。
+        遞增前的版本與本程序記錄的相同時才逐筆更新；不同表示有其他程序的異動尚未套用，
+        改為在下次搜尋時整個重建。
+
+        Args:
+            variant_ids: 變體 ID 列表
+            product_ids: 產品 ID 列表
+        """
+        variant_ids = set(variant_ids or [])
+        product_ids = set(product_ids or [])
+
+        from products.models import CatalogueVersion
+
+        with self._lock:
+            version = CatalogueVersion.bump()
+            if self.version is None or version != self.version + 1:
+                # 本程序尚未建立索引，或遺漏了其他程序的異動：下次搜尋時整個重建
+                self.version = None
+                return
+
+            active = self._active_variants()
+            if product_ids:
+                variant_ids |= {
+                    variant_id for variant_id, document in self.documents.items()
+                    if document['product_id'] in product_ids
+                }
+                active = active.filter(Q(id__in=variant_ids) | Q(product_id__in=product_ids))
+            else:
+                active = active.filter(id__in=variant_ids)
+
+            for variant_id in variant_ids:
+                self._remove(variant_id)
+            for variant in active:
+                self._remove(variant.id)
+                self._add(variant)
+            self.version = version
+
+    def _lookup(self, term, partial):
+        """
+        單一詞的變體 ID 集合
+
+        子字串比對時逐一掃描記憶體中的詞表（詞數遠少於變體內容，仍不需查詢資料庫）
+        """
+        if not partial:
+            return self.postings.get(term, set())
+
+        if self._terms is None:
+            self._terms = list(self.postings)
+        matched = set()
+        for candidate in self._terms:
+            if term in candidate:
+                matched |= self.postings[candidate]
+        return matched
+
+    def search(self, query=None, days=None, data_amount=None):
+        """
+        搜尋符合所有條件的變體
+
+        Args:
+            query: 搜尋字串，所有詞都要符合
+            days: 方案天數
+            data_amount: 方案規格
+
+        Returns:
+            set: 變體 ID
+        """
+        with self._lock:
+            self._ensure_current()
+
+            matched = None
+            for term, partial in query_terms(query):
+                ids = self._lookup(term, partial)
+                matched = set(ids) if matched is None else matched & ids
+                if not matched:
+                    return set()
+            if matched is None:
+                matched = set(self.documents)
+
+            if days:
+                matched = {variant_id for variant_id in matched if self.documents[variant_id]['days'] == days}
+            if data_amount:
+                matched = {
+                    variant_id for variant_id in matched
+                    if self.documents[variant_id]['data_amount'] == data_amount
+                }
+            return matched
+
+    def facets(self, variant_ids):
+        """
+        統計變體的方案天數與規格
+
+        Args:
+            variant_ids: 變體 ID 可迭代物件
+
+        Returns:
+            dict: {'days': [(天數, 變體數)], 'data_amount': [(規格, 變體數)]}，依解析後的數值排序
+        """
+        with self._lock:
+            self._ensure_current()
+
+            documents = [self.documents[variant_id] for variant_id in variant_ids if variant_id in self.documents]
+            days = Counter(document['days'] for document in documents if document['days'])
+            data_amounts = Counter(document['data_amount'] for document in documents if document['data_amount'])
+            days_values = {document['days']: document['days_value'] for document in documents}
+            data_values = {document['data_amount']: document['data_value'] for document in documents}
+
+        return {
+            'days': sorted(days.items(), key=lambda item: (days_values[item[0]], item[0])),
+            'data_amount': sorted(data_amounts.items(), key=lambda item: (data_values[item[0]], item[0])),
+        }
+
+
+search_index = CatalogueSearchIndex()
@@ -26,3 +26,15 @@ class StockType(models.TextChoices):
     ESIMIMG = "esimimg", "eSIM圖庫庫存"
 
 
+
+# 產品目錄快照快取秒數（異動時會立即失效，此為跨程序快取的最長延遲）
+CATALOGUE_CACHE_TIMEOUT = int(os.getenv('CATALOGUE_CACHE_TIMEOUT', 600))
+
+# ESIMIMG 圖片批次入庫：每批寫入筆數與寫檔執行緒數
+QR_INGEST_CHUNK_SIZE = int(os.getenv('QR_INGEST_CHUNK_SIZE', 500))
+QR_INGEST_WORKERS = int(os.getenv('QR_INGEST_WORKERS', 8))
+
+# QR 縮圖邊長（像素）與聯絡表每列張數、每頁張數
+QR_THUMBNAIL_SIZE = int(os.getenv('QR_THUMBNAIL_SIZE', 160))
+QR_CONTACT_SHEET_COLUMNS = int(os.getenv('QR_CONTACT_SHEET_COLUMNS', 6))
+QR_CONTACT_SHEET_PAGE_SIZE = int(os.getenv('QR_CONTACT_SHEET_PAGE_SIZE', 60))
@@ -0,0 +1,356 @@
+import hashlib
+import math
+import os
+import re
+import tempfile
+import zipfile
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageDraw, ImageFont
+
+from products.constant import QR_THUMBNAIL_SIZE, QR_CONTACT_SHEET_COLUMNS, QR_CONTACT_SHEET_PAGE_SIZE
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def stock_label(stock):
+    """
+    庫存在聯絡表與 ZIP 檔名中的標籤（代碼為空時改用庫存 ID）
+
+    Returns:
+        str: 庫存代碼，或 'ID{庫存 ID}'
+    """
+    return stock.code or f'ID{stock.id}'
+
+
+# QR 縮圖
+class QRThumbnail:
+    """
+    庫存 QR 圖片的固定尺寸縮圖（存於 media/qr_thumbs/，依庫存 ID 命名）
+
+    入庫時直接由上傳內容產生；舊資料或產生失敗的縮圖由 generate_qr_thumbnails 指令補產生，
+    頁面顯示時不產生縮圖（缺少時改用原圖），只有聯絡表會在指令產生時順便補上。
+    檔名帶有圖片雜湊值前綴，圖片更換後會自動改用新的縮圖。
+    """
+    directory = 'qr_thumbs'
+    size = QR_THUMBNAIL_SIZE
+    storage = default_storage
+
+    @classmethod
+    def name_for(cls, stock):
+        """縮圖儲存路徑：qr_thumbs/{尺寸}/{庫存 ID // 1000}/{庫存 ID}[_{雜湊值前 12 碼}].png"""
+        suffix = f'_{stock.qr_sha256[:12]}' if stock.qr_sha256 else ''
+        return f'{cls.directory}/{cls.size}/{stock.id // 1000}/{stock.id}{suffix}.png'
+
+    @classmethod
+    def render(cls, source):
+        """
+        產生縮圖
+
+        Args:
+            source: 圖片內容（bytes）或檔案物件
+
+        Returns:
+            bytes: PNG 縮圖
+        """
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+        with Image.open(source) as image:
+            image = cls._to_rgb(image)
+            image.thumbnail((cls.size, cls.size), Image.LANCZOS)
+            output = BytesIO()
+            image.save(output, 'PNG', optimize=True)
+        return output.getvalue()
+
+    @staticmethod
+    def _to_rgb(image):
+        """透明背景補白並轉為 RGB"""
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB')
+
+    @classmethod
+    def generate(cls, stock, data=None):
+        """
+        產生並儲存縮圖（已存在則直接回傳）
+
+        Args:
+            stock: Stock 實例（需有 qr_img）
+            data: 原圖內容，未提供時從 qr_img 讀取
+
+        Returns:
+            str: 縮圖儲存路徑
+        """
+        name = cls.name_for(stock)
+        if cls.storage.exists(name):
+            return name
+
+        if data is None:
+            with stock.qr_img.storage.open(stock.qr_img.name, 'rb') as f:
+                data = f.read()
+        return cls.storage.save(name, ContentFile(cls.render(data)))
+
+    @classmethod
+    def safe_generate(cls, stock, data=None):
+        """產生縮圖，失敗時記錄並回傳 None（原圖遺失或損毀）"""
+        try:
+            return cls.generate(stock, data)
+        except Exception as e:
+            logger.warning(f'產生庫存 {stock.id} 的 QR 縮圖失敗：{str(e)}')
+            return None
+
+    @classmethod
+    def urls_for(cls, stocks):
+        """
+        取得多筆庫存已產生的縮圖網址（只檢查檔案是否存在，不在請求中產生縮圖）
+
+        Args:
+            stocks: Stock 列表
+
+        Returns:
+            dict: {庫存 ID: 縮圖網址}，無圖片或尚未產生縮圖的庫存不包含在內（由呼叫端改用原圖）
+        """
+        urls = {}
+        for stock in stocks:
+            if stock is None or not stock.qr_img:
+                continue
+            name = cls.name_for(stock)
+            if cls.storage.exists(name):
+                urls[stock.id] = cls.storage.url(name)
+        return urls
+
+    @classmethod
+    def open(cls, stock):
+        """
+        讀取縮圖（必要時補產生）
+
+        Returns:
+            PIL.Image 或 None
+        """
+        if stock is None or not stock.qr_img:
+            return None
+        name = cls.safe_generate(stock)
+        if not name:
+            return None
+        with cls.storage.open(name, 'rb') as f:
+            image = Image.open(f)
+            image.load()
+        return image
+
+    @classmethod
+    def delete(cls, name):
+        """
+        刪除縮圖
+
+        Args:
+            name: name_for() 產生的縮圖路徑
+        """
+        if cls.storage.exists(name):
+            cls.storage.delete(name)
+
+
+# QR 聯絡表
+class QRContactSheet:
+    """
+    將多張 QR 縮圖與代碼排成單張 PNG（一次請求取得一整頁 QR Code，方便列印或轉傳）
+
+    與縮圖相同，由 generate_qr_thumbnails 指令預先產生並存於 media/qr_sheets/，
+    請求中只提供已產生的聯絡表，不在請求中產生。
+    檔名帶有該頁內容的雜湊值，庫存分配或圖片改變後會改用新的聯絡表。
+    """
+    directory = 'qr_sheets'
+    storage = default_storage
+    columns = QR_CONTACT_SHEET_COLUMNS
+    page_size = QR_CONTACT_SHEET_PAGE_SIZE
+    padding = 12
+    label_height = 28
+
+    @staticmethod
+    def items_for(units):
+        """
+        聯絡表項目（預設字型只支援 ASCII，標籤不使用中文）
+
+        Args:
+            units: UsedStockResolver.units() 的逐件明細
+
+        Returns:
+            list: [(標籤文字, Stock 或 None), ...]
+        """
+        return [
+            (f'#{sequence} {stock_label(stock)}' if stock else f'#{sequence} (deleted)', stock)
+            for sequence, stock, _ in units
+        ]
+
+    @classmethod
+    def pages(cls, items):
+        """
+        依頁分割項目
+
+        Returns:
+            list: [(頁碼, 項目列表), ...]，沒有項目時為空列表
+        """
+        return [
+            (page, items[(page - 1) * cls.page_size:page * cls.page_size])
+            for page in range(1, math.ceil(len(items) / cls.page_size) + 1)
+        ]
+
+    @classmethod
+    def name_for(cls, order_product_id, page, items):
+        """
+        聯絡表儲存路徑：qr_sheets/{訂單產品 ID // 1000}/{訂單產品 ID}/{頁碼}_{內容雜湊值前 12 碼}.png
+
+        雜湊值由該頁的標籤與 QR 圖片（路徑與雜湊值）計算
+        """
+        sha256 = hashlib.sha256()
+        for label, stock in items:
+            image = f'{stock.qr_img.name}:{stock.qr_sha256 or ""}' if stock is not None and stock.qr_img else ''
+            sha256.update(f'{label}\t{image}\n'.encode())
+        return (
+            f'{cls.directory}/{order_product_id // 1000}/{order_product_id}/'
+            f'{page}_{sha256.hexdigest()[:12]}.png'
+        )
+
+    @classmethod
+    def generate(cls, order_product_id, page, items):
+        """
+        產生並儲存聯絡表（已存在則直接回傳），並移除同一頁內容改變前的舊檔
+
+        Returns:
+            str: 聯絡表儲存路徑
+        """
+        name = cls.name_for(order_product_id, page, items)
+        if cls.storage.exists(name):
+            return name
+
+        name = cls.storage.save(name, ContentFile(cls.render(items)))
+        directory, filename = os.path.split(name)
+        _, files = cls.storage.listdir(directory)
+        for stale in files:
+            if stale != filename and stale.startswith(f'{page}_'):
+                cls.storage.delete(f'{directory}/{stale}')
+        return name
+
+    @classmethod
+    def safe_generate(cls, order_product_id, page, items):
+        """產生聯絡表，失敗時記錄並回傳 None"""
+        try:
+            return cls.generate(order_product_id, page, items)
+        except Exception as e:
+            logger.warning(f'產生訂單產品 {order_product_id} 第 {page} 頁聯絡表失敗：{str(e)}')
+            return None
+
+    @classmethod
+    def page_count(cls, count):
+        return max(1, math.ceil(count / cls.page_size))
+
+    @classmethod
+    def page(cls, items, page):
+        """
+        取得指定頁的項目（頁碼超出範圍時回傳最後一頁）
+
+        Returns:
+            tuple: (頁碼, 項目列表)
+        """
+        page = min(max(1, page), cls.page_count(len(items)))
+        start = (page - 1) * cls.page_size
+        return page, items[start:start + cls.page_size]
+
+    @classmethod
+    def render(cls, items):
+        """
+        產生聯絡表（缺少的縮圖會順便補上；由指令平行產生多頁，單頁內依序讀取）
+
+        Args:
+            items: [(標籤文字, Stock 或 None), ...]
+
+        Returns:
+            bytes: PNG 圖片
+        """
+        thumbnails = [QRThumbnail.open(stock) for _, stock in items]
+
+        size = QRThumbnail.size
+        cell_width = size + cls.padding * 2
+        cell_height = size + cls.label_height + cls.padding * 2
+        columns = max(1, min(cls.columns, len(items)))
+        rows = max(1, math.ceil(len(items) / columns))
+
+        sheet = Image.new('RGB', (cell_width * columns, cell_height * rows), 'white')
+        draw = ImageDraw.Draw(sheet)
+        font = cls._font()
+
+        for index, ((label, _), thumbnail) in enumerate(zip(items, thumbnails)):
+            left = (index % columns) * cell_width + cls.padding
+            top = (index // columns) * cell_height + cls.padding
+
+            if thumbnail is not None:
+                offset_x = (size - thumbnail.width) // 2
+                offset_y = (size - thumbnail.height) // 2
+                sheet.paste(thumbnail, (left + offset_x, top + offset_y))
+            else:
+                draw.rectangle((left, top, left + size - 1, top + size - 1), fill='#f1f3f5', outline='#ced4da')
+                draw.text((left + size // 2, top + size // 2), 'N/A', fill='#adb5bd', font=font, anchor='mm')
+
+            draw.text(
+                (left + size // 2, top + size + cls.label_height // 2),
+                label, fill='black', font=font, anchor='mm'
+            )
+
+        output = BytesIO()
+        sheet.save(output, 'PNG', optimize=True)
+        return output.getvalue()
+
+    @staticmethod
+    def _font():
+        try:
+            return ImageFont.load_default(size=14)
+        except TypeError:
+            # 舊版 Pillow 不支援 size 參數
+            return ImageFont.load_default()
+
+
+# ZIP 檔名中不允許的字元（路徑分隔符號與控制字元）
+UNSAFE_FILENAME_PATTERN = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+def build_qr_archive(entries):
+    """
+    將 QR 原圖打包為 ZIP（PNG 已壓縮，使用 ZIP_STORED 不再壓縮）
+
+    檔名中的路徑分隔符號等字元會替換為底線，避免在 ZIP 內產生子資料夾。
+
+    Args:
+        entries: [(ZIP 內檔名（不含副檔名）, Stock 或 None), ...]
+
+    Returns:
+        tuple: (暫存檔案物件（已移至開頭）, 缺少圖片的檔名列表)
+    """
+    archive_file = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+    missing = []
+
+    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_STORED) as archive:
+        for filename, stock in entries:
+            filename = UNSAFE_FILENAME_PATTERN.sub('_', filename)
+            if stock is None or not stock.qr_img:
+                missing.append(filename)
+                continue
+            extension = os.path.splitext(stock.qr_img.name)[1] or '.png'
+            try:
+                with stock.qr_img.storage.open(stock.qr_img.name, 'rb') as source, \
+                        archive.open(f'{filename}{extension}', 'w') as target:
+                    for chunk in iter(lambda: source.read(64 * 1024), b''):
+                        target.write(chunk)
+            except OSError as e:
+                logger.warning(f'讀取庫存 {stock.id} 的 QR 圖片失敗：{str(e)}')
+                missing.append(filename)
+
+        if missing:
+            archive.writestr('missing.txt', '\n'.join(missing) + '\n')
+
+    archive_file.seek(0)
+    return archive_file, missing
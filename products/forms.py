@@ -52,6 +52,15 @@ class StockCreateForm(forms.ModelForm):
         required=False,
         help_text='支援多選，適用於 ESIMIMG 類型'
     )
+    qr_zip = forms.FileField(
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.zip,application/zip'
+        }),
+        label='上傳 QR 圖片 ZIP 壓縮檔',
+        required=False,
+        help_text='大量圖片請壓縮為 ZIP 上傳，檔名（不含副檔名）即為庫存代碼'
+    )
 
     class Meta:
         model = Stock
@@ -100,12 +109,16 @@ class StockCreateForm(forms.ModelForm):
         
         product_type = product.product_type
         qr_images = self.files.getlist('qr_images')
+        qr_zip = cleaned_data.get('qr_zip')
         quantity = cleaned_data.get('quantity')
         
-        # 情況 A: ESIMIMG - 必須上傳圖片
+        # 情況 A: ESIMIMG - 必須上傳圖片或 ZIP 壓縮檔
         if product_type == ProductType.ESIMIMG:
-            if not qr_images or len(qr_images) == 0:
-                raise ValidationError('ESIMIMG 類型必須上傳至少一張 QR 圖片')
+            if not qr_images and not qr_zip:
+                raise ValidationError('ESIMIMG 類型必須上傳至少一張 QR 圖片或一個 ZIP 壓縮檔')
+            
+            if qr_zip and not qr_zip.name.lower().endswith('.zip'):
+                raise ValidationError('壓縮檔僅支援 ZIP 格式')
             
             # 檢查 SKU
             if not product.sku:
@@ -114,8 +127,8 @@ class StockCreateForm(forms.ModelForm):
                     f'請先在產品管理中設定 SKU。'
                 )
             
-            # ✅ 自動設定數量為圖片數量
-            cleaned_data['quantity'] = len(qr_images)
+            # ✅ 自動設定數量為圖片數量（ZIP 內的實際數量於匯入時決定）
+            cleaned_data['quantity'] = len(qr_images) or 1
         
         # 情況 B: 其他類型 - 必須填寫數量
         else:
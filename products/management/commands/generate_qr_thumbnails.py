@@ -0,0 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from products.constant import QR_INGEST_WORKERS, ProductType
+from products.derivatives import QRThumbnail, QRContactSheet
+from products.models import Stock
+from products.services import UsedStockResolver
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '補產生 ESIMIMG 庫存缺少的 QR 縮圖與訂單產品的 QR 聯絡表（訂單產品頁面不會即時產生）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--variant',
+            type=int,
+            help='只處理指定產品變體 ID 的庫存'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=QR_INGEST_WORKERS,
+            help=f'平行產生縮圖的執行緒數量，預設 {QR_INGEST_WORKERS}'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='每批讀取的庫存或訂單產品筆數，預設 500'
+        )
+        parser.add_argument(
+            '--skip-sheets',
+            action='store_true',
+            help='只補產生縮圖，不產生聯絡表'
+        )
+
+    def handle(self, *args, **options):
+        # 1. 查詢有 QR 圖片的庫存
+        stocks = Stock.objects.filter(
+            product__product_type=ProductType.ESIMIMG
+        ).exclude(qr_img='').exclude(qr_img__isnull=True).only('id', 'qr_img', 'qr_sha256')
+        if options['variant']:
+            stocks = stocks.filter(product_id=options['variant'])
+
+        # 2. 分批檢查並平行產生缺少的縮圖
+        checked = 0
+        generated = 0
+        failed = 0
+        batch = []
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for stock in stocks.order_by('id').iterator(chunk_size=options['chunk_size']):
+                checked += 1
+                if not QRThumbnail.storage.exists(QRThumbnail.name_for(stock)):
+                    batch.append(stock)
+                if len(batch) >= options['chunk_size']:
+                    succeeded = self.generate(pool, batch)
+                    generated += succeeded
+                    failed += len(batch) - succeeded
+                    batch = []
+            if batch:
+                succeeded = self.generate(pool, batch)
+                generated += succeeded
+                failed += len(batch) - succeeded
+
+        # 3. 輸出結果
+        self.stdout.write(f'檢查 {checked} 筆庫存')
+        if failed:
+            self.stdout.write(self.style.WARNING(f'已產生 {generated} 張縮圖，{failed} 張失敗（原圖遺失或損毀）'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'已產生 {generated} 張縮圖'))
+
+        logger.info(f'補產生 QR 縮圖完成：檢查 {checked} 筆，產生 {generated} 張，失敗 {failed} 張')
+
+        # 4. 產生缺少的聯絡表（縮圖已補齊，聯絡表直接使用）
+        if not options['skip_sheets']:
+            self.generate_sheets(options)
+
+    def generate_sheets(self, options):
+        """
+        分批產生 ESIMIMG 訂單產品缺少的聯絡表
+
+        Args:
+            options: 指令參數
+        """
+        from business.models import OrderProduct
+
+        order_products = OrderProduct.objects.filter(
+            variant__product_type=ProductType.ESIMIMG
+        ).only('id', 'used_stocks')
+        if options['variant']:
+            order_products = order_products.filter(variant_id=options['variant'])
+
+        totals = {'checked': 0, 'generated': 0, 'failed': 0}
+        batch = []
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for order_product in order_products.order_by('id').iterator(chunk_size=options['chunk_size']):
+                batch.append(order_product)
+                if len(batch) >= options['chunk_size']:
+                    self.generate_sheet_batch(pool, batch, totals)
+                    batch = []
+            if batch:
+                self.generate_sheet_batch(pool, batch, totals)
+
+        self.stdout.write(f'檢查 {totals["checked"]} 頁聯絡表')
+        if totals['failed']:
+            self.stdout.write(self.style.WARNING(
+                f'已產生 {totals["generated"]} 頁聯絡表，{totals["failed"]} 頁失敗'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'已產生 {totals["generated"]} 頁聯絡表'))
+
+        logger.info(
+            f'產生 QR 聯絡表完成：檢查 {totals["checked"]} 頁，'
+            f'產生 {totals["generated"]} 頁，失敗 {totals["failed"]} 頁'
+        )
+
+    @staticmethod
+    def generate_sheet_batch(pool, order_products, totals):
+        """
+        平行產生一批訂單產品缺少的聯絡表（分配記錄與庫存各一次查詢）
+
+        Args:
+            pool: 執行緒池
+            order_products: OrderProduct 列表
+            totals: 統計數字，就地累加 checked / generated / failed
+        """
+        from business.models import StockAllocation
+
+        used_stocks = StockAllocation.used_stocks_for(order_products)
+        resolver = UsedStockResolver([entry for entries in used_stocks.values() for entry in entries])
+
+        pending = []
+        for order_product in order_products:
+            units = resolver.units(used_stocks[order_product.id])
+            for page, items in QRContactSheet.pages(QRContactSheet.items_for(units)):
+                totals['checked'] += 1
+                if not QRContactSheet.storage.exists(QRContactSheet.name_for(order_product.id, page, items)):
+                    pending.append((order_product.id, page, items))
+
+        succeeded = sum(1 for name in pool.map(lambda args: QRContactSheet.safe_generate(*args), pending) if name)
+        totals['generated'] += succeeded
+        totals['failed'] += len(pending) - succeeded
+
+    @staticmethod
+    def generate(pool, stocks):
+        """
+        平行產生一批縮圖
+
+        Returns:
+            int: 成功產生的數量
+        """
+        return sum(1 for name in pool.map(QRThumbnail.safe_generate, stocks) if name)
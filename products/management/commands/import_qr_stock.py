@@ -0,0 +1,92 @@
+import os
+import zipfile
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from products.constant import QR_INGEST_CHUNK_SIZE, QR_INGEST_WORKERS
+from products.models import Variant
+from products.services import QRStockIngestor
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '從 ZIP 檔或伺服器資料夾批次匯入 ESIMIMG 的 QR 圖片庫存（檔名即為庫存代碼）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('variant_id', type=int, help='產品變體 ID（必須為圖庫 eSIM）')
+        parser.add_argument('path', help='ZIP 檔或資料夾路徑')
+        parser.add_argument('--name', help='庫存批次名稱，預設為檔案或資料夾名稱')
+        parser.add_argument('--description', default='', help='庫存描述')
+        parser.add_argument('--expire-date', help='過期日期（格式：YYYY-MM-DD）')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=QR_INGEST_CHUNK_SIZE,
+            help=f'每批處理的檔案數量，預設 {QR_INGEST_CHUNK_SIZE}'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=QR_INGEST_WORKERS,
+            help=f'寫入圖片的執行緒數量，預設 {QR_INGEST_WORKERS}'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+
+        # 1. 檢查參數
+        try:
+            variant = Variant.objects.get(pk=options['variant_id'])
+        except Variant.DoesNotExist:
+            raise CommandError(f"產品變體 {options['variant_id']} 不存在")
+
+        if not os.path.exists(path):
+            raise CommandError(f'路徑不存在：{path}')
+
+        expire_date = None
+        if options['expire_date']:
+            try:
+                expire_date = timezone.make_aware(datetime.strptime(options['expire_date'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError('過期日期格式錯誤，請使用 YYYY-MM-DD')
+
+        name = options['name'] or os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+
+        try:
+            ingestor = QRStockIngestor(
+                variant,
+                name=name,
+                description=options['description'],
+                expire_date=expire_date,
+                chunk_size=options['chunk_size'],
+                max_workers=options['workers']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        # 2. 匯入
+        self.stdout.write(f'開始匯入 QR 圖片：{path} → 變體 {variant.name}（{variant.sku}）')
+
+        if os.path.isdir(path):
+            result = ingestor.ingest_directory(path)
+        else:
+            try:
+                result = ingestor.ingest_zip(path)
+            except zipfile.BadZipFile:
+                raise CommandError(f'無法讀取 ZIP 檔：{path}')
+
+        # 3. 輸出結果
+        for filename, reason in result.failures:
+            self.stdout.write(self.style.WARNING(f'  ✗ {filename}：{reason}'))
+
+        if result.failures:
+            self.stdout.write(
+                self.style.WARNING(f'已建立 {result.created} 筆庫存，{len(result.failures)} 個檔案失敗')
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(f'已建立 {result.created} 筆庫存'))
+
+        logger.info(f'匯入 QR 圖片完成：{path}，建立 {result.created} 筆，失敗 {len(result.failures)} 個')
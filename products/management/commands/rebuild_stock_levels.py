@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.models import VariantStockLevel
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '從庫存資料重新計算產品變體庫存彙總（VariantStockLevel）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--variant',
+            type=int,
+            action='append',
+            help='指定變體 ID，可重複指定，預設為全部變體'
+        )
+    
+    def handle(self, *args, **options):
+        variant_ids = options['variant']
+        
+        if variant_ids:
+            self.stdout.write(f"開始重新計算庫存彙總：變體 {variant_ids}")
+        else:
+            self.stdout.write("開始重新計算所有變體的庫存彙總...")
+        
+        with transaction.atomic():
+            changed = VariantStockLevel.rebuild(variant_ids)
+        
+        if changed:
+            self.stdout.write(
+                self.style.WARNING(f"已修正 {changed} 個變體的庫存彙總偏差")
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS("庫存彙總與庫存資料一致"))
+        
+        logger.info(f"重新計算庫存彙總完成，修正 {changed} 個變體")
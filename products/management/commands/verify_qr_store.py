@@ -0,0 +1,171 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from products.constant import QR_INGEST_WORKERS
+from products.models import Stock
+from products.storage import QR_IMAGE_ROOT, QR_STORE_DIRECTORY, file_digest, qr_image_storage
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '檢查 QR 圖片儲存：列出孤兒檔案（沒有庫存引用）、遺失檔案與內容重複的庫存'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=QR_INGEST_WORKERS,
+            help=f'平行掃描的執行緒數量，預設 {QR_INGEST_WORKERS}'
+        )
+        parser.add_argument(
+            '--checksum',
+            action='store_true',
+            help='重新計算內容定址檔案的雜湊值，檢查檔案是否損毀'
+        )
+        parser.add_argument(
+            '--fill-hashes',
+            action='store_true',
+            help='為舊版圖片（依 SKU 存放）計算並寫入 qr_sha256'
+        )
+        parser.add_argument(
+            '--delete-orphans',
+            action='store_true',
+            help='刪除孤兒檔案'
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+
+        # 1. 讀取所有庫存引用的圖片 {路徑: (庫存 ID, 雜湊值)}
+        referenced = {
+            name: (stock_id, digest)
+            for stock_id, name, digest in Stock.objects.exclude(qr_img='').exclude(
+                qr_img__isnull=True
+            ).values_list('id', 'qr_img', 'qr_sha256')
+        }
+        self.stdout.write(f'庫存引用的圖片：{len(referenced)} 個')
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # 2. 平行掃描圖片資料夾
+            on_disk = self.scan(pool)
+            self.stdout.write(f'儲存空間中的圖片：{len(on_disk)} 個')
+
+            orphans = sorted(on_disk - set(referenced))
+            missing = set(
+                name for name in set(referenced) - on_disk
+                if not qr_image_storage.exists(name)
+            )
+
+            # 3. 檢查內容定址檔案的雜湊值，並為舊版圖片補上雜湊值
+            to_hash = []
+            for name, (stock_id, digest) in referenced.items():
+                if name in missing:
+                    continue
+                if options['checksum'] and qr_image_storage.digest_from_name(name):
+                    to_hash.append(name)
+                elif options['fill_hashes'] and not digest:
+                    to_hash.append(name)
+            digests = dict(zip(to_hash, pool.map(self.hash_file, to_hash)))
+
+        corrupted = sorted(
+            name for name, digest in digests.items()
+            if qr_image_storage.digest_from_name(name) and digest != qr_image_storage.digest_from_name(name)
+        )
+        filled = [
+            Stock(id=referenced[name][0], qr_sha256=digest)
+            for name, digest in digests.items()
+            if digest and not qr_image_storage.digest_from_name(name) and not referenced[name][1]
+        ]
+        if filled:
+            Stock.objects.bulk_update(filled, ['qr_sha256'], batch_size=500)
+
+        duplicates = Stock.objects.exclude(qr_sha256__isnull=True).values('qr_sha256').annotate(
+            count=Count('id')
+        ).filter(count__gt=1).count()
+
+        # 4. 輸出結果
+        self.report('孤兒檔案（沒有庫存引用）', orphans)
+        self.report('遺失檔案（庫存引用但檔案不存在）', sorted(missing))
+        if options['checksum']:
+            self.report('內容與雜湊值不符的檔案', corrupted)
+        if filled:
+            self.stdout.write(self.style.SUCCESS(f'已為 {len(filled)} 筆舊版圖片庫存寫入雜湊值'))
+        if duplicates:
+            self.stdout.write(self.style.WARNING(f'有 {duplicates} 組圖片內容重複的庫存'))
+
+        if orphans and options['delete_orphans']:
+            for name in orphans:
+                qr_image_storage.delete(name)
+            self.stdout.write(self.style.SUCCESS(f'已刪除 {len(orphans)} 個孤兒檔案'))
+
+        if not (orphans or missing or corrupted):
+            self.stdout.write(self.style.SUCCESS('QR 圖片儲存與庫存資料一致'))
+
+        logger.info(
+            f'檢查 QR 圖片儲存完成：孤兒 {len(orphans)} 個，遺失 {len(missing)} 個，'
+            f'損毀 {len(corrupted)} 個，重複 {duplicates} 組'
+        )
+
+    def scan(self, pool):
+        """
+        平行列出 QR 圖片資料夾中的所有檔案（每個 SKU 資料夾或雜湊分層由一個執行緒走訪）
+
+        Returns:
+            set: 相對於儲存根目錄的路徑
+        """
+        root = qr_image_storage.path(QR_IMAGE_ROOT)
+        if not os.path.isdir(root):
+            return set()
+
+        names = set()
+        subdirectories = []
+        store_root = qr_image_storage.path(QR_STORE_DIRECTORY)
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    names.add(f'{QR_IMAGE_ROOT}/{entry.name}')
+                elif entry.path == store_root:
+                    # 內容定址資料夾依雜湊前綴分層，每個分層各由一個執行緒走訪
+                    with os.scandir(store_root) as shards:
+                        for shard in shards:
+                            if shard.is_dir():
+                                subdirectories.append(shard.path)
+                            else:
+                                names.add(f'{QR_STORE_DIRECTORY}/{shard.name}')
+                else:
+                    subdirectories.append(entry.path)
+
+        for files in pool.map(self.walk, subdirectories):
+            names.update(files)
+        return names
+
+    @staticmethod
+    def walk(directory):
+        location = qr_image_storage.location
+        files = []
+        for root, dirs, filenames in os.walk(directory):
+            for filename in filenames:
+                files.append(os.path.relpath(os.path.join(root, filename), location).replace('\\', '/'))
+        return files
+
+    @staticmethod
+    def hash_file(name):
+        try:
+            with qr_image_storage.open(name, 'rb') as f:
+                return file_digest(f)
+        except OSError as e:
+            logger.warning(f'讀取圖片 {name} 失敗：{str(e)}')
+            return None
+
+    def report(self, title, names, limit=20):
+        if not names:
+            return
+        self.stdout.write(self.style.WARNING(f'{title}：{len(names)} 個'))
+        for name in names[:limit]:
+            self.stdout.write(f'  - {name}')
+        if len(names) > limit:
+            self.stdout.write(f'  ... 另有 {len(names) - limit} 個')
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_stock_levels(apps, schema_editor):
+    """從現有庫存與預訂訂單建立庫存彙總"""
+    Variant = apps.get_model('products', 'Variant')
+    Stock = apps.get_model('products', 'Stock')
+    VariantStockLevel = apps.get_model('products', 'VariantStockLevel')
+    OrderProduct = apps.get_model('business', 'OrderProduct')
+
+    stock_totals = {
+        row['product_id']: row
+        for row in Stock.objects.values('product_id').annotate(
+            available=models.Sum('quantity', filter=models.Q(is_used=False)),
+            used=models.Sum(models.F('initial_quantity') - models.F('quantity')),
+            next_expiry=models.Min('expire_date', filter=models.Q(is_used=False)),
+        )
+    }
+    reserved = dict(
+        OrderProduct.objects.filter(order__status='HOLDING').values('variant_id').annotate(
+            total=models.Sum('quantity')
+        ).values_list('variant_id', 'total')
+    )
+
+    levels = []
+    for variant_id in Variant.objects.values_list('id', flat=True):
+        totals = stock_totals.get(variant_id, {})
+        levels.append(VariantStockLevel(
+            variant_id=variant_id,
+            available=totals.get('available') or 0,
+            reserved=reserved.get(variant_id) or 0,
+            used=totals.get('used') or 0,
+            next_expiry=totals.get('next_expiry'),
+        ))
+    VariantStockLevel.objects.bulk_create(levels, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_variant_supplier'),
+        ('business', '0017_alter_order_order_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariantStockLevel',
+            fields=[
+                ('variant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_level', serialize=False, to='products.variant', verbose_name='產品')),
+                ('available', models.IntegerField(default=0, verbose_name='可用數量')),
+                ('reserved', models.IntegerField(default=0, verbose_name='預訂保留數量')),
+                ('used', models.IntegerField(default=0, verbose_name='已使用數量')),
+                ('next_expiry', models.DateTimeField(blank=True, null=True, verbose_name='最近過期時間')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'variant stock level',
+                'verbose_name_plural': 'variant stock levels',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['product', 'is_used', 'expire_date'], name='products_st_product_1d47ff_idx'),
+        ),
+        migrations.RunPython(populate_stock_levels, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:57
+
+from django.db import migrations, models
+import products.models
+import products.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_variantstocklevel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='qr_sha256',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='圖片 SHA-256'),
+        ),
+        migrations.AlterField(
+            model_name='stock',
+            name='qr_img',
+            field=models.ImageField(blank=True, null=True, storage=products.storage.ContentAddressedStorage(), upload_to=products.models.stock_qr_image_path, verbose_name='二維碼圖片'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['qr_sha256'], name='products_st_qr_sha2_7cc901_idx'),
+        ),
+    ]
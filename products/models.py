@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
 from products.constant import ProductStatus, VariantStatus, ProductType
+from products.storage import qr_image_storage
 from accounts.models import CustomUser as User
 import os
 
@@ -10,6 +12,10 @@ def stock_qr_image_path(instance, filename):
     
     對於 ESIMIMG:
         media/esimimg/{sku}/{filename}
+
+    ESIMIMG 新上傳的圖片由 qr_image_storage 依內容改存為 esimimg/sha256/ 下的雜湊路徑，
+    此路徑只決定副檔名；舊版圖片仍保留在原本的 SKU 資料夾。
+    其他路徑不改用內容定址，依原路徑儲存。
     """
     if instance.product and instance.product.product_type == ProductType.ESIMIMG:
         # 使用 variant 的 sku 作為資料夾名稱
@@ -194,10 +200,12 @@ class Stock(models.Model):
     code = models.CharField(max_length=255, blank=True, null=True)
     qr_img = models.ImageField(
         upload_to=stock_qr_image_path,
+        storage=qr_image_storage,
         blank=True, 
         null=True, 
         verbose_name='二維碼圖片'
     )
+    qr_sha256 = models.CharField(max_length=64, blank=True, null=True, verbose_name='圖片 SHA-256')
     initial_quantity = models.IntegerField(default=0, verbose_name="初始庫存數量")
     quantity = models.IntegerField(default=0, verbose_name="庫存數量")
     expire_date = models.DateTimeField(null=True, blank=True, verbose_name="過期時間")
@@ -221,7 +229,9 @@ class Stock(models.Model):
         indexes = [
             models.Index(fields=['product', 'is_used', 'quantity']),  # 查詢可用庫存
             models.Index(fields=['code']),  # 根據 code 搜尋
+            models.Index(fields=['qr_sha256']),  # 圖片內容查重
             models.Index(fields=['expire_date']),  # 過期時間排序
+            models.Index(fields=['product', 'is_used', 'expire_date']),  # 最近過期時間
         ]
 
     # 獲取圖片存儲資料夾
@@ -233,6 +243,341 @@ class Stock(models.Model):
             return f'esimimg/{sku}/'
         return 'stocks/qr_images/'
 
+    def save(self, *args, **kwargs):
+        # 先寫入新上傳的圖片，才能由內容定址路徑取得雜湊值（舊版路徑保留原本的雜湊值）
+        if self.qr_img and not self.qr_img._committed:
+            self.qr_img.save(self.qr_img.name, self.qr_img.file, save=False)
+        if not self.qr_img:
+            self.qr_sha256 = None
+        else:
+            self.qr_sha256 = qr_image_storage.digest_from_name(self.qr_img.name) or self.qr_sha256
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def delete_unreferenced_images(cls, names):
+        """
+        刪除沒有任何庫存引用的圖片檔案（內容定址的檔案可能被多筆庫存共用）
+
+        Args:
+            names: 圖片儲存路徑列表
+
+        Returns:
+            int: 刪除的檔案數量
+        """
+        names = set(name for name in names if name)
+        if not names:
+            return 0
+        referenced = set(cls.objects.filter(qr_img__in=names).values_list('qr_img', flat=True))
+        deleted = 0
+        for name in names - referenced:
+            if qr_image_storage.exists(name):
+                qr_image_storage.delete(name)
+                deleted += 1
+        return deleted
+
     def __str__(self):
         return f"{self.product.name} - {self.name} (Qty: {self.quantity})"
 
+
+# 產品庫存彙總
+class VariantStockLevel(models.Model):
+    """
+    每個產品變體的庫存彙總
+
+    由所有異動 Stock 的路徑（新增/修改/刪除庫存、訂單扣除、訂單恢復）
+    在同一交易中即時維護，讓可用庫存查詢變成主鍵查詢。
+    資料偏差時可執行 manage.py rebuild_stock_levels 重新計算。
+
+    - available：未使用庫存數量（is_used=False 的 quantity 總和）
+    - reserved：預訂訂單（HOLDING）保留的數量
+    - used：已扣除數量（initial_quantity - quantity 總和）
+    - next_expiry：未使用庫存中最早的過期時間
+    """
+    variant = models.OneToOneField(
+        'Variant',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stock_level',
+        verbose_name="產品"
+    )
+    available = models.IntegerField(default=0, verbose_name="可用數量")
+    reserved = models.IntegerField(default=0, verbose_name="預訂保留數量")
+    used = models.IntegerField(default=0, verbose_name="已使用數量")
+    next_expiry = models.DateTimeField(null=True, blank=True, verbose_name="最近過期時間")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "variant stock level"
+        verbose_name_plural = "variant stock levels"
+
+    def __str__(self):
+        return f"{self.variant_id} - 可用 {self.available} / 保留 {self.reserved} / 已用 {self.used}"
+
+    @staticmethod
+    def stock_contribution(stock):
+        """
+        單筆庫存對彙總的貢獻
+
+        Returns:
+            tuple: (可用數量, 已使用數量)
+        """
+        available = 0 if stock.is_used else stock.quantity
+        used = stock.initial_quantity - stock.quantity
+        return available, used
+
+    @classmethod
+    def get_available(cls, variant_ids):
+        """
+        批次取得多個變體的可用庫存
+
+        Returns:
+            dict: {variant_id: 可用數量}，沒有彙總資料的變體為 0
+        """
+        variant_ids = list(variant_ids)
+        levels = dict(
+            cls.objects.filter(variant_id__in=variant_ids).values_list('variant_id', 'available')
+        )
+        return {variant_id: levels.get(variant_id, 0) for variant_id in variant_ids}
+
+    @classmethod
+    def apply_deltas(cls, deltas, expiry_variant_ids=None):
+        """
+        以 F() 累加庫存異動量（所有變體一次 UPDATE），並更新最近過期時間
+
+        必須在異動 Stock 的同一交易中呼叫。
+
+        Args:
+            deltas: dict {variant_id: (可用數量變化, 已使用數量變化)}
+            expiry_variant_ids: 未使用庫存有增減（用完、恢復、新增或刪除）的變體，
+                只有這些變體需要重新計算最近過期時間；None 表示 deltas 中的所有變體
+        """
+        deltas = {
+            variant_id: delta for variant_id, delta in deltas.items()
+            if variant_id is not None
+        }
+        if not deltas:
+            return
+
+        cls.objects.bulk_create(
+            [cls(variant_id=variant_id) for variant_id in deltas],
+            ignore_conflicts=True
+        )
+
+        changed = {
+            variant_id: delta for variant_id, delta in deltas.items()
+            if delta[0] or delta[1]
+        }
+        if changed:
+            cls.objects.filter(variant_id__in=changed).update(
+                available=models.F('available') + cls._case_by_variant(
+                    {variant_id: delta[0] for variant_id, delta in changed.items()}
+                ),
+                used=models.F('used') + cls._case_by_variant(
+                    {variant_id: delta[1] for variant_id, delta in changed.items()}
+                )
+            )
+
+        if expiry_variant_ids is None:
+            expiry_variant_ids = deltas.keys()
+        cls.refresh_next_expiry(expiry_variant_ids)
+
+    @staticmethod
+    def _case_by_variant(values, default=0):
+        """依 variant_id 對應不同數值的 CASE 運算式（供單一 UPDATE 更新多個變體）"""
+        return models.Case(
+            *[models.When(variant_id=variant_id, then=models.Value(value)) for variant_id, value in values.items()],
+            default=models.Value(default),
+            output_field=models.IntegerField()
+        )
+
+    @classmethod
+    def apply_stock_change(cls, before=None, after=None):
+        """
+        依單筆庫存異動前後的狀態更新彙總
+
+        Args:
+            before: 異動前的 Stock（新增時為 None）
+            after: 異動後的 Stock（刪除時為 None）
+        """
+        deltas = {}
+        for stock, sign in ((before, -1), (after, 1)):
+            if stock is None:
+                continue
+            available, used = cls.stock_contribution(stock)
+            current = deltas.get(stock.product_id, (0, 0))
+            deltas[stock.product_id] = (current[0] + sign * available, current[1] + sign * used)
+        cls.apply_deltas(deltas)
+
+    @classmethod
+    def refresh_next_expiry(cls, variant_ids):
+        """
+        重新計算最近過期時間（單一 UPDATE 搭配子查詢，使用 product/is_used/expire_date 索引）
+        """
+        variant_ids = [variant_id for variant_id in variant_ids if variant_id is not None]
+        if not variant_ids:
+            return
+
+        cls.objects.filter(variant_id__in=variant_ids).update(
+            next_expiry=models.Subquery(
+                Stock.objects.filter(
+                    product_id=models.OuterRef('variant_id'),
+                    is_used=False
+                ).order_by().values('product_id').annotate(
+                    next_expiry=models.Min('expire_date')
+                ).values('next_expiry')[:1]
+            )
+        )
+
+    @classmethod
+    def refresh_reserved(cls, variant_ids):
+        """
+        重新計算預訂訂單（HOLDING）保留的數量
+        """
+        from business.models import OrderProduct
+        from business.constant import OrderStatus
+
+        variant_ids = [variant_id for variant_id in variant_ids if variant_id is not None]
+        if not variant_ids:
+            return
+
+        reserved = dict(
+            OrderProduct.objects.filter(
+                variant_id__in=variant_ids,
+                order__status=OrderStatus.HOLDING
+            ).values('variant_id').annotate(
+                total=models.Sum('quantity')
+            ).values_list('variant_id', 'total')
+        )
+
+        cls.objects.bulk_create(
+            [cls(variant_id=variant_id) for variant_id in variant_ids],
+            ignore_conflicts=True
+        )
+        cls.objects.filter(variant_id__in=variant_ids).update(
+            reserved=cls._case_by_variant(
+                {variant_id: reserved.get(variant_id) or 0 for variant_id in set(variant_ids)}
+            )
+        )
+
+    @classmethod
+    def rebuild(cls, variant_ids=None):
+        """
+        從 Stock 與預訂訂單完整重新計算彙總
+
+        Args:
+            variant_ids: 指定變體 ID 列表，None 表示全部
+
+        Returns:
+            int: 數值有變動的變體數量
+        """
+        from business.models import OrderProduct
+        from business.constant import OrderStatus
+
+        variants = Variant.objects.all()
+        stocks = Stock.objects.all()
+        reservations = OrderProduct.objects.filter(order__status=OrderStatus.HOLDING)
+        if variant_ids is not None:
+            variants = variants.filter(id__in=variant_ids)
+            stocks = stocks.filter(product_id__in=variant_ids)
+            reservations = reservations.filter(variant_id__in=variant_ids)
+
+        stock_totals = {
+            row['product_id']: row
+            for row in stocks.values('product_id').annotate(
+                available=models.Sum('quantity', filter=models.Q(is_used=False)),
+                used=models.Sum(models.F('initial_quantity') - models.F('quantity')),
+                next_expiry=models.Min('expire_date', filter=models.Q(is_used=False)),
+            )
+        }
+        reserved = dict(
+            reservations.values('variant_id').annotate(
+                total=models.Sum('quantity')
+            ).values_list('variant_id', 'total')
+        )
+        existing = {
+            level.variant_id: level
+            for level in cls.objects.filter(variant_id__in=variants.values('id'))
+        }
+
+        levels = []
+        changed = 0
+        for variant_id in variants.values_list('id', flat=True):
+            totals = stock_totals.get(variant_id, {})
+            level = cls(
+                variant_id=variant_id,
+                available=totals.get('available') or 0,
+                reserved=reserved.get(variant_id) or 0,
+                used=totals.get('used') or 0,
+                next_expiry=totals.get('next_expiry'),
+            )
+            current = existing.get(variant_id)
+            if current is None or (
+                current.available, current.reserved, current.used, current.next_expiry
+            ) != (level.available, level.reserved, level.used, level.next_expiry):
+                changed += 1
+            levels.append(level)
+
+        cls.objects.bulk_create(
+            levels,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['variant'],
+            update_fields=['available', 'reserved', 'used', 'next_expiry', 'updated_at']
+        )
+        return changed
+
+
+# 產品目錄版本
+class CatalogueVersion(models.Model):
+    """
+    產品目錄版本（單列計數器）
+
+    產品、變體或分類異動時遞增，CatalogueSnapshot 以此版本組成快取鍵，
+    CatalogueSearchIndex 以此版本判斷程序內的索引是否需要重建。
+    版本存於資料庫，多個程序（各自使用本機快取）都能看到失效，不依賴共用快取。
+    """
+    version = models.BigIntegerField(default=0, verbose_name="版本")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "catalogue version"
+        verbose_name_plural = "catalogue versions"
+
+    def __str__(self):
+        return str(self.version)
+
+    @classmethod
+    def current(cls):
+        """
+        目前的版本（一次主鍵查詢）
+
+        Returns:
+            int: 版本，尚未建立時為 0
+        """
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        """
+        遞增版本（以 F() 原子遞增，尚未建立時建立）
+
+        Returns:
+            int: 遞增後的版本（在同一交易內讀回，期間其他程序無法遞增，
+            因此回傳值減一必定是本次遞增前的版本）
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(pk=1).update(
+                version=models.F('version') + 1,
+                updated_at=timezone.now()
+            )
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(pk=1, version=1)
+                except IntegrityError:
+                    # 其他交易已建立，改為遞增
+                    cls.objects.filter(pk=1).update(
+                        version=models.F('version') + 1,
+                        updated_at=timezone.now()
+                    )
+            return cls.objects.filter(pk=1).values_list('version', flat=True).get()
@@ -0,0 +1,640 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import islice
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F, Sum, Case, When, Value, IntegerField, Window
+from django.utils import timezone
+from PIL import Image
+
+from products.constant import ProductType, QR_INGEST_CHUNK_SIZE, QR_INGEST_WORKERS
+from products.models import Stock, VariantStockLevel
+from products.storage import file_digest
+from products.derivatives import QRThumbnail
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class StockAllocationError(Exception):
+    """庫存不足或庫存在分配期間被其他交易異動"""
+
+    def __init__(self, message, shortages=None):
+        super().__init__(message)
+        # 格式：{variant_id: {'required': 10, 'available': 3}}
+        self.shortages = shortages or {}
+
+
+# 訂單產品庫存使用記錄解析
+class UsedStockResolver:
+    """
+    將 used_stocks 記錄對應到庫存（不論記錄筆數，只有一次 id__in 查詢）
+
+    可一次載入多個訂單產品的記錄，之後以 details / units 分別取得各訂單產品的明細；
+    已刪除的庫存以 None 表示，由呼叫端顯示佔位資訊。
+    """
+
+    def __init__(self, used_stocks, lock=False):
+        """
+        Args:
+            used_stocks: used_stocks 列表（可合併多個訂單產品的記錄）
+            lock: 是否以 select_for_update 鎖定庫存（必須在 transaction.atomic() 內）
+        """
+        stock_ids = {entry.get('stock_id') for entry in used_stocks if entry.get('stock_id')}
+        queryset = Stock.objects.select_for_update() if lock else Stock.objects.all()
+        self.stocks = queryset.in_bulk(stock_ids) if stock_ids else {}
+
+    def get(self, stock_id):
+        """Returns: Stock，已刪除時為 None"""
+        return self.stocks.get(stock_id)
+
+    def details(self, used_stocks):
+        """
+        庫存使用明細（每筆 used_stocks 記錄一列）
+
+        Returns:
+            list: [{'stock', 'stock_id', 'deducted_quantity', 'stock_quantity_before', 'note'}]
+        """
+        details = []
+        for entry in used_stocks or []:
+            stock_id = entry.get('stock_id')
+            stock = self.get(stock_id)
+            details.append({
+                'stock': stock,
+                'stock_id': stock_id,
+                'deducted_quantity': entry.get('deducted_quantity'),
+                'stock_quantity_before': entry.get('stock_quantity_before'),
+                'note': '' if stock else '庫存記錄已刪除',
+            })
+        return details
+
+    def units(self, used_stocks):
+        """
+        依 deducted_quantity 展開為逐件明細（ESIMIMG 每件對應一張 QR 圖片）
+
+        ESIMIMG 每個 Stock 應該對應一張圖片 (quantity=1)，
+        但為了相容舊資料，仍依 deducted_quantity 重複展開。
+
+        Returns:
+            list: [(順序編號, Stock 或 None（已刪除）, 庫存 ID), ...]
+        """
+        units = []
+        for entry in used_stocks or []:
+            stock_id = entry.get('stock_id')
+            stock = self.get(stock_id)
+            for _ in range(int(entry.get('deducted_quantity') or 0)):
+                units.append((len(units) + 1, stock, stock_id))
+        return units
+
+
+# 庫存分配服務（FIFO）
+class StockAllocator:
+    """
+    以集合運算進行 FIFO 庫存扣除與恢復
+
+    扣除流程（不論訂單大小，查詢數固定）：
+    1. 以視窗函數計算每個變體在建立時間順序下的累計數量，
+       一次選出「累計前數量 < 需求數量」的庫存列
+    2. 對選出的庫存列加鎖並確認數量未被其他交易異動
+    3. 在記憶體中計算扣除量，以 bulk_update 一次寫回並同步 VariantStockLevel
+
+    回傳的 used_stocks 格式與 OrderProduct.used_stocks 相同：
+    [{'stock_id': 1, 'deducted_quantity': 5, 'stock_quantity_before': 10}, ...]
+    """
+
+    # 鎖定後若發現庫存已被異動，重新選取的次數上限
+    max_retries = 3
+    batch_size = 500
+
+    @staticmethod
+    def available_quantities(variant_ids):
+        """
+        一次查詢多個變體的可用庫存數量（讀取 VariantStockLevel 彙總）
+
+        Args:
+            variant_ids: 變體 ID 列表
+
+        Returns:
+            dict: {variant_id: 可用數量}，沒有庫存的變體為 0
+        """
+        return VariantStockLevel.get_available(variant_ids)
+
+    @classmethod
+    def allocate(cls, requirements):
+        """
+        依 FIFO 原則為多個變體扣除庫存
+
+        必須在 transaction.atomic() 內呼叫。
+
+        Args:
+            requirements: dict {variant_id: 需求數量}
+
+        Returns:
+            dict: {variant_id: used_stocks 列表}
+
+        Raises:
+            StockAllocationError: 任一變體庫存不足
+        """
+        requirements = {
+            variant_id: quantity
+            for variant_id, quantity in requirements.items()
+            if quantity > 0
+        }
+        if not requirements:
+            return {}
+
+        for attempt in range(cls.max_retries):
+            # 1. 視窗函數選出需要扣除的庫存列
+            candidates = cls._select_candidates(requirements)
+
+            # 2. 加鎖並確認數量一致
+            locked = {
+                stock.id: stock
+                for stock in Stock.objects.select_for_update().filter(
+                    id__in=[row['id'] for row in candidates]
+                )
+            }
+            if all(
+                row['id'] in locked
+                and not locked[row['id']].is_used
+                and locked[row['id']].quantity == row['quantity']
+                for row in candidates
+            ):
+                break
+            logger.warning(f'庫存分配期間庫存已被異動，重新選取（第 {attempt + 1} 次）')
+        else:
+            raise StockAllocationError('庫存正在被其他訂單使用，請稍後再試')
+
+        # 3. 計算扣除量
+        now = timezone.now()
+        allocations = {variant_id: [] for variant_id in requirements}
+        remaining = dict(requirements)
+        changed_stocks = []
+        deltas = {}
+        used_up = set()
+
+        for row in candidates:
+            variant_id = row['product_id']
+            if remaining[variant_id] <= 0:
+                continue
+
+            stock = locked[row['id']]
+            before = VariantStockLevel.stock_contribution(stock)
+            deduct_quantity = min(stock.quantity, remaining[variant_id])
+
+            allocations[variant_id].append({
+                'stock_id': stock.id,
+                'deducted_quantity': deduct_quantity,
+                'stock_quantity_before': stock.quantity
+            })
+
+            stock.quantity -= deduct_quantity
+            if stock.quantity <= 0:
+                stock.is_used = True
+                stock.exchange_time = now
+                used_up.add(variant_id)
+            stock.updated_at = now
+            changed_stocks.append(stock)
+            cls._add_delta(deltas, stock, before)
+
+            remaining[variant_id] -= deduct_quantity
+
+        shortages = {
+            variant_id: {
+                'required': requirements[variant_id],
+                'available': requirements[variant_id] - quantity
+            }
+            for variant_id, quantity in remaining.items()
+            if quantity > 0
+        }
+        if shortages:
+            raise StockAllocationError('庫存不足', shortages=shortages)
+
+        # 4. 一次寫回並更新庫存彙總
+        Stock.objects.bulk_update(
+            changed_stocks,
+            ['quantity', 'is_used', 'exchange_time', 'updated_at'],
+            batch_size=cls.batch_size
+        )
+        # 只有庫存被用完的變體，最近過期時間才可能改變
+        VariantStockLevel.apply_deltas(deltas, expiry_variant_ids=used_up)
+
+        logger.info(
+            f'庫存分配完成：{len(requirements)} 個變體，'
+            f'異動 {len(changed_stocks)} 筆庫存'
+        )
+        return allocations
+
+    @classmethod
+    def allocate_one(cls, variant_id, quantity):
+        """
+        為單一變體扣除庫存
+
+        Returns:
+            list: used_stocks 列表
+        """
+        return cls.allocate({variant_id: quantity}).get(variant_id, [])
+
+    @classmethod
+    def release(cls, used_stocks, resolver=None):
+        """
+        依 used_stocks 記錄恢復庫存
+
+        必須在 transaction.atomic() 內呼叫。
+
+        Args:
+            used_stocks: used_stocks 列表（可合併多個訂單產品的記錄）
+            resolver: 已鎖定庫存的 UsedStockResolver（多個訂單產品分別恢復時共用，避免重複查詢）
+
+        Returns:
+            tuple: (已恢復列表, 已被刪除的庫存 ID 列表)
+                已恢復列表格式：[{'stock_id', 'restored_quantity', 'current_quantity', 'stock'}]
+        """
+        if not used_stocks:
+            return [], []
+
+        if resolver is None:
+            resolver = UsedStockResolver(used_stocks, lock=True)
+        stocks = resolver.stocks
+
+        now = timezone.now()
+        restored = []
+        missing_ids = []
+        changed = {}
+        deltas = {}
+        reopened = set()
+
+        for entry in used_stocks:
+            stock = stocks.get(entry['stock_id'])
+            if stock is None:
+                missing_ids.append(entry['stock_id'])
+                continue
+
+            before = VariantStockLevel.stock_contribution(stock)
+            stock.quantity += entry['deducted_quantity']
+            # 如果庫存恢復到大於 0，取消已使用標記
+            if stock.quantity > 0:
+                if stock.is_used:
+                    reopened.add(stock.product_id)
+                stock.is_used = False
+                stock.exchange_time = None
+            stock.updated_at = now
+            changed[stock.id] = stock
+            cls._add_delta(deltas, stock, before)
+
+            restored.append({
+                'stock_id': stock.id,
+                'restored_quantity': entry['deducted_quantity'],
+                'current_quantity': stock.quantity,
+                'stock': stock,
+            })
+
+        Stock.objects.bulk_update(
+            list(changed.values()),
+            ['quantity', 'is_used', 'exchange_time', 'updated_at'],
+            batch_size=cls.batch_size
+        )
+        # 只有已用完的庫存恢復可用時，最近過期時間才可能改變
+        VariantStockLevel.apply_deltas(deltas, expiry_variant_ids=reopened)
+
+        return restored, missing_ids
+
+    @staticmethod
+    def _add_delta(deltas, stock, before):
+        """累加單筆庫存異動對 VariantStockLevel 的影響"""
+        after = VariantStockLevel.stock_contribution(stock)
+        available, used = deltas.get(stock.product_id, (0, 0))
+        deltas[stock.product_id] = (
+            available + after[0] - before[0],
+            used + after[1] - before[1]
+        )
+
+    @staticmethod
+    def _select_candidates(requirements):
+        """
+        以累計數量選出每個變體需要扣除的最少庫存列（依建立時間排序）
+        """
+        required = Case(
+            *[
+                When(product_id=variant_id, then=Value(quantity))
+                for variant_id, quantity in requirements.items()
+            ],
+            default=Value(0),
+            output_field=IntegerField()
+        )
+
+        return list(
+            Stock.objects.filter(
+                product_id__in=list(requirements),
+                is_used=False,
+                quantity__gt=0
+            ).annotate(
+                running_before=Window(
+                    expression=Sum('quantity'),
+                    partition_by=[F('product_id')],
+                    order_by=[F('created_at').asc(), F('id').asc()]
+                ) - F('quantity'),
+                required=required
+            ).filter(
+                running_before__lt=F('required')
+            ).order_by(
+                'product_id', 'created_at', 'id'
+            ).values('id', 'product_id', 'quantity')
+        )
+
+
+class QRIngestResult:
+    """ESIMIMG 圖片批次入庫結果"""
+
+    def __init__(self):
+        self.created = 0
+        # 格式：[(檔名, 原因), ...]
+        self.failures = []
+
+    def fail(self, filename, reason):
+        self.failures.append((filename, reason))
+
+    def summary(self, limit=5):
+        """
+        結果摘要文字
+
+        Args:
+            limit: 最多列出幾個失敗檔案
+        """
+        message = f'已建立 {self.created} 筆庫存'
+        if self.failures:
+            details = '、'.join(f'{filename}（{reason}）' for filename, reason in self.failures[:limit])
+            more = f' 等 {len(self.failures)} 個檔案' if len(self.failures) > limit else ''
+            message += f'，{len(self.failures)} 個檔案失敗：{details}{more}'
+        return message
+
+
+# ESIMIMG 圖片批次入庫
+class QRStockIngestor:
+    """
+    將 QR 圖片批次建立為 ESIMIMG 庫存（每張圖片一筆，數量 = 1，檔名為庫存代碼）
+
+    來源可以是上傳的圖片、ZIP 檔或伺服器上的資料夾，處理流程：
+    1. 只讀取檔名檢查副檔名與代碼，並排除檔案內重複的代碼
+    2. 以分段的 code__in 查詢排除已存在的代碼
+    3. 每 chunk_size 個檔案一批：依序讀取內容（ZIP 逐一解壓，不整包載入記憶體），
+       由執行緒池驗證圖片並計算 SHA-256，排除內容與已匯入圖片或既有庫存（qr_sha256）重複者，
+       再平行寫入內容定址儲存，最後以 bulk_create 建立庫存並更新庫存彙總，並產生縮圖
+
+    單一檔案失敗不影響其他檔案，失敗原因記錄在 QRIngestResult。
+    """
+
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+    lookup_chunk_size = 500
+
+    def __init__(self, variant, name, description='', expire_date=None,
+                 chunk_size=QR_INGEST_CHUNK_SIZE, max_workers=QR_INGEST_WORKERS):
+        if variant.product_type != ProductType.ESIMIMG:
+            raise ValueError(f'產品變體「{variant.name}」不是圖庫 eSIM，無法匯入 QR 圖片')
+        if not variant.sku:
+            raise ValueError(
+                f'產品變體「{variant.name}」未設定 SKU，無法上傳 ESIMIMG 圖片。'
+                f'請先在產品管理中設定 SKU。'
+            )
+        self.variant = variant
+        self.name = name
+        self.description = description
+        self.expire_date = expire_date
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.field = Stock._meta.get_field('qr_img')
+        # 本次匯入已接受的圖片：{雜湊值: 檔名}
+        self.seen_digests = {}
+
+    def ingest_uploads(self, files):
+        """
+        匯入上傳的圖片檔案
+
+        Args:
+            files: UploadedFile 列表
+        """
+        return self.ingest((upload.name, upload.read) for upload in files)
+
+    def ingest_zip(self, fileobj):
+        """
+        匯入 ZIP 檔中的圖片（忽略資料夾結構，只使用檔名）
+
+        Args:
+            fileobj: ZIP 檔案路徑或可 seek 的檔案物件
+        """
+        with zipfile.ZipFile(fileobj) as archive:
+            return self.ingest(
+                (info.filename, lambda info=info: archive.read(info))
+                for info in archive.infolist()
+                if not info.is_dir()
+            )
+
+    def ingest_directory(self, path):
+        """
+        匯入資料夾（含子資料夾）中的圖片
+
+        Args:
+            path: 資料夾路徑
+        """
+        def read_file(file_path):
+            with open(file_path, 'rb') as f:
+                return f.read()
+
+        entries = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                file_path = os.path.join(root, filename)
+                entries.append((
+                    os.path.relpath(file_path, path),
+                    lambda file_path=file_path: read_file(file_path)
+                ))
+        return self.ingest(entries)
+
+    def ingest(self, entries):
+        """
+        匯入圖片
+
+        Args:
+            entries: (檔名, 讀取內容的函數) 可迭代物件
+
+        Returns:
+            QRIngestResult
+        """
+        result = QRIngestResult()
+
+        # 1. 檢查檔名
+        candidates = []
+        seen = set()
+        for filename, read in entries:
+            basename = os.path.basename(filename)
+            # 略過系統產生的檔案（例如 macOS 的 __MACOSX/、._ 開頭的檔案）
+            if not basename or basename.startswith('.') or '__MACOSX' in filename:
+                continue
+
+            code, extension = os.path.splitext(basename)
+            code = code.strip()
+            if extension.lower() not in self.IMAGE_EXTENSIONS:
+                result.fail(filename, '不支援的檔案類型')
+            elif not code:
+                result.fail(filename, '檔名無效')
+            elif code in seen:
+                result.fail(filename, '檔案內代碼重複')
+            else:
+                seen.add(code)
+                candidates.append((filename, basename, code, read))
+
+        # 2. 排除已存在的代碼
+        existing = self.find_existing_codes(seen)
+        for filename, _, code, _ in candidates:
+            if code in existing:
+                result.fail(filename, '代碼已存在')
+        candidates = [candidate for candidate in candidates if candidate[2] not in existing]
+
+        # 3. 分批寫入
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            iterator = iter(candidates)
+            while True:
+                chunk = list(islice(iterator, self.chunk_size))
+                if not chunk:
+                    break
+                self._ingest_chunk(chunk, pool, result)
+
+        logger.info(
+            f'ESIMIMG 圖片入庫完成：變體 {self.variant.id}（{self.variant.sku}），'
+            f'建立 {result.created} 筆，失敗 {len(result.failures)} 個檔案'
+        )
+        return result
+
+    @classmethod
+    def find_existing_codes(cls, codes):
+        """
+        查詢已存在於庫存的代碼（每 lookup_chunk_size 個一次查詢，使用 code 索引）
+
+        Returns:
+            set: 已存在的代碼
+        """
+        codes = list(codes)
+        existing = set()
+        for start in range(0, len(codes), cls.lookup_chunk_size):
+            existing.update(
+                Stock.objects.filter(
+                    code__in=codes[start:start + cls.lookup_chunk_size]
+                ).values_list('code', flat=True)
+            )
+        return existing
+
+    def _ingest_chunk(self, chunk, pool, result):
+        """讀取一批檔案，排除內容重複的圖片，平行寫入儲存空間後一次建立庫存"""
+        # 1. 依序讀取內容，交給執行緒池驗證圖片並計算雜湊值
+        pending = []
+        for filename, basename, code, read in chunk:
+            try:
+                data = read()
+            except Exception as e:
+                logger.warning(f'讀取檔案 {filename} 失敗：{str(e)}')
+                result.fail(filename, '無法讀取檔案')
+                continue
+            pending.append((filename, basename, code, data, pool.submit(self._inspect_file, data)))
+
+        inspected = []
+        for filename, basename, code, data, future in pending:
+            try:
+                digest = future.result()
+            except Exception as e:
+                result.fail(filename, str(e))
+                continue
+            inspected.append((filename, basename, code, data, digest))
+
+        # 2. 排除內容重複的圖片（本次匯入中重複或已存在於庫存）
+        existing = dict(
+            Stock.objects.filter(
+                qr_sha256__in=[digest for *_, digest in inspected]
+            ).values_list('qr_sha256', 'code')
+        )
+        accepted = []
+        for filename, basename, code, data, digest in inspected:
+            if digest in existing:
+                result.fail(filename, f'圖片內容與庫存代碼 {existing[digest]} 重複')
+            elif digest in self.seen_digests:
+                result.fail(filename, f'圖片內容與 {self.seen_digests[digest]} 重複')
+            else:
+                self.seen_digests[digest] = filename
+                accepted.append((filename, basename, code, data, digest))
+
+        # 3. 由執行緒池平行寫入儲存空間
+        futures = [
+            (filename, code, data, digest, pool.submit(self._store_file, basename, data))
+            for filename, basename, code, data, digest in accepted
+        ]
+        stocks = []
+        contents = []
+        for filename, code, data, digest, future in futures:
+            try:
+                path = future.result()
+            except Exception as e:
+                logger.warning(f'儲存檔案 {filename} 失敗：{str(e)}')
+                result.fail(filename, '無法儲存檔案')
+                continue
+            stocks.append(Stock(
+                product=self.variant,
+                name=f'{self.name} - {code}',
+                description=self.description,
+                qr_img=path,
+                qr_sha256=digest,
+                code=code,
+                initial_quantity=1,
+                quantity=1,
+                expire_date=self.expire_date,
+                is_used=False
+            ))
+            contents.append(data)
+
+        if not stocks:
+            return
+
+        # 4. 建立庫存並更新庫存彙總，失敗時移除本批已寫入且未被引用的檔案
+        try:
+            with transaction.atomic():
+                Stock.objects.bulk_create(stocks, batch_size=self.chunk_size)
+                VariantStockLevel.apply_deltas({self.variant.id: (len(stocks), 0)})
+        except Exception as e:
+            logger.error(f'建立 ESIMIMG 庫存失敗：{str(e)}', exc_info=True)
+            Stock.delete_unreferenced_images([stock.qr_img.name for stock in stocks])
+            for stock in stocks:
+                result.fail(f'{stock.code}', '建立庫存失敗')
+            return
+
+        result.created += len(stocks)
+
+        # 5. 由已讀取的內容產生縮圖（失敗時於第一次顯示時補產生）
+        if all(stock.pk for stock in stocks):
+            list(pool.map(QRThumbnail.safe_generate, stocks, contents))
+
+    @staticmethod
+    def _inspect_file(data):
+        """
+        驗證圖片並計算內容雜湊值（於執行緒池中執行）
+
+        Returns:
+            str: SHA-256 雜湊值
+        """
+        try:
+            with Image.open(BytesIO(data)) as image:
+                image.verify()
+        except Exception:
+            raise ValueError('不是有效的圖片')
+        return file_digest(data)
+
+    def _store_file(self, basename, data):
+        """
+        寫入儲存空間（於執行緒池中執行，檔名由內容雜湊值決定）
+
+        Returns:
+            str: 儲存後的檔案路徑
+        """
+        name = self.field.generate_filename(Stock(product=self.variant), basename)
+        return self.field.storage.save(name, ContentFile(data))
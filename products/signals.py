@@ -0,0 +1,47 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.db import transaction
+from products.models import Product, Variant, Category, Stock
+from products.catalogue import CatalogueSnapshot, search_index
+from products.derivatives import QRThumbnail
+import logging
+
+logger = logging.getLogger(__name__)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalogue_snapshot(sender, instance, **kwargs):
+    """
+    分類異動時讓產品目錄快照失效
+
+    於交易提交後執行，避免其他請求在提交前重新快取舊資料。
+    產品與變體異動由搜尋索引更新遞增 CatalogueVersion，同樣會讓快照失效。
+    庫存異動不需讓快照失效：快照不含可用庫存，取得快照時才由庫存彙總覆寫。
+    """
+    transaction.on_commit(CatalogueSnapshot.invalidate)
+
+
+@receiver(post_save, sender=Variant)
+@receiver(post_delete, sender=Variant)
+def update_search_index_on_variant_change(sender, instance, **kwargs):
+    """變體異動時重新索引該變體（下架或刪除則移出搜尋索引），並讓產品目錄快照失效"""
+    variant_id = instance.pk
+    transaction.on_commit(lambda: search_index.update_variants(variant_ids=[variant_id]))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_search_index_on_product_change(sender, instance, **kwargs):
+    """產品異動時重新索引其所有變體（產品名稱、描述與上下架狀態都會影響搜尋），並讓產品目錄快照失效"""
+    product_id = instance.pk
+    transaction.on_commit(lambda: search_index.update_variants(product_ids=[product_id]))
+
+
+@receiver(post_delete, sender=Stock)
+def delete_unreferenced_qr_image(sender, instance, **kwargs):
+    """庫存刪除後移除不再被引用的 QR 圖片及其縮圖（交易提交後執行，回滾時保留檔案）"""
+    name = instance.qr_img.name if instance.qr_img else None
+    if name:
+        thumbnail_name = QRThumbnail.name_for(instance)
+        transaction.on_commit(lambda: Stock.delete_unreferenced_images([name]))
+        transaction.on_commit(lambda: QRThumbnail.delete(thumbnail_name))
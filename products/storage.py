@@ -0,0 +1,113 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+import logging
+logger = logging.getLogger(__name__)
+
+# QR 圖片根目錄（舊版依 SKU 存放於 esimimg/{sku}/，內容定址檔案存放於 esimimg/sha256/）
+QR_IMAGE_ROOT = 'esimimg'
+QR_STORE_DIRECTORY = f'{QR_IMAGE_ROOT}/sha256'
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def file_digest(content):
+    """
+    計算檔案內容的 SHA-256
+
+    Args:
+        content: Django File 物件或 bytes
+
+    Returns:
+        str: 十六進位雜湊值
+    """
+    sha256 = hashlib.sha256()
+    if isinstance(content, bytes):
+        sha256.update(content)
+    else:
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+    return sha256.hexdigest()
+
+
+# 內容定址儲存
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    以內容 SHA-256 決定檔名的檔案儲存（忽略上傳檔名，只保留副檔名）
+
+    路徑格式：{directory}/ab/cd/abcd...{ext}，以雜湊前兩段分層避免單一資料夾檔案過多。
+    相同內容只會存一份；寫入時先寫暫存檔再以 os.replace 取代，同時寫入相同內容也不會衝突。
+
+    只有 root 之下的上傳路徑（ESIMIMG 圖片，見 stock_qr_image_path）改用內容定址，
+    其他路徑照一般 FileSystemStorage 儲存；讀取不受影響，既有檔案都依原路徑取得。
+    """
+
+    def __init__(self, directory=QR_STORE_DIRECTORY, root=QR_IMAGE_ROOT, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.root = root
+
+    def is_content_addressed(self, name):
+        """上傳路徑是否改用內容定址（位於 root 之下）"""
+        return name.replace('\\', '/').startswith(f'{self.root}/')
+
+    def hashed_name(self, digest, extension=''):
+        """依雜湊值產生儲存路徑"""
+        return f'{self.directory}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+    def digest_from_name(self, name):
+        """
+        由儲存路徑取得雜湊值
+
+        Returns:
+            str: 雜湊值，不是內容定址路徑（例如舊版檔案）時為 None
+        """
+        if not name or not name.startswith(f'{self.directory}/'):
+            return None
+        digest = os.path.splitext(os.path.basename(name))[0]
+        return digest if DIGEST_PATTERN.match(digest) else None
+
+    def get_available_name(self, name, max_length=None):
+        if not self.is_content_addressed(name):
+            return super().get_available_name(name, max_length=max_length)
+        # 實際檔名於 _save 依內容決定，不需要避開同名檔案
+        return name
+
+    def _save(self, name, content):
+        if not self.is_content_addressed(name):
+            return super()._save(name, content)
+
+        name = self.hashed_name(file_digest(content), os.path.splitext(name)[1])
+        if self.exists(name):
+            return name
+
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, full_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+qr_image_storage = ContentAddressedStorage()
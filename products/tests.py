@@ -1,3 +1,259 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from products.catalogue import CatalogueSearchIndex
+from products.constant import ProductStatus, VariantStatus, ProductType
+from products.models import Supplier, Category, Product, Variant, Stock, VariantStockLevel, CatalogueVersion
+from products.services import StockAllocator, StockAllocationError
+from products.storage import qr_image_storage
+
+
+def create_variant(name, product_code='', product_type=ProductType.ESIM):
+    """建立上架產品與變體"""
+    supplier, _ = Supplier.objects.get_or_create(supplier_code='TEST', defaults={'name': '測試供應商'})
+    category, _ = Category.objects.get_or_create(name='測試分類')
+    product = Product.objects.create(name=name, category=category, status=ProductStatus.ACTIVE)
+    return Variant.objects.create(
+        product=product,
+        supplier=supplier,
+        name=name,
+        product_code=product_code,
+        product_type=product_type,
+        status=VariantStatus.ACTIVE,
+        price=100
+    )
+
+
+def create_stock(variant, quantity, expire_days=30):
+    """建立庫存並同步庫存彙總"""
+    stock = Stock.objects.create(
+        name=f'{variant.name} 庫存',
+        product=variant,
+        quantity=quantity,
+        initial_quantity=quantity,
+        expire_date=timezone.now() + timedelta(days=expire_days)
+    )
+    VariantStockLevel.apply_stock_change(after=stock)
+    return stock
+
+
+class StockAllocatorTests(TestCase):
+    """庫存分配與恢復"""
+
+    def setUp(self):
+        self.variant = create_variant('日本 5G')
+        self.other = create_variant('韓國 5G')
+        self.early = create_stock(self.variant, 5, expire_days=10)
+        self.late = create_stock(self.variant, 10, expire_days=20)
+        self.other_stock = create_stock(self.other, 3)
+
+    def test_allocate_uses_earliest_expiry_first(self):
+        allocations = StockAllocator.allocate({self.variant.id: 7, self.other.id: 3})
+
+        self.assertEqual(
+            [(entry['stock_id'], entry['deducted_quantity']) for entry in allocations[self.variant.id]],
+            [(self.early.id, 5), (self.late.id, 2)]
+        )
+        self.early.refresh_from_db()
+        self.late.refresh_from_db()
+        self.other_stock.refresh_from_db()
+        self.assertTrue(self.early.is_used)
+        self.assertEqual(self.late.quantity, 8)
+        self.assertTrue(self.other_stock.is_used)
+
+    def test_release_restores_stock(self):
+        allocations = StockAllocator.allocate({self.variant.id: 7})
+        restored, missing = StockAllocator.release(allocations[self.variant.id])
+
+        self.assertEqual(missing, [])
+        self.assertEqual(sum(entry['restored_quantity'] for entry in restored), 7)
+        self.early.refresh_from_db()
+        self.late.refresh_from_db()
+        self.assertFalse(self.early.is_used)
+        self.assertEqual((self.early.quantity, self.late.quantity), (5, 10))
+
+    def test_shortage_raises_without_changes(self):
+        with self.assertRaises(StockAllocationError) as context:
+            StockAllocator.allocate({self.variant.id: 7, self.other.id: 4})
+
+        self.assertEqual(context.exception.shortages, {self.other.id: {'required': 4, 'available': 3}})
+        self.assertEqual(
+            sorted(Stock.objects.values_list('quantity', flat=True)),
+            [3, 5, 10]
+        )
+
+    def test_release_skips_deleted_stock(self):
+        allocations = StockAllocator.allocate({self.variant.id: 7})
+        deleted_id = self.late.id
+        self.late.delete()
+
+        restored, missing = StockAllocator.release(allocations[self.variant.id])
+
+        self.assertEqual(missing, [deleted_id])
+        self.assertEqual([entry['stock_id'] for entry in restored], [self.early.id])
+
+
+class VariantStockLevelTests(TestCase):
+    """庫存彙總的增量維護與完整重算一致"""
+
+    def setUp(self):
+        self.variant = create_variant('日本 5G')
+        self.other = create_variant('韓國 5G')
+        self.early = create_stock(self.variant, 5, expire_days=10)
+        self.late = create_stock(self.variant, 10, expire_days=20)
+        create_stock(self.other, 3)
+
+    def assertStockLevelsConsistent(self):
+        # 增量維護的彙總與完整重算的結果一致
+        self.assertEqual(VariantStockLevel.rebuild(), 0)
+
+    def test_allocate_updates_levels_and_next_expiry(self):
+        StockAllocator.allocate({self.variant.id: 7, self.other.id: 3})
+
+        level = VariantStockLevel.objects.get(variant=self.variant)
+        self.assertEqual((level.available, level.used), (8, 7))
+        self.assertEqual(level.next_expiry, self.late.expire_date)
+        self.assertEqual(VariantStockLevel.objects.get(variant=self.other).available, 0)
+        self.assertStockLevelsConsistent()
+
+    def test_release_restores_levels_and_next_expiry(self):
+        allocations = StockAllocator.allocate({self.variant.id: 7})
+        StockAllocator.release(allocations[self.variant.id])
+
+        level = VariantStockLevel.objects.get(variant=self.variant)
+        self.assertEqual((level.available, level.used), (15, 0))
+        self.assertEqual(level.next_expiry, self.early.expire_date)
+        self.assertStockLevelsConsistent()
+
+    def test_shortage_leaves_levels_unchanged(self):
+        with self.assertRaises(StockAllocationError):
+            StockAllocator.allocate({self.variant.id: 7, self.other.id: 4})
+
+        self.assertEqual(VariantStockLevel.get_available([self.variant.id, self.other.id]), {
+            self.variant.id: 15,
+            self.other.id: 3,
+        })
+        self.assertStockLevelsConsistent()
+
+    def test_stock_edit_and_delete(self):
+        before = Stock.objects.get(pk=self.early.pk)
+        self.early.quantity = 2
+        self.early.save()
+        VariantStockLevel.apply_stock_change(before=before, after=self.early)
+
+        self.late.delete()
+        VariantStockLevel.apply_stock_change(before=self.late)
+
+        level = VariantStockLevel.objects.get(variant=self.variant)
+        self.assertEqual(level.available, 2)
+        self.assertEqual(level.next_expiry, self.early.expire_date)
+        self.assertStockLevelsConsistent()
+
+
+class CatalogueSearchIndexTests(TestCase):
+    """產品目錄搜尋索引"""
+
+    def setUp(self):
+        self.japan = create_variant('日本 Japan 吃到飽', product_code='JP30D')
+        self.thailand = create_variant('泰國 Thailand', product_code='TH5')
+        self.index = CatalogueSearchIndex()
+
+    def search_names(self, query):
+        return sorted(
+            Variant.objects.filter(id__in=self.index.search(query)).values_list('name', flat=True)
+        )
+
+    def test_latin_and_digit_terms_match_substrings(self):
+        self.assertEqual(self.search_names('apan'), ['日本 Japan 吃到飽'])
+        self.assertEqual(self.search_names('30'), ['日本 Japan 吃到飽'])
+        self.assertEqual(self.search_names('hail'), ['泰國 Thailand'])
+
+    def test_cjk_terms_match_bigrams(self):
+        self.assertEqual(self.search_names('日本'), ['日本 Japan 吃到飽'])
+        self.assertEqual(self.search_names('日本 泰國'), [])
+
+    def test_local_change_updates_incrementally(self):
+        self.index.search('japan')
+        self.thailand.name = '泰國 Bangkok'
+
+        with mock.patch.object(self.index, 'rebuild', wraps=self.index.rebuild) as rebuild:
+            # TestCase 中不會執行 on_commit，直接以 signals 會呼叫的方式更新本索引
+            self.thailand.save()
+            self.index.update_variants(variant_ids=[self.thailand.id])
+
+            self.assertEqual(self.search_names('bangkok'), ['泰國 Bangkok'])
+            rebuild.assert_not_called()
+        self.assertEqual(self.index.version, CatalogueVersion.current())
+
+    def test_change_from_other_process_rebuilds(self):
+        self.index.search('japan')
+
+        # 其他程序的異動：資料與 CatalogueVersion 都已改變，本程序的索引未收到通知
+        Variant.objects.filter(pk=self.thailand.pk).update(name='泰國 Bangkok')
+        CatalogueVersion.bump()
+
+        self.assertEqual(self.search_names('bangkok'), ['泰國 Bangkok'])
+
+    def test_missed_change_is_not_applied_incrementally(self):
+        self.index.search('japan')
+        Variant.objects.filter(pk=self.thailand.pk).update(name='泰國 Bangkok')
+        CatalogueVersion.bump()
+
+        # 本程序的異動遞增版本時發現遺漏了其他程序的異動
+        self.index.update_variants(variant_ids=[self.japan.id])
+
+        self.assertIsNone(self.index.version)
+        self.assertEqual(self.search_names('bangkok'), ['泰國 Bangkok'])
+
+
+class ContentAddressedStorageTests(TestCase):
+    """QR 圖片只有 ESIMIMG 的上傳路徑改用內容定址"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_esimimg_uploads_are_content_addressed(self):
+        variant = create_variant('日本 圖庫', product_type=ProductType.ESIMIMG)
+        variant.sku = 'JP-IMG'
+        stock = Stock(name='圖庫', product=variant, qr_img=ContentFile(b'qr', name='a.png'))
+        stock.save()
+        other = qr_image_storage.save('esimimg/JP-IMG/b.png', ContentFile(b'qr'))
+
+        self.assertTrue(stock.qr_img.name.startswith('esimimg/sha256/'))
+        self.assertEqual(other, stock.qr_img.name)
+        self.assertEqual(stock.qr_sha256, qr_image_storage.digest_from_name(other))
+
+    def test_other_paths_keep_their_names(self):
+        first = qr_image_storage.save('stocks/qr_images/a.png', ContentFile(b'qr'))
+        second = qr_image_storage.save('stocks/qr_images/a.png', ContentFile(b'qr'))
+
+        self.assertEqual(first, 'stocks/qr_images/a.png')
+        self.assertNotEqual(second, first)
+        self.assertIsNone(qr_image_storage.digest_from_name(first))
+
+    def test_existing_files_still_resolve(self):
+        variant = create_variant('日本 5G')
+        for name in ('esimimg/JP-IMG/legacy.png', 'stocks/qr_images/legacy.png'):
+            default_storage.save(name, ContentFile(b'legacy'))
+            stock = Stock.objects.create(name='舊版', product=variant, qr_img=name)
+            stock.refresh_from_db()
+
+            self.assertEqual(stock.qr_img.name, name)
+            self.assertEqual(stock.qr_img.path, os.path.join(self.media_root, name))
+            self.assertEqual(stock.qr_img.url, default_storage.url(name))
+            with stock.qr_img.open('rb') as f:
+                self.assertEqual(f.read(), b'legacy')
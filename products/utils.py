@@ -1,6 +1,7 @@
+import re
 from decimal import Decimal
 from accounts.constant import AccountRole
-from accounts.utils import is_headquarter_admin, is_agent, is_distributor, is_peer
+from accounts.utils import is_headquarter_admin, is_agent, is_distributor, is_peer, get_variant_display_price
 
 
 def format_price(price, show_currency=True):
@@ -93,18 +94,33 @@ def get_distributor_price(variant, distributor_user):
     try:
         # 查找該 AGENT 為此 Variant 設定的經銷價格
         pricing = AgentDistributorPricing.objects.get(variant=variant, agent=agent)
-        
-        display_price = pricing.price_sales_distr or pricing.price_distr or 0
-        original_price = pricing.price_distr if pricing.price_sales_distr else None
-        has_sale = bool(pricing.price_sales_distr and pricing.price_distr and pricing.price_sales_distr < pricing.price_distr)
-        
-        return display_price, original_price, has_sale
+        return get_distributor_pricing_price(pricing)
     
     except AgentDistributorPricing.DoesNotExist:
         # 如果 AGENT 尚未設定價格，返回 0
         return 0, None, False
 
 
+def get_distributor_pricing_price(pricing):
+    """
+    從 AgentDistributorPricing 計算經銷商的價格
+    
+    Args:
+        pricing: AgentDistributorPricing 實例或 None
+        
+    Returns:
+        tuple: (顯示價格, 原價, 是否有特價)
+    """
+    if pricing is None:
+        return 0, None, False
+    
+    display_price = pricing.price_sales_distr or pricing.price_distr or 0
+    original_price = pricing.price_distr if pricing.price_sales_distr else None
+    has_sale = bool(pricing.price_sales_distr and pricing.price_distr and pricing.price_sales_distr < pricing.price_distr)
+    
+    return display_price, original_price, has_sale
+
+
 def get_peer_price(variant):
     """
     獲取同業角色的價格
@@ -181,6 +197,101 @@ def get_variant_price_for_user(variant, user):
         return get_user_price(variant)
 
 
+class PriceBook:
+    """
+    單次請求內的價格簿
+    
+    在同一個請求中為同一位用戶計算多個變體的價格時使用：
+    經銷商的上級代理商經銷價格（AgentDistributorPricing）只在第一次需要時
+    一次載入，之後所有變體的價格都從記憶體計算，查詢數不隨變體數量增加。
+    
+    使用方式：
+        price_book = PriceBook(request.user)
+        display_price, original_price, has_sale = price_book.get_price(variant)
+    """
+    
+    def __init__(self, user):
+        self.user = user
+        self.role = user.role if user.is_authenticated else None
+        self._distributor_pricings = None
+    
+    @property
+    def distributor_pricings(self):
+        """
+        上級代理商設定的所有經銷價格
+        
+        Returns:
+            dict: {variant_id: AgentDistributorPricing}，非經銷商為空 dict
+        """
+        if self._distributor_pricings is None:
+            from products.models import AgentDistributorPricing
+            
+            self._distributor_pricings = {}
+            if self.role == AccountRole.DISTRIBUTOR:
+                agent = self.user.parent
+                if agent and agent.role == AccountRole.AGENT:
+                    self._distributor_pricings = {
+                        pricing.variant_id: pricing
+                        for pricing in AgentDistributorPricing.objects.filter(agent=agent)
+                    }
+        return self._distributor_pricings
+    
+    def get_price(self, variant):
+        """
+        根據用戶角色獲取變體的價格（與 get_variant_price_for_user 結果相同）
+        
+        Args:
+            variant: Variant 實例
+            
+        Returns:
+            tuple: (顯示價格, 原價, 是否有特價)
+        """
+        if self.role == AccountRole.HEADQUARTER:
+            return get_headquarter_price(variant)
+        
+        elif self.role == AccountRole.AGENT:
+            return get_agent_price(variant)
+        
+        elif self.role == AccountRole.DISTRIBUTOR:
+            return get_distributor_pricing_price(self.distributor_pricings.get(variant.id))
+        
+        elif self.role == AccountRole.PEER:
+            return get_peer_price(variant)
+        
+        else:
+            # 未登入、一般用戶或未知角色：使用一般價格
+            return get_user_price(variant)
+    
+    def get_display_price(self, variant):
+        """
+        獲取目錄頁顯示價格（與 accounts.utils.get_variant_display_price 結果相同）
+        
+        Args:
+            variant: Variant 實例
+            
+        Returns:
+            tuple: (顯示價格, 原價)
+        """
+        return get_variant_display_price(variant, self.user)
+    
+    def get_min_display_price(self, variants):
+        """
+        獲取多個變體中最低的目錄頁顯示價格
+        
+        Args:
+            variants: Variant 可迭代物件
+            
+        Returns:
+            Decimal 或 None（沒有任何有效價格時）
+        """
+        prices = [
+            display_price
+            for display_price, _ in (self.get_display_price(variant) for variant in variants)
+            if display_price
+        ]
+        return min(prices) if prices else None
+
+
 def get_variant_price_for_target_user(variant, target_user):
     """
     獲取「為特定用戶訂購」時應該使用的價格
@@ -355,4 +466,32 @@ def validate_price_hierarchy(variant):
     return {
         'is_valid': len(errors) == 0,
         'errors': errors
-    }
\ No newline at end of file
+    }
+
+
+def parse_days(days_str):
+    """
+    解析方案天數字串，取第一個數字作為排序值
+
+    例如 '1-3 天' → 1、'30 天' → 30，無法解析時為 999（排在最後）
+    """
+    match = re.match(r'\s*(\d+)', days_str or '')
+    return int(match.group(1)) if match else 999
+
+
+def parse_data_amount(data_str):
+    """
+    解析方案規格字串為 GB 數值
+
+    例如 '5G' → 5、'500MB' → 0.48828125，無限流量為 999999，無法解析時為 0
+    """
+    data_str = (data_str or '').upper().strip()
+    if 'UNLIMITED' in data_str or '無限' in data_str:
+        return 999999
+    match = re.search(r'(\d+)', data_str)
+    if match:
+        num = int(match.group(1))
+        if 'MB' in data_str:
+            return num / 1024
+        return num
+    return 0
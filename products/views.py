@@ -6,7 +6,7 @@ from django.views.generic.list import ListView
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.db.models import Q, Prefetch, Count, Min, Sum
-from products.models import Supplier, Product, Variant, Category, Stock, AgentDistributorPricing
+from products.models import Supplier, Product, Variant, Category, Stock, AgentDistributorPricing, VariantStockLevel
 from products.constant import ProductStatus, VariantStatus, ProductType
 from django.db import transaction
 from products.forms import StockCreateForm, StockUpdateForm, AgentDistributorPricingForm
@@ -14,12 +14,13 @@ from accounts.utils import (
     is_headquarter_admin, 
     is_agent, 
     is_distributor,
-    get_variant_display_price,
     get_user_price_field,
     is_distributor,
     is_peer,
 )
-from products.utils import get_variant_price_for_user
+from products.utils import PriceBook, parse_days, parse_data_amount
+from products.catalogue import CatalogueSnapshot
+from products.services import QRStockIngestor, QRIngestResult
 
 # 產品目錄列表 Catalogue List
 class CatalogueView(ListView):
@@ -30,73 +31,40 @@ class CatalogueView(ListView):
     
     def get_queryset(self):
         """
-        獲取產品列表，根據以下條件：
+        獲取產品列表（從產品目錄快照篩選，不查詢資料庫），根據以下條件：
         1. 產品狀態必須是 ACTIVE 上架
         2. 至少有一個變體狀態是 ACTIVE 上架
         3. 按照 sort_order 由小到大排序
         4. 支援分類篩選
         5. 支援產品類型篩選
+        6. 支援關鍵字搜尋與方案天數、規格篩選（使用產品目錄搜尋索引）
         """
-        # 基礎查詢：只顯示上架的產品
-        queryset = Product.objects.filter(
-            status=ProductStatus.ACTIVE
-        ).select_related('category').prefetch_related(
-            Prefetch(
-                'variants',
-                queryset=Variant.objects.filter(
-                    status=VariantStatus.ACTIVE
-                ).order_by('sort_order')
-            )
-        )
+        self.snapshot = CatalogueSnapshot.get()
         
-        # 只顯示至少有一個上架變體的產品
-        queryset = queryset.annotate(
-            active_variants_count=Count(
-                'variants',
-                filter=Q(variants__status=VariantStatus.ACTIVE)
-            )
-        ).filter(active_variants_count__gt=0)
-        
-        # 分類篩選
-        category_id = self.request.GET.get('category')
-        if category_id:
-            try:
-                queryset = queryset.filter(category_id=int(category_id))
-            except (ValueError, TypeError):
-                pass
-        
-        # 產品類型篩選
         product_type = self.request.GET.get('type')
-        if product_type and product_type in dict(ProductType.choices):
-            queryset = queryset.filter(
-                variants__product_type=product_type,
-                variants__status=VariantStatus.ACTIVE
-            ).distinct()
-        
-        # 搜尋功能
-        search_query = self.request.GET.get('q')
-        if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(variants__name__icontains=search_query) |
-                Q(variants__description__icontains=search_query)
-            ).distinct()
+        if product_type not in dict(ProductType.choices):
+            product_type = None
         
-        # 排序：按照 sort_order 由小到大
-        queryset = queryset.order_by('sort_order', 'id')
+        products = self.snapshot.filter(
+            category_id=self.request.GET.get('category'),
+            product_type=product_type,
+            search_query=self.request.GET.get('q')
+        )
         
-        return queryset
+        # 方案天數與規格篩選（選項依目前的搜尋結果統計）
+        self.facets = CatalogueSnapshot.facets(products)
+        return self.snapshot.filter(
+            days=self.request.GET.get('days'),
+            data_amount=self.request.GET.get('data'),
+            products=products
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
         
         # 傳遞分類列表
-        context['categories'] = Category.objects.filter(
-            products__status=ProductStatus.ACTIVE,
-            products__variants__status=VariantStatus.ACTIVE
-        ).distinct().order_by('sort_order')
+        context['categories'] = self.snapshot.categories
         
         # 傳遞產品類型選項
         context['product_types'] = ProductType.choices
@@ -105,26 +73,18 @@ class CatalogueView(ListView):
         context['selected_category'] = self.request.GET.get('category', '')
         context['selected_type'] = self.request.GET.get('type', '')
         context['search_query'] = self.request.GET.get('q', '')
+        context['selected_days'] = self.request.GET.get('days', '')
+        context['selected_data'] = self.request.GET.get('data', '')
+        context['days_facets'] = self.facets['days']
+        context['data_amount_facets'] = self.facets['data_amount']
         
         # 統計資料
-        context['total_products'] = self.get_queryset().count()
+        context['total_products'] = len(self.object_list)
         
-        # ✅ 為每個產品添加最低價格（使用統一函數）
+        # ✅ 為每個產品添加最低價格（使用預載的上架變體與價格簿）
+        price_book = PriceBook(user)
         for product in context['products']:
-            active_variants = product.variants.filter(status=VariantStatus.ACTIVE)
-            if active_variants.exists():
-                prices = []
-                for variant in active_variants:
-                    display_price, _ = get_variant_display_price(variant, user)
-                    if display_price:
-                        prices.append(display_price)
-                
-                if prices:
-                    product.min_price = min(prices)
-                else:
-                    product.min_price = None
-            else:
-                product.min_price = None
+            product.min_price = price_book.get_min_display_price(product.variants.all())
         
         return context
 
@@ -159,10 +119,9 @@ class CatalogueDetailView(DetailView):
         context['is_agent'] = is_agent(user)
         context['is_distributor'] = is_distributor(user)
         
-        # 獲取所有上架的變體
-        variants = self.object.variants.filter(
-            status=VariantStatus.ACTIVE
-        ).order_by('sort_order')
+        # 獲取所有上架的變體（已在 get_queryset 預載並排序）
+        variants = self.object.variants.all()
+        price_book = PriceBook(user)
         
         context['variants'] = variants
         
@@ -171,20 +130,20 @@ class CatalogueDetailView(DetailView):
         for variant in variants:
             if variant.days:
                 days_set.add(variant.days)
-        context['days_options'] = sorted(list(days_set), key=lambda x: self._parse_days(x))
+        context['days_options'] = sorted(list(days_set), key=parse_days)
         
         # 提取所有唯一的流量規格選項
         data_amount_set = set()
         for variant in variants:
             if variant.data_amount:
                 data_amount_set.add(variant.data_amount)
-        context['data_amount_options'] = sorted(list(data_amount_set), key=lambda x: self._parse_data_amount(x))
+        context['data_amount_options'] = sorted(list(data_amount_set), key=parse_data_amount)
         
         # ✅ 使用統一的價格獲取函數
         # 建立變體映射表
         variant_map = {}
         for variant in variants:
-            display_price, original_price = get_variant_display_price(variant, user)
+            display_price, original_price = price_book.get_display_price(variant)
             
             key = f"{variant.days}|{variant.data_amount}"
             variant_map[key] = {
@@ -214,6 +173,13 @@ class CatalogueDetailView(DetailView):
             status=ProductStatus.ACTIVE
         ).exclude(
             id=self.object.id
+        ).prefetch_related(
+            Prefetch(
+                'variants',
+                queryset=Variant.objects.filter(
+                    status=VariantStatus.ACTIVE
+                ).order_by('sort_order')
+            )
         ).annotate(
             active_variants_count=Count(
                 'variants',
@@ -223,44 +189,11 @@ class CatalogueDetailView(DetailView):
             active_variants_count__gt=0
         ).order_by('sort_order')[:6]
         
-        # ✅ 為相關產品計算最低價格（使用統一函數）
+        # ✅ 為相關產品計算最低價格（使用預載的上架變體與價格簿）
         for related in context['related_products']:
-            related_variants = related.variants.filter(status=VariantStatus.ACTIVE)
-            if related_variants.exists():
-                prices = []
-                for rv in related_variants:
-                    display_price, _ = get_variant_display_price(rv, user)
-                    if display_price:
-                        prices.append(display_price)
-                related.min_price = min(prices) if prices else None
-            else:
-                related.min_price = None
+            related.min_price = price_book.get_min_display_price(related.variants.all())
         
         return context
-    
-    def _parse_days(self, days_str):
-        """解析天數字串"""
-        try:
-            return int(days_str.split('-')[0].strip())
-        except:
-            return 999
-    
-    def _parse_data_amount(self, data_str):
-        """解析流量字串"""
-        data_str = data_str.upper().strip()
-        if 'UNLIMITED' in data_str or '無限' in data_str:
-            return 999999
-        try:
-            import re
-            match = re.search(r'(\d+)', data_str)
-            if match:
-                num = int(match.group(1))
-                if 'MB' in data_str:
-                    return num / 1024
-                return num
-        except:
-            pass
-        return 0
 
 
 # 產品目錄列表給批發商看 Catalogue List for Agents
@@ -288,109 +221,38 @@ class CatalogueViewForAgents(LoginRequiredMixin, ListView):
     def get_queryset(self):
         user = self.request.user
         
-        # ✅ 根據角色決定允許的產品類型
-        if is_headquarter_admin(user):
-            allowed_types = None  # 總公司可以看所有類型
-        else:
-            allowed_types = [
-                ProductType.ESIM,
-                ProductType.ESIMIMG,
-                ProductType.RECHARGEABLE
-            ]
-        
-        # 基礎查詢（只包含上架的產品和變體）
-        if allowed_types:
-            # ✅ 非總公司：只預載符合類型的變體
-            queryset = Product.objects.filter(
-                status=ProductStatus.ACTIVE
-            ).select_related('category').prefetch_related(
-                Prefetch(
-                    'variants',
-                    queryset=Variant.objects.filter(
-                        status=VariantStatus.ACTIVE,
-                        product_type__in=allowed_types  # ✅ 關鍵：在這裡就過濾
-                    ).order_by('sort_order')
-                )
-            )
-        else:
-            # ✅ 總公司：預載所有上架變體
-            queryset = Product.objects.filter(
-                status=ProductStatus.ACTIVE
-            ).select_related('category').prefetch_related(
-                Prefetch(
-                    'variants',
-                    queryset=Variant.objects.filter(
-                        status=VariantStatus.ACTIVE
-                    ).order_by('sort_order')
-                )
-            )
-        
-        # 根據用戶角色過濾產品（確保產品至少有一個符合條件的變體）
-        if allowed_types:
-            queryset = queryset.filter(
-                variants__product_type__in=allowed_types,
-                variants__status=VariantStatus.ACTIVE
-            ).distinct()
-        
-        # 統計有效變體數量（考慮角色限制）
-        if allowed_types:
-            queryset = queryset.annotate(
-                active_variants_count=Count(
-                    'variants',
-                    filter=Q(
-                        variants__status=VariantStatus.ACTIVE,
-                        variants__product_type__in=allowed_types
-                    )
-                )
-            ).filter(active_variants_count__gt=0)
-        else:
-            queryset = queryset.annotate(
-                active_variants_count=Count(
-                    'variants',
-                    filter=Q(variants__status=VariantStatus.ACTIVE)
-                )
-            ).filter(active_variants_count__gt=0)
+        # ✅ 根據角色決定允許的產品類型（總公司可以看所有類型）
+        allowed_types = CatalogueSnapshot.allowed_types_for(user)
         
-        # 分類篩選
-        category_id = self.request.GET.get('category')
-        if category_id:
-            try:
-                queryset = queryset.filter(category_id=int(category_id))
-            except (ValueError, TypeError):
-                pass
+        # 從產品目錄快照篩選（快照只包含上架產品與符合類型的上架變體）
+        self.snapshot = CatalogueSnapshot.get(allowed_types)
         
-        # 產品類型篩選
+        # 產品類型篩選（非總公司用戶嘗試查看不允許的類型時忽略此篩選）
         product_type = self.request.GET.get('type')
-        if product_type and product_type in dict(ProductType.choices):
-            # 檢查用戶是否有權限查看該類型
-            if allowed_types and product_type not in allowed_types:
-                # 非總公司用戶嘗試查看不允許的類型，忽略此篩選
-                pass
-            else:
-                queryset = queryset.filter(
-                    variants__product_type=product_type,
-                    variants__status=VariantStatus.ACTIVE
-                ).distinct()
-        
-        # 搜尋功能
-        search_query = self.request.GET.get('q')
-        if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(variants__name__icontains=search_query) |
-                Q(variants__product_code__icontains=search_query)
-            ).distinct()
+        if product_type not in dict(ProductType.choices):
+            product_type = None
+        elif allowed_types and product_type not in allowed_types:
+            product_type = None
+        
+        products = self.snapshot.filter(
+            category_id=self.request.GET.get('category'),
+            product_type=product_type,
+            search_query=self.request.GET.get('q')
+        )
         
-        return queryset.order_by('sort_order', 'id')
+        # 方案天數與規格篩選（選項依目前的搜尋結果統計）
+        self.facets = CatalogueSnapshot.facets(products)
+        return self.snapshot.filter(
+            days=self.request.GET.get('days'),
+            data_amount=self.request.GET.get('data'),
+            products=products
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
         
         import logging
-        import json
-        from urllib.parse import unquote
         logger = logging.getLogger(__name__)
         
         # 傳遞角色判斷
@@ -400,32 +262,10 @@ class CatalogueViewForAgents(LoginRequiredMixin, ListView):
         context['is_peer'] = is_peer(user)
         context['is_superuser'] = user.is_superuser
         
-        # ✅ 根據角色決定允許的產品類型
-        if is_headquarter_admin(user):
-            allowed_types = None  # 總公司可以看所有類型
-        else:
-            allowed_types = [
-                ProductType.ESIM,
-                ProductType.ESIMIMG,
-                ProductType.RECHARGEABLE
-            ]
-        
-        # 傳遞分類列表（根據角色限制）
-        if allowed_types:
-            # 其他角色：只顯示有 ESIM/ESIMIMG/RECHARGEABLE 產品的分類
-            categories_queryset = Category.objects.filter(
-                products__status=ProductStatus.ACTIVE,
-                products__variants__status=VariantStatus.ACTIVE,
-                products__variants__product_type__in=allowed_types
-            )
-        else:
-            # 總公司：顯示所有分類
-            categories_queryset = Category.objects.filter(
-                products__status=ProductStatus.ACTIVE,
-                products__variants__status=VariantStatus.ACTIVE
-            )
+        allowed_types = self.snapshot.allowed_types
         
-        context['categories'] = categories_queryset.distinct().order_by('sort_order')
+        # 傳遞分類列表（快照已依角色限制）
+        context['categories'] = self.snapshot.categories
         
         # ✅ 根據角色過濾產品類型選項
         if allowed_types:
@@ -443,22 +283,19 @@ class CatalogueViewForAgents(LoginRequiredMixin, ListView):
         context['selected_category'] = self.request.GET.get('category', '')
         context['selected_type'] = self.request.GET.get('type', '')
         context['search_query'] = self.request.GET.get('q', '')
+        context['selected_days'] = self.request.GET.get('days', '')
+        context['selected_data'] = self.request.GET.get('data', '')
+        context['days_facets'] = self.facets['days']
+        context['data_amount_facets'] = self.facets['data_amount']
         
         # 統計資料
-        context['total_products'] = self.get_queryset().count()
+        context['total_products'] = len(self.object_list)
         
-        # 從 cookie 獲取購物車
-        cart = {}
-        cart_cookie = self.request.COOKIES.get('cart', '{}')
-        try:
-            decoded_cookie = unquote(cart_cookie)
-            cart = json.loads(decoded_cookie)
-            logger.info(f'購物車內容：{cart}')
-        except json.JSONDecodeError:
-            cart = {}
-            logger.warning('購物車 JSON 解析失敗')
+        # 獲取購物車（CartMiddleware 已解析）
+        cart = self.request.cart
 
-        # ✅ 使用 products.utils 的統一價格獲取函數
+        # ✅ 使用價格簿統一計算價格（經銷價格只查詢一次）
+        price_book = PriceBook(user)
         for product in context['products']:
             # ✅ 重要：直接使用已經過濾好的 variants（從 Prefetch 中獲取）
             # 這樣可以避免重複查詢，並且保證獲取的是符合角色權限的變體
@@ -468,21 +305,13 @@ class CatalogueViewForAgents(LoginRequiredMixin, ListView):
             
             for variant in active_variants:
                 # ✅ 使用統一價格函數獲取正確的價格
-                display_price, original_price, has_sale = get_variant_price_for_user(variant, user)
+                display_price, original_price, has_sale = price_book.get_price(variant)
                 variant.display_price = display_price
                 variant.display_original_price = original_price
                 variant.has_sale = has_sale
                 
-                # 計算庫存數量（只統計未使用的庫存）
-                stock_total = Stock.objects.filter(
-                    product=variant,
-                    is_used=False
-                ).aggregate(
-                    total=Sum('quantity')
-                )['total'] or 0
-                
-                variant.stock_quantity = stock_total
-                variant.has_stock = stock_total > 0
+                # 庫存數量（快照中的可用庫存）
+                stock_total = variant.stock_quantity
                 
                 logger.info(
                     f'變體 {variant.id} ({variant.name}) [{user.role}] - '
@@ -494,14 +323,13 @@ class CatalogueViewForAgents(LoginRequiredMixin, ListView):
                 )
                 
                 # 添加購物車數量
-                variant_id_str = str(variant.id)
-                if variant_id_str in cart:
-                    variant.cart_quantity = cart[variant_id_str].get('quantity', 0)
+                if variant.id in cart:
+                    variant.cart_quantity = cart[variant.id].get('quantity', 0)
                     logger.info(f'變體 {variant.id} 在購物車中，數量：{variant.cart_quantity}')
                 else:
                     variant.cart_quantity = 0
         
-        context['cart'] = cart
+        context['cart'] = cart.data
         return context
 
 
@@ -631,8 +459,8 @@ class StockCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         return is_headquarter_admin(self.request.user)
 
     def form_valid(self, form):
-        import os
         import logging
+        import zipfile
         
         logger = logging.getLogger(__name__)
         
@@ -643,98 +471,65 @@ class StockCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         
         # 獲取額外欄位資料
         qr_images = self.request.FILES.getlist('qr_images')
+        qr_zip = self.request.FILES.get('qr_zip')
         
-        created_count = 0
-        failed_count = 0
-        failed_files = []
+        # 情況 A: ESIMIMG (圖庫) - 依圖片數量建立多筆（分批寫入，不使用單一長交易）
+        if product_type == ProductType.ESIMIMG and (qr_images or qr_zip):
+            try:
+                ingestor = QRStockIngestor(
+                    variant,
+                    name=stock.name,
+                    description=stock.description,
+                    expire_date=stock.expire_date
+                )
+            except ValueError as e:
+                messages.error(self.request, f'❌ {str(e)}')
+                return self.form_invalid(form)
+            
+            logger.info(f'開始批量建立 ESIMIMG 庫存，目標 SKU 資料夾：{variant.sku}')
+            
+            try:
+                result = QRIngestResult()
+                if qr_zip:
+                    zip_result = ingestor.ingest_zip(qr_zip)
+                    result.created += zip_result.created
+                    result.failures += zip_result.failures
+                if qr_images:
+                    upload_result = ingestor.ingest_uploads(qr_images)
+                    result.created += upload_result.created
+                    result.failures += upload_result.failures
+            except zipfile.BadZipFile:
+                messages.error(self.request, '❌ ZIP 檔案格式錯誤，無法讀取')
+                return self.form_invalid(form)
+            
+            # 顯示結果訊息
+            if result.created > 0:
+                messages.success(self.request, f'✅ 已成功建立 {result.created} 筆 ESIMIMG 庫存')
+                if result.failures:
+                    messages.warning(self.request, result.summary())
+            else:
+                messages.error(self.request, f'❌ 所有圖片上傳失敗：{result.summary()}')
+                return self.form_invalid(form)
+            
+            return redirect(self.success_url)
         
         try:
             with transaction.atomic():
-                # 情況 A: ESIMIMG (圖庫) - 依圖片數量建立多筆
-                if product_type == ProductType.ESIMIMG and qr_images:
-                    # ✅ 檢查 variant 是否有 SKU
-                    if not variant.sku:
-                        messages.error(
-                            self.request, 
-                            f'❌ 該產品變體未設定 SKU，無法上傳 ESIMIMG 圖片。請先在產品管理中設定 SKU。'
-                        )
-                        return self.form_invalid(form)
-                    
-                    logger.info(f'開始批量建立 ESIMIMG 庫存，目標 SKU 資料夾：{variant.sku}')
-                    
-                    for img in qr_images:
-                        try:
-                            # 從檔名提取 code（去除副檔名）
-                            filename = img.name
-                            code = os.path.splitext(filename)[0]  # 例如：'10000001.png' → '10000001'
-                            
-                            # ✅ 驗證檔名格式（可選，確保檔名符合預期）
-                            if not code.strip():
-                                logger.warning(f'檔案 {filename} 的檔名無效，跳過')
-                                failed_count += 1
-                                failed_files.append(filename)
-                                continue
-                            
-                            # 建立庫存記錄
-                            # Django 會自動調用 stock_qr_image_path 函數來決定存儲路徑
-                            stock_instance = Stock.objects.create(
-                                product=variant,
-                                name=f"{stock.name} - {code}",  # 使用 code 作為名稱一部分
-                                description=stock.description,
-                                qr_img=img,  # Django 會自動處理文件上傳和路徑
-                                code=code,  # 儲存從檔名提取的 code
-                                initial_quantity=1,
-                                quantity=1,
-                                expire_date=stock.expire_date,
-                                is_used=False
-                            )
-                            created_count += 1
-                            
-                            logger.info(
-                                f'✅ 成功建立庫存：ID={stock_instance.id}, '
-                                f'Code={code}, 圖片路徑={stock_instance.qr_img.name}'
-                            )
-                            
-                        except Exception as e:
-                            logger.error(f'❌ 處理檔案 {img.name} 時發生錯誤：{str(e)}')
-                            failed_count += 1
-                            failed_files.append(img.name)
-                            continue
-                    
-                    # 顯示結果訊息
-                    if created_count > 0:
-                        success_msg = f'✅ 已成功建立 {created_count} 筆 ESIMIMG 庫存'
-                        if failed_count > 0:
-                            success_msg += f'，{failed_count} 筆失敗'
-                        messages.success(self.request, success_msg)
-                        
-                        if failed_files:
-                            messages.warning(
-                                self.request, 
-                                f'失敗的檔案：{", ".join(failed_files[:5])}' + 
-                                (f' 等 {len(failed_files)} 個檔案' if len(failed_files) > 5 else '')
-                            )
-                    else:
-                        messages.error(self.request, '❌ 所有圖片上傳失敗，請檢查檔案格式')
-                        return self.form_invalid(form)
-                    
-                    return redirect(self.success_url)
-
                 # 情況 B: 其他所有類型 - 建立單筆
-                else:
-                    stock.initial_quantity = stock.quantity
-                    stock.save()
-                    
-                    logger.info(
-                        f'✅ 建立標準庫存：ID={stock.id}, '
-                        f'產品={stock.product.name}, 數量={stock.quantity}'
-                    )
-                    
-                    messages.success(
-                        self.request, 
-                        f'✅ 已建立庫存：{stock.name} (數量: {stock.quantity})'
-                    )
-                    return redirect(self.success_url)
+                stock.initial_quantity = stock.quantity
+                stock.save()
+                VariantStockLevel.apply_stock_change(after=stock)
+                
+                logger.info(
+                    f'✅ 建立標準庫存：ID={stock.id}, '
+                    f'產品={stock.product.name}, 數量={stock.quantity}'
+                )
+                
+                messages.success(
+                    self.request, 
+                    f'✅ 已建立庫存：{stock.name} (數量: {stock.quantity})'
+                )
+                return redirect(self.success_url)
 
         except Exception as e:
             logger.error(f'❌ 庫存建立過程發生錯誤：{str(e)}')
@@ -778,7 +573,10 @@ class StockUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return context
     
     def form_valid(self, form):
-        stock = form.save()
+        with transaction.atomic():
+            before = Stock.objects.select_for_update().get(pk=self.object.pk)
+            stock = form.save()
+            VariantStockLevel.apply_stock_change(before=before, after=stock)
         
         messages.success(
             self.request,
@@ -821,25 +619,30 @@ class StockDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         context['is_esimimg'] = stock.product.product_type == ProductType.ESIMIMG
         context['has_qr_image'] = bool(stock.qr_img)
         
-        # 檢查是否有關聯訂單（透過 used_stocks）
-        from business.models import OrderProduct
-        related_orders = OrderProduct.objects.filter(
-            used_stocks__contains=[stock.id]
-        ).select_related('order').distinct()
+        # 檢查是否有關聯訂單（透過庫存分配記錄）
+        from business.models import StockAllocation
+        related_orders_count = StockAllocation.objects.filter(
+            stock_id=stock.id,
+            released_at__isnull=True
+        ).values('order_id').distinct().count()
         
-        context['has_related_orders'] = related_orders.exists()
-        context['related_orders_count'] = related_orders.count()
+        context['has_related_orders'] = related_orders_count > 0
+        context['related_orders_count'] = related_orders_count
         
         return context
     
-    def delete(self, request, *args, **kwargs):
-        stock = self.get_object()
+    def form_valid(self, form):
+        request = self.request
+        stock = self.object
         stock_name = stock.name
         product_name = stock.product.name
         has_image = bool(stock.qr_img)
         
-        # 執行刪除
-        response = super().delete(request, *args, **kwargs)
+        # 執行刪除並更新庫存彙總
+        with transaction.atomic():
+            stock.delete()
+            VariantStockLevel.apply_stock_change(before=stock)
+        response = redirect(self.get_success_url())
         
         # 成功訊息
         msg = f'✅ 已刪除庫存：{stock_name} ({product_name})'
@@ -1280,20 +1083,16 @@ class ProductDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         return redirect('products:catalogue_list')
     
     def get_context_data(self, **kwargs):
-        from django.db.models import Sum
-        
         context = super().get_context_data(**kwargs)
         
         # 獲取所有變體（包含上架/下架）
         variants = self.object.variants.all().order_by('sort_order')
         context['variants'] = variants
         
-        # 為每個變體計算庫存
+        # 為每個變體取得庫存
+        stock_levels = VariantStockLevel.get_available(variant.id for variant in variants)
         for variant in variants:
-            variant.total_stock = Stock.objects.filter(
-                product=variant,
-                is_used=False
-            ).aggregate(total=Sum('quantity'))['total'] or 0
+            variant.total_stock = stock_levels[variant.id]
         
         # 統計資料
         context['total_variants'] = variants.count()
@@ -1525,8 +1324,6 @@ class VariantListView(LoginRequiredMixin, ListView):
         """
         添加額外的 context 資料
         """
-        from django.db.models import Sum
-        
         context = super().get_context_data(**kwargs)
         user = self.request.user
         
@@ -1543,12 +1340,12 @@ class VariantListView(LoginRequiredMixin, ListView):
             allowed_statuses = [VariantStatus.ACTIVE]  # ✅ 其他角色只能看 ACTIVE
         
         # 為每個變體計算庫存和添加價格資訊
+        stock_levels = VariantStockLevel.get_available(
+            variant.id for variant in context['variants']
+        )
         for variant in context['variants']:
-            # 計算庫存
-            variant.total_stock = Stock.objects.filter(
-                product=variant,
-                is_used=False
-            ).aggregate(total=Sum('quantity'))['total'] or 0
+            # 庫存
+            variant.total_stock = stock_levels[variant.id]
             
             # 如果是代理商，獲取其設定的經銷價格
             if is_agent(user):
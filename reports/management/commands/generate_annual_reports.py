@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
+from django.db import transaction
 from reports.models import AnnualSalesReport, AnnualSalesSummary
 import logging
 
@@ -28,6 +29,12 @@ class Command(BaseCommand):
             action='store_true',
             help='強制重新生成已結算的報表'
         )
+        
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='批次模式：一次讀取所有年份的月報表並批次寫入'
+        )
     
     def handle(self, *args, **options):
         now = timezone.now()
@@ -41,6 +48,21 @@ class Command(BaseCommand):
         self.stdout.write(f"起始年份：{year}")
         self.stdout.write(f"生成年數：{years_count}年")
         
+        if options['bulk']:
+            years = sorted(year - i for i in range(years_count))
+            
+            with transaction.atomic():
+                count = AnnualSalesReport.bulk_generate(years)
+                for current_year in years:
+                    AnnualSalesSummary.generate_summary(current_year)
+            
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"\n🎉 年報表批次生成完成！{len(years)} 個年份，共 {count} 筆用戶報表"
+                )
+            )
+            return
+        
         total_reports = 0
         
         for i in range(years_count):
@@ -16,6 +16,7 @@ class Command(BaseCommand):
         parser.add_argument('--days', type=int, default=1, help='生成過去N天的報表')
         parser.add_argument('--force', action='store_true', help='強制重新生成')
         parser.add_argument('--skip-cascade', action='store_true', help='跳過級聯更新（月報表/年報表）')
+        parser.add_argument('--bulk', action='store_true', help='批次模式：一次分組計算整個日期範圍並批次寫入')
     
     def handle(self, *args, **options):
         if options['date']:
@@ -34,6 +35,10 @@ class Command(BaseCommand):
         self.stdout.write(f"結束日期：{end_date}")
         self.stdout.write(f"生成天數：{days}天")
         
+        if options['bulk']:
+            self.handle_bulk(end_date, days, skip_cascade)
+            return
+        
         total_reports = 0
         
         # 【優化】使用事務批量處理
@@ -99,4 +104,39 @@ class Command(BaseCommand):
             self.style.SUCCESS(
                 f"\n🎉 報表生成完成！共生成 {total_reports} 筆用戶報表"
             )
-        )
\ No newline at end of file
+        )
+    
+    def handle_bulk(self, end_date, days, skip_cascade):
+        """
+        批次模式：整個日期範圍一次計算，月報表與年報表由日報表批次推導
+        """
+        from reports.models import MonthlySalesReport, MonthlySalesSummary, AnnualSalesReport, AnnualSalesSummary
+        
+        start_date = end_date - timedelta(days=days - 1)
+        
+        with transaction.atomic():
+            # 1. 日報表與每日營業總結
+            count = DailySalesReport.bulk_generate(start_date, end_date)
+            DailySalesSummary.bulk_generate(start_date, end_date)
+            self.stdout.write(
+                self.style.SUCCESS(f"✅ {start_date} ~ {end_date}: 生成 {count} 筆用戶報表")
+            )
+            
+            if skip_cascade:
+                return
+            
+            # 2. 月報表與月度營業總結
+            date_range = [end_date - timedelta(days=i) for i in range(days)]
+            year_months = sorted(set((d.year, d.month) for d in date_range))
+            years = sorted(set(d.year for d in date_range))
+            
+            count = MonthlySalesReport.bulk_generate(year_months)
+            for year, month in year_months:
+                MonthlySalesSummary.generate_summary(year, month)
+            self.stdout.write(self.style.SUCCESS(f"✅ 更新 {len(year_months)} 個月份，共 {count} 筆月報表"))
+            
+            # 3. 年報表與年度營業總結
+            count = AnnualSalesReport.bulk_generate(years)
+            for year in years:
+                AnnualSalesSummary.generate_summary(year)
+            self.stdout.write(self.style.SUCCESS(f"✅ 更新 {len(years)} 個年份，共 {count} 筆年報表"))
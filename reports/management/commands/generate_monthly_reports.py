@@ -1,7 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import datetime
-from reports.models import MonthlySalesReport, MonthlySalesSummary
+from django.db import transaction
+from reports.models import MonthlySalesReport, MonthlySalesSummary, AnnualSalesReport, AnnualSalesSummary
 import logging
 
 logger = logging.getLogger(__name__)
@@ -35,6 +36,12 @@ class Command(BaseCommand):
             action='store_true',
             help='強制重新生成已結算的報表'
         )
+        
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='批次模式：一次讀取所有月份的日報表並批次寫入（含年報表）'
+        )
     
     def handle(self, *args, **options):
         now = timezone.now()
@@ -49,6 +56,10 @@ class Command(BaseCommand):
         self.stdout.write(f"起始月份：{year}-{month:02d}")
         self.stdout.write(f"生成月數：{months_count}個月")
         
+        if options['bulk']:
+            self.handle_bulk(year, month, months_count)
+            return
+        
         total_reports = 0
         
         for i in range(months_count):
@@ -95,4 +106,34 @@ class Command(BaseCommand):
             self.style.SUCCESS(
                 f"\n🎉 月報表生成完成！共生成 {total_reports} 筆用戶報表"
             )
-        )
\ No newline at end of file
+        )
+    
+    def handle_bulk(self, year, month, months_count):
+        """
+        批次模式：所有月份一次計算，並同步重建涉及的年報表
+        """
+        year_months = []
+        for i in range(months_count):
+            current_month = month - i
+            current_year = year
+            while current_month < 1:
+                current_month += 12
+                current_year -= 1
+            year_months.append((current_year, current_month))
+        year_months.sort()
+        years = sorted(set(y for y, _ in year_months))
+        
+        with transaction.atomic():
+            count = MonthlySalesReport.bulk_generate(year_months)
+            for current_year, current_month in year_months:
+                MonthlySalesSummary.generate_summary(current_year, current_month)
+            
+            AnnualSalesReport.bulk_generate(years)
+            for current_year in years:
+                AnnualSalesSummary.generate_summary(current_year)
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"\n🎉 月報表批次生成完成！{len(year_months)} 個月份，共 {count} 筆用戶報表"
+            )
+        )
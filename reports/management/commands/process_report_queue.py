@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+from reports.models import ReportDirtyPeriod
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '處理報表待更新佇列（重算月報表、年報表與營業總結）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='每批讀取的佇列筆數，預設為1000'
+        )
+        
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='持續執行（適合以 supervisor 常駐）'
+        )
+        
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=10,
+            help='佇列清空後等待秒數（搭配 --loop），預設為10秒'
+        )
+    
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+        
+        while True:
+            # 處理到佇列清空（月報表重算後加入的年度項目也在此一併處理）
+            total = {'items': 0, 'monthly': 0, 'annual': 0, 'failed': 0}
+            while True:
+                result = ReportDirtyPeriod.process_batch(batch_size=batch_size)
+                if not result['items']:
+                    break
+                for key in total:
+                    total[key] += result[key]
+            
+            if total['items']:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"✅ 處理 {total['items']} 筆佇列，"
+                        f"重算月報表 {total['monthly']} 筆、年報表 {total['annual']} 筆"
+                    )
+                )
+            
+            if total['failed']:
+                self.stdout.write(
+                    self.style.WARNING(f"⚠️ {total['failed']} 筆佇列重算失敗，已保留待稍後重試")
+                )
+            
+            if not options['loop']:
+                break
+            
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                break
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def populate_report_entries(apps, schema_editor):
+    """從現有已付款訂單建立日報表貢獻記錄"""
+    Order = apps.get_model('business', 'Order')
+    DailySalesReportEntry = apps.get_model('reports', 'DailySalesReportEntry')
+
+    orders = Order.objects.filter(status='PAID').prefetch_related('order_products__variant')
+
+    entries = []
+    for order in orders.iterator(chunk_size=500):
+        amount = 0
+        products_sold = 0
+        product_breakdown = {}
+        for order_product in order.order_products.all():
+            line_amount = order_product.unit_price * order_product.quantity
+            amount += line_amount
+            products_sold += order_product.quantity
+            if order_product.variant is not None:
+                bucket = product_breakdown.setdefault(
+                    order_product.variant.product_type, {'quantity': 0, 'revenue': 0}
+                )
+                bucket['quantity'] += order_product.quantity
+                bucket['revenue'] += float(line_amount)
+
+        entries.append(DailySalesReportEntry(
+            order_id=order.pk,
+            user_id=order.account_id,
+            report_date=timezone.localdate(order.created_at),
+            revenue=amount + (order.shipping_fee or 0),
+            products_sold=products_sold,
+            order_source=order.order_source or 'OTHER',
+            product_breakdown=product_breakdown,
+        ))
+    DailySalesReportEntry.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reports', '0001_initial'),
+        ('business', '0017_alter_order_order_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesReportEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.CharField(max_length=255, unique=True, verbose_name='訂單編號')),
+                ('report_date', models.DateField(verbose_name='報表日期')),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='訂單收入（含運費）')),
+                ('products_sold', models.IntegerField(default=0, verbose_name='銷售產品數量')),
+                ('order_source', models.CharField(default='OTHER', max_length=50, verbose_name='訂單來源')),
+                ('product_breakdown', models.JSONField(blank=True, default=dict, help_text="格式：{'esim': {'quantity': 10, 'revenue': 5000}, ...}", verbose_name='產品類型明細')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新時間')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales_report_entries', to=settings.AUTH_USER_MODEL, verbose_name='用戶')),
+            ],
+            options={
+                'verbose_name': '訂單日報表貢獻記錄',
+                'verbose_name_plural': '訂單日報表貢獻記錄',
+                'indexes': [models.Index(fields=['user', 'report_date'], name='reports_dai_user_id_a7a560_idx')],
+            },
+        ),
+        migrations.RunPython(populate_report_entries, migrations.RunPython.noop),
+    ]
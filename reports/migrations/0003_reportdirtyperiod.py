@@ -0,0 +1,31 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reports', '0002_dailysalesreportentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportDirtyPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('DAY', '日報表'), ('MONTH', '月報表')], default='DAY', max_length=10, verbose_name='期間類型')),
+                ('report_date', models.DateField(verbose_name='報表日期')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_dirty_periods', to=settings.AUTH_USER_MODEL, verbose_name='用戶')),
+            ],
+            options={
+                'verbose_name': '報表待更新期間',
+                'verbose_name_plural': '報表待更新期間',
+                'ordering': ['id'],
+            },
+        ),
+    ]
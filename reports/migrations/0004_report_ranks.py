@@ -0,0 +1,68 @@
+# Generated by Django 4.2.24 on 2026-10-16 19:46
+
+from django.db import migrations, models
+
+
+def backfill_ranks(apps, schema_editor):
+    """以視窗函數一次計算既有報表的排名"""
+    from reports.models import refresh_report_ranks
+
+    refresh_report_ranks(apps.get_model('reports', 'DailySalesReport').objects.all(), ['report_date'])
+    refresh_report_ranks(apps.get_model('reports', 'MonthlySalesReport').objects.all(), ['report_year', 'report_month'])
+    refresh_report_ranks(apps.get_model('reports', 'AnnualSalesReport').objects.all(), ['report_year'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0003_reportdirtyperiod'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annualsalesreport',
+            name='revenue_rank',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='整體排名'),
+        ),
+        migrations.AddField(
+            model_name='annualsalesreport',
+            name='role_rank',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='角色排名'),
+        ),
+        migrations.AddField(
+            model_name='annualsalesreport',
+            name='role_total',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='同角色報表數'),
+        ),
+        migrations.AddField(
+            model_name='dailysalesreport',
+            name='revenue_rank',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='整體排名'),
+        ),
+        migrations.AddField(
+            model_name='dailysalesreport',
+            name='role_rank',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='角色排名'),
+        ),
+        migrations.AddField(
+            model_name='dailysalesreport',
+            name='role_total',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='同角色報表數'),
+        ),
+        migrations.AddField(
+            model_name='monthlysalesreport',
+            name='revenue_rank',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='整體排名'),
+        ),
+        migrations.AddField(
+            model_name='monthlysalesreport',
+            name='role_rank',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='角色排名'),
+        ),
+        migrations.AddField(
+            model_name='monthlysalesreport',
+            name='role_total',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='同角色報表數'),
+        ),
+        migrations.RunPython(backfill_ranks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.24 on 2026-10-16 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0004_report_ranks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportdirtyperiod',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='失敗次數'),
+        ),
+        migrations.AddField(
+            model_name='reportdirtyperiod',
+            name='last_error',
+            field=models.TextField(blank=True, default='', verbose_name='最後錯誤訊息'),
+        ),
+        migrations.AddField(
+            model_name='reportdirtyperiod',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='下次重試時間'),
+        ),
+    ]
@@ -1,15 +1,215 @@
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum, Count, Q, Window
+from django.db.models.functions import Cast, Rank
 from accounts.models import CustomUser
 from accounts.constant import AccountRole
-from business.models import Order
+from business.models import Order, OrderProduct
 from business.constant import OrderStatus
+from collections import defaultdict
+from datetime import date, timedelta
+import calendar
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def merge_breakdown(breakdown, delta, sign=1):
+    """
+    合併明細 JSON（如 product_breakdown、order_source_breakdown）
+    
+    Args:
+        breakdown: 原明細，格式：{'esim': {'quantity': 10, 'revenue': 5000}, ...}
+        delta: 要合併的明細，格式同上
+        sign: 1 為加上，-1 為扣除
+        
+    Returns:
+        dict: 合併後的新明細，數值全部歸零的項目會被移除
+    """
+    merged = {key: dict(values) for key, values in (breakdown or {}).items()}
+    for key, values in delta.items():
+        bucket = merged.setdefault(key, {})
+        for field, value in values.items():
+            bucket[field] = bucket.get(field, 0) + sign * value
+        if not any(bucket.values()):
+            del merged[key]
+    return merged
+
+
+def growth_rate(current, previous):
+    """
+    計算增長率(%)
+    
+    Args:
+        current: 本期數值
+        previous: 比較期數值，None 或不大於 0 時無法計算
+        
+    Returns:
+        增長率，無法計算時為 None
+    """
+    if not previous or previous <= 0:
+        return None
+    return (current - previous) / previous * 100
+
+
+def refresh_report_ranks(queryset, period_fields):
+    """
+    以視窗函數一次計算報表排名，寫回 revenue_rank、role_rank、role_total
+    
+    排名規則與 get_rank 相同：同一期間內收入較高的報表數 + 1（同收入同名次）。
+    只寫回排名有變動的報表，不觸發報表 signal。
+    
+    Args:
+        queryset: 要重算的報表，必須包含所屬期間的所有報表
+        period_fields: 期間欄位，例如 ['report_date']、['report_year', 'report_month']
+        
+    Returns:
+        int: 排名有變動的報表數量
+    """
+    model = queryset.model
+    partition = [F(field) for field in period_fields]
+    role_partition = partition + [F('user__role')]
+    # total_revenue 沒有小數位，轉為整數排序（SQLite 無法在視窗排序中使用 DecimalField）
+    revenue_order = Cast('total_revenue', models.BigIntegerField()).desc()
+    
+    # 1. 一次查詢計算整體排名、角色排名與同角色報表數
+    rows = queryset.order_by().annotate(
+        new_rank=Window(Rank(), partition_by=partition, order_by=revenue_order),
+        new_role_rank=Window(Rank(), partition_by=role_partition, order_by=revenue_order),
+        new_role_total=Window(Count('id'), partition_by=role_partition),
+    ).values_list(
+        'id', 'revenue_rank', 'role_rank', 'role_total',
+        'new_rank', 'new_role_rank', 'new_role_total'
+    )
+    
+    # 2. 只寫回有變動的報表
+    changed = [
+        model(id=report_id, revenue_rank=new_rank, role_rank=new_role_rank, role_total=new_role_total)
+        for report_id, rank, role_rank, role_total, new_rank, new_role_rank, new_role_total in rows
+        if (rank, role_rank, role_total) != (new_rank, new_role_rank, new_role_total)
+    ]
+    model.objects.bulk_update(changed, ['revenue_rank', 'role_rank', 'role_total'], batch_size=500)
+    return len(changed)
+
+
+# 時間序列
+class TimeSeries:
+    """
+    補齊空缺期間的報表時間序列（整個範圍只查詢一次）
+    
+    以 days / months / years 建立，依期間由舊到新排列；沒有資料的期間值為 None，
+    可用 values(field, default) 取得補零後的數列。期間鍵：
+    - days：date
+    - months：(年, 月)
+    - years：年
+    
+    aggregate=True 時同一期間的多筆報表會加總（例如所有用戶的日報表），
+    否則每個期間應只有一筆（例如單一用戶的報表或營業總結）。
+    """
+    # 儀表板可選的趨勢長度
+    DAY_LENGTHS = (7, 30, 90, 365)
+    MONTH_LENGTHS = (12, 24, 36)
+    
+    def __init__(self, queryset, periods, key_fields, fields, aggregate=False):
+        self.periods = periods
+        self.fields = list(fields)
+        
+        rows = queryset.order_by().values(*key_fields)
+        if aggregate:
+            # 彙總欄位名稱不能與模型欄位相同
+            rows = rows.annotate(**{f'{field}_sum': Sum(field) for field in self.fields})
+            rows = [
+                {**{key: row[key] for key in key_fields}, **{field: row[f'{field}_sum'] for field in self.fields}}
+                for row in rows
+            ]
+        else:
+            rows = rows.values(*key_fields, *self.fields)
+        
+        self.rows = {}
+        for row in rows:
+            key = tuple(row[field] for field in key_fields)
+            self.rows[key[0] if len(key) == 1 else key] = row
+    
+    @classmethod
+    def days(cls, queryset, end_date, length=30, fields=('total_revenue', 'total_orders'), aggregate=False):
+        """
+        以日為單位的時間序列
+        
+        Args:
+            queryset: 具 report_date 欄位的報表
+            end_date: 最後一天（含）
+            length: 天數
+            fields: 要取出的欄位
+            aggregate: 是否加總同一天的多筆報表
+        """
+        start_date = end_date - timedelta(days=length - 1)
+        periods = [start_date + timedelta(days=i) for i in range(length)]
+        return cls(
+            queryset.filter(report_date__range=(start_date, end_date)),
+            periods, ['report_date'], fields, aggregate
+        )
+    
+    @classmethod
+    def months(cls, queryset, year, month, length=12, fields=('total_revenue', 'total_orders'), aggregate=False):
+        """
+        以月為單位的時間序列
+        
+        Args:
+            queryset: 具 report_year、report_month 欄位的報表
+            year, month: 最後一個月（含）
+            length: 月數
+            fields: 要取出的欄位
+            aggregate: 是否加總同一月的多筆報表
+        """
+        periods = []
+        for i in range(length - 1, -1, -1):
+            target_year, target_month = divmod(year * 12 + month - 1 - i, 12)
+            periods.append((target_year, target_month + 1))
+        
+        (first_year, first_month), (last_year, last_month) = periods[0], periods[-1]
+        queryset = queryset.alias(
+            period_index=F('report_year') * 12 + F('report_month')
+        ).filter(
+            report_year__range=(first_year, last_year),
+            period_index__range=(first_year * 12 + first_month, last_year * 12 + last_month)
+        )
+        return cls(queryset, periods, ['report_year', 'report_month'], fields, aggregate)
+    
+    @classmethod
+    def years(cls, queryset, year, length=5, fields=('total_revenue', 'total_orders'), aggregate=False):
+        """
+        以年為單位的時間序列
+        
+        Args:
+            queryset: 具 report_year 欄位的報表
+            year: 最後一年（含）
+            length: 年數
+            fields: 要取出的欄位
+            aggregate: 是否加總同一年的多筆報表
+        """
+        periods = list(range(year - length + 1, year + 1))
+        return cls(
+            queryset.filter(report_year__range=(periods[0], year)),
+            periods, ['report_year'], fields, aggregate
+        )
+    
+    def get(self, period):
+        """取得期間的資料列，沒有資料時為 None"""
+        return self.rows.get(period)
+    
+    def items(self):
+        """依期間順序回傳 (期間, 資料列或 None)"""
+        return [(period, self.rows.get(period)) for period in self.periods]
+    
+    def values(self, field, default=0):
+        """依期間順序回傳單一欄位的數列，沒有資料的期間補 default"""
+        return [
+            row[field] if row is not None and row[field] is not None else default
+            for _, row in self.items()
+        ]
+
 # 日營業收入報表
 class DailySalesReport(models.Model):
     """
@@ -73,6 +273,25 @@ class DailySalesReport(models.Model):
         help_text="格式：{'ERP': {'orders': 5, 'revenue': 3000}, 'SHOPEE': {...}}"
     )
     
+    # 排名（報表生成時以 refresh_ranks 寫入）
+    revenue_rank = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="整體排名"
+    )
+    
+    role_rank = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="角色排名"
+    )
+    
+    role_total = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="同角色報表數"
+    )
+    
     # 狀態追蹤
     is_finalized = models.BooleanField(
         default=False,
@@ -116,7 +335,6 @@ class DailySalesReport(models.Model):
         Returns:
             DailySalesReport 實例
         """
-        from django.db import transaction
         if report_date is None:
             report_date = timezone.now().date()
         
@@ -136,62 +354,19 @@ class DailySalesReport(models.Model):
                 account=user,
                 status=OrderStatus.PAID,
                 created_at__date=report_date
-            ).select_related('account').prefetch_related('order_products__variant__product')
-            
-            # 計算總收入
-            total_revenue = sum(order.total_amount for order in orders)
-            total_orders = orders.count()
-            
-            # 計算總銷售產品數量
-            total_products_sold = sum(
-                order.order_products.aggregate(
-                    total=Sum('quantity')
-                )['total'] or 0
-                for order in orders
             )
             
-            # 產品類型明細統計
-            product_breakdown = {}
-            for order in orders:
-                for order_product in order.order_products.all():
-                    variant = order_product.variant
-                    if variant and variant.product:
-                        product_type = variant.product_type
-                        
-                        if product_type not in product_breakdown:
-                            product_breakdown[product_type] = {
-                                'quantity': 0,
-                                'revenue': 0
-                            }
-                        
-                        product_breakdown[product_type]['quantity'] += order_product.quantity
-                        product_breakdown[product_type]['revenue'] += float(order_product.amount)
-            
-            # 訂單來源統計
-            order_source_breakdown = {}
-            for order in orders:
-                source = order.order_source or 'OTHER'
-                
-                if source not in order_source_breakdown:
-                    order_source_breakdown[source] = {
-                        'orders': 0,
-                        'revenue': 0
-                    }
-                
-                order_source_breakdown[source]['orders'] += 1
-                order_source_breakdown[source]['revenue'] += float(order.total_amount)
+            # 以分組查詢計算每筆訂單的貢獻，再彙總為日報表
+            entries = DailySalesReportEntry.build_for_orders(orders)
+            totals = cls.summarize_entries(entries)
+            total_revenue = totals['total_revenue']
+            total_orders = totals['total_orders']
             
             # 更新或建立報表
             report, created = cls.objects.update_or_create(
                 user=user,
                 report_date=report_date,
-                defaults={
-                    'total_revenue': total_revenue,
-                    'total_orders': total_orders,
-                    'total_products_sold': total_products_sold,
-                    'product_breakdown': product_breakdown,
-                    'order_source_breakdown': order_source_breakdown,
-                }
+                defaults=totals
             )
             
             action = "建立" if created else "更新"
@@ -199,30 +374,133 @@ class DailySalesReport(models.Model):
                 f"✅ {action}日報表：{report_date} - {user.fullname} - "
                 f"收入：${total_revenue:,}，訂單：{total_orders}筆"
             )
-            if report:
-                # 更新現有報表
-                report.total_revenue = total_revenue
-                report.total_orders = total_orders
-                total_products_sold = total_products_sold
-                product_breakdown = product_breakdown
-                order_source_breakdown = order_source_breakdown
-                report.save()
-                created = False
-            else:
-                # 建立新報表
-                report = cls.objects.create(
-                    user=user,
-                    report_date=report_date,
-                    total_revenue=total_revenue,
-                    total_orders=total_orders,
-                    total_products_sold=total_products_sold,
-                    product_breakdown=product_breakdown,
-                    order_source_breakdown=order_source_breakdown,
-                )
-                created = True
+            # 同步訂單貢獻記錄，讓後續的增量更新以重算結果為基準
+            DailySalesReportEntry.replace_entries(user, report_date, entries)
             
             return report
     
+    @staticmethod
+    def summarize_entries(entries):
+        """
+        將多筆訂單貢獻彙總為日報表欄位
+        
+        Args:
+            entries: DailySalesReportEntry 列表
+            
+        Returns:
+            dict: total_revenue、total_orders、total_products_sold、
+                  product_breakdown、order_source_breakdown
+        """
+        totals = {
+            'total_revenue': 0,
+            'total_orders': 0,
+            'total_products_sold': 0,
+            'product_breakdown': {},
+            'order_source_breakdown': {},
+        }
+        for entry in entries:
+            totals['total_revenue'] += entry.revenue
+            totals['total_orders'] += 1
+            totals['total_products_sold'] += entry.products_sold
+            totals['product_breakdown'] = merge_breakdown(
+                totals['product_breakdown'], entry.product_breakdown
+            )
+            totals['order_source_breakdown'] = merge_breakdown(
+                totals['order_source_breakdown'],
+                {entry.order_source: {'orders': 1, 'revenue': float(entry.revenue)}}
+            )
+        return totals
+    
+    @classmethod
+    def apply_order(cls, order, deleted=False):
+        """
+        增量更新：只把單筆訂單的變化套用到日報表與每日營業總結
+        
+        比較訂單目前的貢獻與 DailySalesReportEntry 中已計入的貢獻，
+        只套用差額，不重新讀取當天其他訂單。貢獻未改變時（例如只修改備註）
+        不會寫入任何報表。
+        
+        排名不在此重算：日報表儲存後會加入 ReportDirtyPeriod 佇列，
+        由 process_report_queue 每批對受影響的日期重算一次。
+        
+        Args:
+            order: Order 實例
+            deleted: 訂單是否已被刪除
+            
+        Returns:
+            bool: 是否有更新報表
+        """
+        with transaction.atomic():
+            # 1. 取得已計入的貢獻並加鎖
+            previous = DailySalesReportEntry.objects.select_for_update().select_related(
+                'user'
+            ).filter(order_id=order.pk).first()
+            
+            # 2. 計算訂單目前的貢獻（未付款或已刪除則為無貢獻）
+            current = None
+            if not deleted and order.status == OrderStatus.PAID:
+                current = DailySalesReportEntry.from_order(order)
+            
+            if previous is None and current is None:
+                return False
+            if previous is not None and current is not None and previous.same_contribution(current):
+                return False
+            
+            # 3. 扣除舊貢獻、加上新貢獻
+            if previous is not None:
+                cls._apply_contribution(previous, sign=-1)
+            if current is not None:
+                cls._apply_contribution(current, sign=1)
+            
+            # 4. 更新貢獻記錄
+            if current is None:
+                previous.delete()
+            else:
+                if previous is not None:
+                    current.pk = previous.pk
+                current.save()
+            
+            return True
+    
+    @classmethod
+    def _apply_contribution(cls, entry, sign):
+        """
+        將單筆訂單貢獻以 F() 原子更新套用到日報表與每日營業總結
+        
+        Args:
+            entry: DailySalesReportEntry 實例
+            sign: 1 為加上，-1 為扣除
+        """
+        report, _ = cls.objects.select_for_update().get_or_create(
+            user_id=entry.user_id,
+            report_date=entry.report_date
+        )
+        
+        report.total_revenue = F('total_revenue') + sign * entry.revenue
+        report.total_orders = F('total_orders') + sign
+        report.total_products_sold = F('total_products_sold') + sign * entry.products_sold
+        report.product_breakdown = merge_breakdown(
+            report.product_breakdown, entry.product_breakdown, sign
+        )
+        report.order_source_breakdown = merge_breakdown(
+            report.order_source_breakdown,
+            {entry.order_source: {'orders': 1, 'revenue': float(entry.revenue)}},
+            sign
+        )
+        # 使用 save 以觸發月報表同步
+        report.save(update_fields=[
+            'total_revenue', 'total_orders', 'total_products_sold',
+            'product_breakdown', 'order_source_breakdown', 'last_updated'
+        ])
+        report.refresh_from_db(fields=['total_revenue', 'total_orders', 'total_products_sold'])
+        
+        DailySalesSummary.apply_contribution(entry, sign)
+        
+        logger.info(
+            f"✅ 增量更新日報表：{entry.report_date} - {entry.order_id} - "
+            f"{'+' if sign > 0 else '-'}${entry.revenue:,}"
+        )
+    
     @classmethod
     def generate_all_reports(cls, report_date=None):
         """
@@ -247,10 +525,87 @@ class DailySalesReport(models.Model):
         for user in users_with_orders:
             cls.update_or_create_report(user, report_date)
             count += 1
+        cls.refresh_ranks(report_date)
         
         logger.info(f"✅ 生成 {report_date} 日報表完成，共 {count} 位用戶")
         return count
     
+    @classmethod
+    def bulk_generate(cls, start_date, end_date):
+        """
+        批次重建日期範圍內所有用戶的日報表
+        
+        以一次分組查詢計算範圍內所有已付款訂單，再以 bulk_create 寫入，
+        不逐一用戶、逐日查詢；不觸發報表 signal，月報表與年報表需另行重建。
+        範圍內已沒有已付款訂單的既有報表會歸零。
+        
+        Args:
+            start_date: 起始日期
+            end_date: 結束日期（含）
+            
+        Returns:
+            int: 寫入的報表數量
+        """
+        with transaction.atomic():
+            # 1. 一次計算範圍內所有訂單的貢獻，依 (用戶, 日期) 分組
+            orders = Order.objects.filter(
+                status=OrderStatus.PAID,
+                created_at__date__range=(start_date, end_date)
+            )
+            entries = DailySalesReportEntry.build_for_orders(orders)
+            
+            entries_by_key = defaultdict(list)
+            for entry in entries:
+                entries_by_key[(entry.user_id, entry.report_date)].append(entry)
+            
+            # 2. 彙總並批次寫入
+            reports = [
+                cls(user_id=user_id, report_date=report_date, **cls.summarize_entries(group))
+                for (user_id, report_date), group in entries_by_key.items()
+            ]
+            cls.objects.bulk_create(
+                reports,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['report_date', 'user'],
+                update_fields=[
+                    'total_revenue', 'total_orders', 'total_products_sold',
+                    'product_breakdown', 'order_source_breakdown', 'last_updated'
+                ]
+            )
+            
+            # 3. 範圍內已無訂單的報表歸零
+            stale_ids = [
+                report_id
+                for report_id, user_id, report_date in cls.objects.filter(
+                    report_date__range=(start_date, end_date)
+                ).values_list('id', 'user_id', 'report_date')
+                if (user_id, report_date) not in entries_by_key
+            ]
+            cls.objects.filter(id__in=stale_ids).update(
+                total_revenue=0,
+                total_orders=0,
+                total_products_sold=0,
+                product_breakdown={},
+                order_source_breakdown={},
+                last_updated=timezone.now()
+            )
+            
+            # 4. 重建貢獻記錄
+            DailySalesReportEntry.objects.filter(
+                report_date__range=(start_date, end_date)
+            ).delete()
+            DailySalesReportEntry.objects.bulk_create(entries, batch_size=500)
+            
+            # 5. 重算排名
+            cls.refresh_ranks(start_date, end_date)
+        
+        logger.info(
+            f"✅ 批次重建日報表：{start_date} ~ {end_date}，"
+            f"共 {len(reports)} 筆，歸零 {len(stale_ids)} 筆"
+        )
+        return len(reports)
+    
     @classmethod
     def get_ranking(cls, report_date=None, role=None, limit=10):
         """
@@ -312,6 +667,44 @@ class DailySalesReport(models.Model):
             # 其他用戶：只能查看自己的報表
             return queryset.filter(user=user).select_related('user')
     
+    @classmethod
+    def refresh_ranks(cls, start_date, end_date=None):
+        """
+        重算日期範圍內每一天的報表排名（一次視窗函數查詢）
+        
+        Args:
+            start_date: 起始日期
+            end_date: 結束日期（含），預設與起始日期相同
+            
+        Returns:
+            int: 排名有變動的報表數量
+        """
+        if end_date is None:
+            end_date = start_date
+        return refresh_report_ranks(
+            cls.objects.filter(report_date__range=(start_date, end_date)),
+            ['report_date']
+        )
+    
+    @classmethod
+    def refresh_ranks_on(cls, report_dates):
+        """
+        重算指定日期（不必連續）的報表排名（一次視窗函數查詢）
+        
+        Args:
+            report_dates: 日期列表
+            
+        Returns:
+            int: 排名有變動的報表數量
+        """
+        report_dates = set(report_dates)
+        if not report_dates:
+            return 0
+        return refresh_report_ranks(
+            cls.objects.filter(report_date__in=report_dates),
+            ['report_date']
+        )
+    
     def get_rank(self):
         """
         獲取該報表在當天所有用戶中的排名
@@ -319,6 +712,10 @@ class DailySalesReport(models.Model):
         Returns:
             int: 排名（從1開始）
         """
+        if self.revenue_rank is not None:
+            return self.revenue_rank
+        
+        # 尚未計算排名時即時查詢
         higher_revenue_count = DailySalesReport.objects.filter(
             report_date=self.report_date,
             total_revenue__gt=self.total_revenue
@@ -333,6 +730,10 @@ class DailySalesReport(models.Model):
         Returns:
             int: 排名（從1開始）
         """
+        if self.role_rank is not None:
+            return self.role_rank
+        
+        # 尚未計算排名時即時查詢
         higher_revenue_count = DailySalesReport.objects.filter(
             report_date=self.report_date,
             user__role=self.user.role,
@@ -340,6 +741,220 @@ class DailySalesReport(models.Model):
         ).count()
         
         return higher_revenue_count + 1
+    
+    def get_role_total(self):
+        """
+        獲取當天同角色用戶的報表數
+        
+        Returns:
+            int: 報表數
+        """
+        if self.role_total is not None:
+            return self.role_total
+        
+        return DailySalesReport.objects.filter(
+            report_date=self.report_date,
+            user__role=self.user.role
+        ).count()
+
+# 訂單日報表貢獻記錄
+class DailySalesReportEntry(models.Model):
+    """
+    記錄每筆已付款訂單已計入日報表的數據
+    
+    用途：訂單異動時只需比較新舊貢獻並套用差額（增量更新），
+    不必重新讀取當天所有訂單。完整重算（update_or_create_report）
+    會同步重建此表，作為對帳基準。
+    
+    order_id 不使用外鍵，訂單刪除後仍可依記錄扣除貢獻。
+    """
+    
+    order_id = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name="訂單編號"
+    )
+    
+    user = models.ForeignKey(
+        'accounts.CustomUser',
+        on_delete=models.CASCADE,
+        related_name='daily_sales_report_entries',
+        verbose_name="用戶"
+    )
+    
+    report_date = models.DateField(
+        verbose_name="報表日期"
+    )
+    
+    revenue = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        default=0,
+        verbose_name="訂單收入（含運費）"
+    )
+    
+    products_sold = models.IntegerField(
+        default=0,
+        verbose_name="銷售產品數量"
+    )
+    
+    order_source = models.CharField(
+        max_length=50,
+        default='OTHER',
+        verbose_name="訂單來源"
+    )
+    
+    product_breakdown = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="產品類型明細",
+        help_text="格式：{'esim': {'quantity': 10, 'revenue': 5000}, ...}"
+    )
+    
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="更新時間"
+    )
+    
+    class Meta:
+        verbose_name = "訂單日報表貢獻記錄"
+        verbose_name_plural = "訂單日報表貢獻記錄"
+        indexes = [
+            models.Index(fields=['user', 'report_date']),
+        ]
+    
+    def __str__(self):
+        return f"{self.report_date} - {self.order_id} - ${self.revenue:,}"
+    
+    @classmethod
+    def from_order(cls, order):
+        """
+        計算訂單目前對日報表的貢獻（不儲存）
+        
+        報表日期使用本地時區日期，與 created_at__date 查詢一致。
+        
+        Args:
+            order: Order 實例
+            
+        Returns:
+            DailySalesReportEntry 實例（未儲存）
+        """
+        order_products = order.order_products.all()
+        if 'order_products' not in getattr(order, '_prefetched_objects_cache', {}):
+            order_products = order_products.select_related('variant')
+        
+        amount = 0
+        products_sold = 0
+        product_breakdown = {}
+        for order_product in order_products:
+            amount += order_product.amount
+            products_sold += order_product.quantity
+            
+            variant = order_product.variant
+            if variant and variant.product_id:
+                bucket = product_breakdown.setdefault(
+                    variant.product_type, {'quantity': 0, 'revenue': 0}
+                )
+                bucket['quantity'] += order_product.quantity
+                bucket['revenue'] += float(order_product.amount)
+        
+        shipping = order.shipping_fee if order.shipping_fee is not None else 0
+        
+        return cls(
+            order_id=order.pk,
+            user=order.account,
+            report_date=timezone.localdate(order.created_at),
+            revenue=amount + shipping,
+            products_sold=products_sold,
+            order_source=order.order_source or 'OTHER',
+            product_breakdown=product_breakdown,
+        )
+    
+    def same_contribution(self, other):
+        """判斷兩筆貢獻對報表的影響是否相同"""
+        return (
+            self.user_id == other.user_id
+            and self.report_date == other.report_date
+            and self.revenue == other.revenue
+            and self.products_sold == other.products_sold
+            and self.order_source == other.order_source
+            and self.product_breakdown == other.product_breakdown
+        )
+    
+    @classmethod
+    def build_for_orders(cls, orders):
+        """
+        以分組查詢計算多筆訂單的貢獻（不儲存）
+        
+        只需兩次查詢：訂單基本資料，以及依 (訂單, 產品類型) 分組的數量與金額。
+        結果與逐筆呼叫 from_order 相同。
+        
+        Args:
+            orders: Order QuerySet
+            
+        Returns:
+            list: DailySalesReportEntry 列表（未儲存）
+        """
+        # 1. 依訂單與產品類型分組統計（沒有變體的訂單產品歸入 None）
+        lines_by_order = defaultdict(list)
+        line_rows = OrderProduct.objects.filter(
+            order__in=orders
+        ).order_by().values(
+            'order_id', 'variant__product_type'
+        ).annotate(
+            line_quantity=Sum('quantity'),
+            line_amount=Sum(F('unit_price') * F('quantity'))
+        )
+        for row in line_rows:
+            lines_by_order[row['order_id']].append(row)
+        
+        # 2. 組合每筆訂單的貢獻
+        entries = []
+        order_rows = orders.order_by().values(
+            'id', 'account_id', 'created_at', 'shipping_fee', 'order_source'
+        )
+        for order in order_rows:
+            amount = 0
+            products_sold = 0
+            product_breakdown = {}
+            for row in lines_by_order.get(order['id'], []):
+                amount += row['line_amount']
+                products_sold += row['line_quantity']
+                if row['variant__product_type'] is not None:
+                    product_breakdown[row['variant__product_type']] = {
+                        'quantity': row['line_quantity'],
+                        'revenue': float(row['line_amount'])
+                    }
+            
+            shipping = order['shipping_fee'] if order['shipping_fee'] is not None else 0
+            
+            entries.append(cls(
+                order_id=order['id'],
+                user_id=order['account_id'],
+                report_date=timezone.localdate(order['created_at']),
+                revenue=amount + shipping,
+                products_sold=products_sold,
+                order_source=order['order_source'] or 'OTHER',
+                product_breakdown=product_breakdown,
+            ))
+        return entries
+    
+    @classmethod
+    def replace_entries(cls, user, report_date, entries):
+        """
+        完整重算後重建該用戶當日的貢獻記錄
+        
+        Args:
+            user: CustomUser 實例
+            report_date: 報表日期
+            entries: build_for_orders 計算的貢獻列表
+        """
+        cls.objects.filter(
+            Q(user=user, report_date=report_date)
+            | Q(order_id__in=[entry.order_id for entry in entries])
+        ).delete()
+        cls.objects.bulk_create(entries, batch_size=500)
+
 
 # 每日營業總結表
 class DailySalesSummary(models.Model):
@@ -418,6 +1033,20 @@ class DailySalesSummary(models.Model):
     def __str__(self):
         return f"{self.report_date} - 總收入：${self.total_revenue:,}"
     
+    @classmethod
+    def get_trend(cls, end_date, days=7):
+        """
+        獲取截至指定日期的每日營業趨勢（一次查詢）
+        
+        Args:
+            end_date: 最後一天（含）
+            days: 天數
+            
+        Returns:
+            TimeSeries: 以日期為期間的時間序列
+        """
+        return TimeSeries.days(cls.objects.all(), end_date, length=days)
+    
     @classmethod
     def generate_summary(cls, report_date=None):
         """
@@ -432,44 +1061,63 @@ class DailySalesSummary(models.Model):
         if report_date is None:
             report_date = timezone.now().date()
         
-        # 從 DailySalesReport 彙總數據
-        daily_reports = DailySalesReport.objects.filter(report_date=report_date)
+        # 從 DailySalesReport 彙總數據（一次讀取）
+        daily_reports = DailySalesReport.objects.filter(
+            report_date=report_date
+        ).values(
+            'user__role', 'total_revenue', 'total_orders',
+            'total_products_sold', 'product_breakdown'
+        )
         
-        # 總體統計
-        total_revenue = daily_reports.aggregate(
-            total=Sum('total_revenue')
-        )['total'] or 0
+        defaults = cls._build_summary_fields(daily_reports)
+        total_revenue = defaults['total_revenue']
+        total_orders = defaults['total_orders']
         
-        total_orders = daily_reports.aggregate(
-            total=Sum('total_orders')
-        )['total'] or 0
+        # 更新或建立總結
+        summary, created = cls.objects.update_or_create(
+            report_date=report_date,
+            defaults=defaults
+        )
         
-        total_products_sold = daily_reports.aggregate(
-            total=Sum('total_products_sold')
-        )['total'] or 0
+        action = "建立" if created else "更新"
+        logger.info(
+            f"✅ {action}每日營業總結：{report_date} - "
+            f"總收入：${total_revenue:,}，訂單：{total_orders}筆"
+        )
         
-        # 按角色統計
-        revenue_by_role = {}
-        for role_choice in AccountRole.choices:
-            role = role_choice[0]
-            role_revenue = daily_reports.filter(
-                user__role=role
-            ).aggregate(total=Sum('total_revenue'))['total'] or 0
-            
-            if role_revenue > 0:
-                revenue_by_role[role] = float(role_revenue)
+        return summary
+    
+    @staticmethod
+    def _build_summary_fields(daily_reports):
+        """
+        由當日日報表計算每日營業總結欄位
         
-        # 彙總產品類型統計
+        Args:
+            daily_reports: 日報表資料列表，每筆需包含 user__role、total_revenue、
+                           total_orders、total_products_sold、product_breakdown
+            
+        Returns:
+            dict: 每日營業總結欄位
+        """
+        total_revenue = 0
+        total_orders = 0
+        total_products_sold = 0
+        role_revenue = defaultdict(int)
         product_type_stats = {}
+        
         for report in daily_reports:
-            for product_type, data in report.product_breakdown.items():
-                if product_type not in product_type_stats:
-                    product_type_stats[product_type] = {
-                        'quantity': 0,
-                        'revenue': 0
-                    }
-                product_type_stats[product_type]['quantity'] += data['quantity']
-                product_type_stats[product_type]['revenue'] += data['revenue']
+            total_revenue += report['total_revenue']
+            total_orders += report['total_orders']
+            total_products_sold += report['total_products_sold']
+            role_revenue[report['user__role']] += report['total_revenue']
+            product_type_stats = merge_breakdown(product_type_stats, report['product_breakdown'])
+        
+        # 按角色統計（只保留收入大於 0 的角色）
+        revenue_by_role = {
+            role: float(role_revenue[role])
+            for role, _ in AccountRole.choices
+            if role_revenue[role] > 0
+        }
         
         # 轉換為列表並排序
         top_product_types = [
@@ -482,24 +1130,112 @@ class DailySalesSummary(models.Model):
         ]
         top_product_types.sort(key=lambda x: x['revenue'], reverse=True)
         
-        # 更新或建立總結
-        summary, created = cls.objects.update_or_create(
-            report_date=report_date,
-            defaults={
-                'total_revenue': total_revenue,
-                'total_orders': total_orders,
-                'total_products_sold': total_products_sold,
-                'revenue_by_role': revenue_by_role,
-                'top_product_types': top_product_types,
-            }
+        return {
+            'total_revenue': total_revenue,
+            'total_orders': total_orders,
+            'total_products_sold': total_products_sold,
+            'revenue_by_role': revenue_by_role,
+            'top_product_types': top_product_types,
+        }
+    
+    @classmethod
+    def bulk_generate(cls, start_date, end_date):
+        """
+        批次重建日期範圍內每一天的營業總結
+        
+        Args:
+            start_date: 起始日期
+            end_date: 結束日期（含）
+            
+        Returns:
+            int: 寫入的總結數量
+        """
+        # 1. 一次讀取範圍內的日報表，依日期分組
+        reports_by_date = defaultdict(list)
+        for report in DailySalesReport.objects.filter(
+            report_date__range=(start_date, end_date)
+        ).values(
+            'report_date', 'user__role', 'total_revenue', 'total_orders',
+            'total_products_sold', 'product_breakdown'
+        ):
+            reports_by_date[report['report_date']].append(report)
+        
+        # 2. 範圍內每一天都產生總結（沒有報表的日期為零）
+        summaries = []
+        current = start_date
+        while current <= end_date:
+            summaries.append(cls(
+                report_date=current,
+                **cls._build_summary_fields(reports_by_date.get(current, []))
+            ))
+            current += timedelta(days=1)
+        
+        cls.objects.bulk_create(
+            summaries,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['report_date'],
+            update_fields=[
+                'total_revenue', 'total_orders', 'total_products_sold',
+                'revenue_by_role', 'top_product_types', 'updated_at'
+            ]
         )
         
-        action = "建立" if created else "更新"
-        logger.info(
-            f"✅ {action}每日營業總結：{report_date} - "
-            f"總收入：${total_revenue:,}，訂單：{total_orders}筆"
+        logger.info(f"✅ 批次重建每日營業總結：{start_date} ~ {end_date}，共 {len(summaries)} 筆")
+        return len(summaries)
+    
+    @classmethod
+    def apply_contribution(cls, entry, sign):
+        """
+        以單筆訂單貢獻增量更新每日營業總結
+        
+        Args:
+            entry: DailySalesReportEntry 實例
+            sign: 1 為加上，-1 為扣除
+        """
+        summary, _ = cls.objects.select_for_update().get_or_create(
+            report_date=entry.report_date
         )
         
+        # 1. 總體統計
+        summary.total_revenue = F('total_revenue') + sign * entry.revenue
+        summary.total_orders = F('total_orders') + sign
+        summary.total_products_sold = F('total_products_sold') + sign * entry.products_sold
+        
+        # 2. 按角色統計（與完整重算相同，只保留收入大於 0 的角色）
+        role = entry.user.role
+        revenue_by_role = dict(summary.revenue_by_role or {})
+        role_revenue = revenue_by_role.get(role, 0) + sign * float(entry.revenue)
+        if role_revenue > 0:
+            revenue_by_role[role] = role_revenue
+        else:
+            revenue_by_role.pop(role, None)
+        summary.revenue_by_role = revenue_by_role
+        
+        # 3. 熱門產品類型
+        product_type_stats = merge_breakdown(
+            {
+                item['type']: {'quantity': item['quantity'], 'revenue': item['revenue']}
+                for item in summary.top_product_types or []
+            },
+            entry.product_breakdown,
+            sign
+        )
+        top_product_types = [
+            {
+                'type': ptype,
+                'quantity': data['quantity'],
+                'revenue': data['revenue']
+            }
+            for ptype, data in product_type_stats.items()
+        ]
+        top_product_types.sort(key=lambda x: x['revenue'], reverse=True)
+        summary.top_product_types = top_product_types
+        
+        summary.save(update_fields=[
+            'total_revenue', 'total_orders', 'total_products_sold',
+            'revenue_by_role', 'top_product_types', 'updated_at'
+        ])
         return summary
 
 # 營業收入月報表   
@@ -636,6 +1372,25 @@ class MonthlySalesReport(models.Model):
         verbose_name="環比訂單增長率(%)"
     )
     
+    # 排名（報表生成時以 refresh_ranks 寫入）
+    revenue_rank = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="整體排名"
+    )
+    
+    role_rank = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="角色排名"
+    )
+    
+    role_total = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="同角色報表數"
+    )
+    
     # 狀態追蹤
     is_finalized = models.BooleanField(
         default=False,
@@ -686,134 +1441,40 @@ class MonthlySalesReport(models.Model):
             month = month or now.month
         
         # 查詢該月的所有日報表
-        daily_reports = DailySalesReport.objects.filter(
+        daily_reports = list(DailySalesReport.objects.filter(
             user=user,
             report_date__year=year,
             report_date__month=month
-        ).order_by('report_date')
+        ).order_by('report_date'))
         
-        if not daily_reports.exists():
+        if not daily_reports:
             logger.warning(f"⚠️ 用戶 {user.fullname} 在 {year}-{month:02d} 沒有日報表數據")
             return None
         
-        # 彙總數據
-        total_revenue = daily_reports.aggregate(
-            total=Sum('total_revenue')
-        )['total'] or 0
-        
-        total_orders = daily_reports.aggregate(
-            total=Sum('total_orders')
-        )['total'] or 0
-        
-        total_products_sold = daily_reports.aggregate(
-            total=Sum('total_products_sold')
-        )['total'] or 0
-        
-        # 活躍天數
-        active_days = daily_reports.count()
-        
-        # 計算日均數據
-        avg_daily_revenue = total_revenue / active_days if active_days > 0 else 0
-        avg_daily_orders = total_orders / active_days if active_days > 0 else 0
-        
-        # 彙總產品類型統計
-        product_breakdown = {}
-        for report in daily_reports:
-            for product_type, data in report.product_breakdown.items():
-                if product_type not in product_breakdown:
-                    product_breakdown[product_type] = {
-                        'quantity': 0,
-                        'revenue': 0
-                    }
-                product_breakdown[product_type]['quantity'] += data['quantity']
-                product_breakdown[product_type]['revenue'] += data['revenue']
-        
-        # 彙總訂單來源統計
-        order_source_breakdown = {}
-        for report in daily_reports:
-            for source, data in report.order_source_breakdown.items():
-                if source not in order_source_breakdown:
-                    order_source_breakdown[source] = {
-                        'orders': 0,
-                        'revenue': 0
-                    }
-                order_source_breakdown[source]['orders'] += data['orders']
-                order_source_breakdown[source]['revenue'] += data['revenue']
-        
-        # 每日明細
-        daily_details = [
-            {
-                'date': report.report_date.strftime('%Y-%m-%d'),
-                'revenue': float(report.total_revenue),
-                'orders': report.total_orders,
-                'products': report.total_products_sold
-            }
-            for report in daily_reports
-        ]
-        
-        # 計算同比增長率（去年同月）
+        # 同比（去年同月）與環比（上個月）比較對象
         last_year_report = cls.objects.filter(
             user=user,
             report_year=year - 1,
             report_month=month
         ).first()
         
-        yoy_revenue_growth = None
-        yoy_order_growth = None
-        if last_year_report and last_year_report.total_revenue > 0:
-            yoy_revenue_growth = (
-                (total_revenue - last_year_report.total_revenue) / 
-                last_year_report.total_revenue * 100
-            )
-        if last_year_report and last_year_report.total_orders > 0:
-            yoy_order_growth = (
-                (total_orders - last_year_report.total_orders) / 
-                last_year_report.total_orders * 100
-            )
-        
-        # 計算環比增長率（上個月）
-        last_month_year = year if month > 1 else year - 1
-        last_month = month - 1 if month > 1 else 12
-        
+        last_month_year, last_month = cls._previous_month(year, month)
         last_month_report = cls.objects.filter(
             user=user,
             report_year=last_month_year,
             report_month=last_month
         ).first()
         
-        mom_revenue_growth = None
-        mom_order_growth = None
-        if last_month_report and last_month_report.total_revenue > 0:
-            mom_revenue_growth = (
-                (total_revenue - last_month_report.total_revenue) / 
-                last_month_report.total_revenue * 100
-            )
-        if last_month_report and last_month_report.total_orders > 0:
-            mom_order_growth = (
-                (total_orders - last_month_report.total_orders) / 
-                last_month_report.total_orders * 100
-            )
+        defaults = cls._build_report_fields(daily_reports, last_year_report, last_month_report)
+        total_revenue = defaults['total_revenue']
+        total_orders = defaults['total_orders']
         
         # 更新或建立報表
         report, created = cls.objects.update_or_create(
             user=user,
             report_year=year,
             report_month=month,
-            defaults={
-                'total_revenue': total_revenue,
-                'total_orders': total_orders,
-                'total_products_sold': total_products_sold,
-                'avg_daily_revenue': avg_daily_revenue,
-                'avg_daily_orders': avg_daily_orders,
-                'active_days': active_days,
-                'product_breakdown': product_breakdown,
-                'order_source_breakdown': order_source_breakdown,
-                'daily_details': daily_details,
-                'yoy_revenue_growth': yoy_revenue_growth,
-                'yoy_order_growth': yoy_order_growth,
-                'mom_revenue_growth': mom_revenue_growth,
-                'mom_order_growth': mom_order_growth,
-            }
+            defaults=defaults
         )
         
         action = "建立" if created else "更新"
@@ -824,6 +1485,70 @@ class MonthlySalesReport(models.Model):
         
         return report
     
+    @staticmethod
+    def _previous_month(year, month):
+        """回傳上個月的 (年, 月)"""
+        return (year, month - 1) if month > 1 else (year - 1, 12)
+    
+    @staticmethod
+    def _build_report_fields(daily_reports, last_year_report=None, last_month_report=None):
+        """
+        由當月日報表計算月報表欄位
+        
+        Args:
+            daily_reports: 當月日報表列表（依日期排序）
+            last_year_report: 去年同月報表（用於同比），可為 None
+            last_month_report: 上個月報表（用於環比），可為 None
+            
+        Returns:
+            dict: 月報表欄位
+        """
+        # 彙總數據
+        total_revenue = sum(report.total_revenue for report in daily_reports)
+        total_orders = sum(report.total_orders for report in daily_reports)
+        total_products_sold = sum(report.total_products_sold for report in daily_reports)
+        
+        # 活躍天數
+        active_days = len(daily_reports)
+        
+        # 計算日均數據
+        avg_daily_revenue = total_revenue / active_days if active_days > 0 else 0
+        avg_daily_orders = total_orders / active_days if active_days > 0 else 0
+        
+        # 彙總產品類型與訂單來源統計
+        product_breakdown = {}
+        order_source_breakdown = {}
+        for report in daily_reports:
+            product_breakdown = merge_breakdown(product_breakdown, report.product_breakdown)
+            order_source_breakdown = merge_breakdown(order_source_breakdown, report.order_source_breakdown)
+        
+        # 每日明細
+        daily_details = [
+            {
+                'date': report.report_date.strftime('%Y-%m-%d'),
+                'revenue': float(report.total_revenue),
+                'orders': report.total_orders,
+                'products': report.total_products_sold
+            }
+            for report in daily_reports
+        ]
+        
+        return {
+            'total_revenue': total_revenue,
+            'total_orders': total_orders,
+            'total_products_sold': total_products_sold,
+            'avg_daily_revenue': avg_daily_revenue,
+            'avg_daily_orders': avg_daily_orders,
+            'active_days': active_days,
+            'product_breakdown': product_breakdown,
+            'order_source_breakdown': order_source_breakdown,
+            'daily_details': daily_details,
+            'yoy_revenue_growth': growth_rate(total_revenue, last_year_report and last_year_report.total_revenue),
+            'yoy_order_growth': growth_rate(total_orders, last_year_report and last_year_report.total_orders),
+            'mom_revenue_growth': growth_rate(total_revenue, last_month_report and last_month_report.total_revenue),
+            'mom_order_growth': growth_rate(total_orders, last_month_report and last_month_report.total_orders),
+        }
+    
     @classmethod
     def generate_all_reports(cls, year=None, month=None):
         """
@@ -847,14 +1572,87 @@ class MonthlySalesReport(models.Model):
             daily_sales_reports__report_date__month=month
         ).distinct()
         
-        count = 0
-        for user in users_with_reports:
-            report = cls.update_or_create_report(user, year, month)
-            if report:
-                count += 1
+        count = 0
+        for user in users_with_reports:
+            report = cls.update_or_create_report(user, year, month)
+            if report:
+                count += 1
+        cls.refresh_ranks([(year, month)])
+        
+        logger.info(f"✅ 生成 {year}-{month:02d} 月報表完成，共 {count} 位用戶")
+        return count
+    
+    @classmethod
+    def bulk_generate(cls, year_months):
+        """
+        批次重建多個月份所有用戶的月報表
+        
+        一次讀取範圍內的日報表並在記憶體中分組計算，依時間順序處理，
+        同比、環比使用同批次剛計算的結果，最後以 bulk_create 寫入。
+        不觸發報表 signal，年報表需另行重建。
+        
+        Args:
+            year_months: (年, 月) 列表
+            
+        Returns:
+            int: 寫入的報表數量
+        """
+        year_months = sorted(set(year_months))
+        if not year_months:
+            return 0
+        
+        first_year, first_month = year_months[0]
+        last_year, last_month = year_months[-1]
+        start_date = date(first_year, first_month, 1)
+        end_date = date(last_year, last_month, calendar.monthrange(last_year, last_month)[1])
+        
+        # 1. 一次讀取範圍內的日報表，依 (用戶, 年, 月) 分組
+        wanted = set(year_months)
+        daily_by_key = defaultdict(list)
+        for daily_report in DailySalesReport.objects.filter(
+            report_date__range=(start_date, end_date)
+        ).order_by('user_id', 'report_date'):
+            key = (daily_report.report_date.year, daily_report.report_date.month)
+            if key in wanted:
+                daily_by_key[(daily_report.user_id, *key)].append(daily_report)
+        
+        # 2. 讀取既有月報表作為同比、環比比較對象
+        previous = {
+            (report.user_id, report.report_year, report.report_month): report
+            for report in cls.objects.filter(
+                user_id__in={user_id for user_id, _, _ in daily_by_key},
+                report_year__range=(first_year - 1, last_year)
+            ).only('user_id', 'report_year', 'report_month', 'total_revenue', 'total_orders')
+        }
         
-        logger.info(f"✅ 生成 {year}-{month:02d} 月報表完成，共 {count} 位用戶")
-        return count
+        # 3. 依時間順序計算
+        reports = []
+        for user_id, year, month in sorted(daily_by_key):
+            fields = cls._build_report_fields(
+                daily_by_key[(user_id, year, month)],
+                previous.get((user_id, year - 1, month)),
+                previous.get((user_id, *cls._previous_month(year, month)))
+            )
+            report = cls(user_id=user_id, report_year=year, report_month=month, **fields)
+            previous[(user_id, year, month)] = report
+            reports.append(report)
+        
+        # 4. 批次寫入
+        if reports:
+            cls.objects.bulk_create(
+                reports,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['report_year', 'report_month', 'user'],
+                update_fields=list(fields) + ['last_updated']
+            )
+            cls.refresh_ranks(year_months)
+        
+        logger.info(
+            f"✅ 批次重建月報表：{first_year}-{first_month:02d} ~ "
+            f"{last_year}-{last_month:02d}，共 {len(reports)} 筆"
+        )
+        return len(reports)
     
     @classmethod
     def get_ranking(cls, year=None, month=None, role=None, limit=10):
@@ -927,6 +1725,29 @@ class MonthlySalesReport(models.Model):
             # 其他用戶：只能查看自己的報表
             return queryset.filter(user=user).select_related('user')
     
+    @classmethod
+    def refresh_ranks(cls, year_months):
+        """
+        重算多個月份的報表排名（一次視窗函數查詢）
+        
+        Args:
+            year_months: (年, 月) 列表
+            
+        Returns:
+            int: 排名有變動的報表數量
+        """
+        year_months = set(year_months)
+        if not year_months:
+            return 0
+        
+        condition = Q()
+        for year, month in year_months:
+            condition |= Q(report_year=year, report_month=month)
+        return refresh_report_ranks(
+            cls.objects.filter(condition),
+            ['report_year', 'report_month']
+        )
+    
     def get_rank(self):
         """
         獲取該報表在當月所有用戶中的排名
@@ -934,6 +1755,10 @@ class MonthlySalesReport(models.Model):
         Returns:
             int: 排名（從1開始）
         """
+        if self.revenue_rank is not None:
+            return self.revenue_rank
+        
+        # 尚未計算排名時即時查詢
         higher_revenue_count = MonthlySalesReport.objects.filter(
             report_year=self.report_year,
             report_month=self.report_month,
@@ -949,6 +1774,10 @@ class MonthlySalesReport(models.Model):
         Returns:
             int: 排名（從1開始）
         """
+        if self.role_rank is not None:
+            return self.role_rank
+        
+        # 尚未計算排名時即時查詢
         higher_revenue_count = MonthlySalesReport.objects.filter(
             report_year=self.report_year,
             report_month=self.report_month,
@@ -958,6 +1787,22 @@ class MonthlySalesReport(models.Model):
         
         return higher_revenue_count + 1
     
+    def get_role_total(self):
+        """
+        獲取當月同角色用戶的報表數
+        
+        Returns:
+            int: 報表數
+        """
+        if self.role_total is not None:
+            return self.role_total
+        
+        return MonthlySalesReport.objects.filter(
+            report_year=self.report_year,
+            report_month=self.report_month,
+            user__role=self.user.role
+        ).count()
+    
     @property
     def report_period(self):
         """返回報表期間的顯示字串"""
@@ -1089,6 +1934,20 @@ class MonthlySalesSummary(models.Model):
     def __str__(self):
         return f"{self.report_year}-{self.report_month:02d} - 總收入：${self.total_revenue:,}"
     
+    @classmethod
+    def get_trend(cls, year, month, months=12):
+        """
+        獲取截至指定月份的每月營業趨勢（一次查詢）
+        
+        Args:
+            year, month: 最後一個月（含）
+            months: 月數
+            
+        Returns:
+            TimeSeries: 以 (年, 月) 為期間的時間序列
+        """
+        return TimeSeries.months(cls.objects.all(), year, month, length=months)
+    
     @classmethod
     def generate_summary(cls, year=None, month=None):
         """
@@ -1413,6 +2272,25 @@ class AnnualSalesReport(models.Model):
         help_text="GROWING/STABLE/DECLINING"
     )
     
+    # 排名（報表生成時以 refresh_ranks 寫入）
+    revenue_rank = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="整體排名"
+    )
+    
+    role_rank = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="角色排名"
+    )
+    
+    role_total = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="同角色報表數"
+    )
+    
     # 狀態追蹤
     is_finalized = models.BooleanField(
         default=False,
@@ -1460,70 +2338,78 @@ class AnnualSalesReport(models.Model):
             year = timezone.now().year
         
         # 查詢該年的所有月報表
-        monthly_reports = MonthlySalesReport.objects.filter(
+        monthly_reports = list(MonthlySalesReport.objects.filter(
             user=user,
             report_year=year
-        ).order_by('report_month')
+        ).order_by('report_month'))
         
-        if not monthly_reports.exists():
+        if not monthly_reports:
             logger.warning(f"⚠️ 用戶 {user.fullname} 在 {year} 年沒有月報表數據")
             return None
         
-        # 彙總數據
-        total_revenue = monthly_reports.aggregate(
-            total=Sum('total_revenue')
-        )['total'] or 0
+        # 同比比較對象（去年）
+        last_year_report = cls.objects.filter(
+            user=user,
+            report_year=year - 1
+        ).first()
         
-        total_orders = monthly_reports.aggregate(
-            total=Sum('total_orders')
-        )['total'] or 0
+        defaults = cls._build_report_fields(monthly_reports, last_year_report)
+        total_revenue = defaults['total_revenue']
+        total_orders = defaults['total_orders']
         
-        total_products_sold = monthly_reports.aggregate(
-            total=Sum('total_products_sold')
-        )['total'] or 0
+        # 更新或建立報表
+        report, created = cls.objects.update_or_create(
+            user=user,
+            report_year=year,
+            defaults=defaults
+        )
+        
+        action = "建立" if created else "更新"
+        logger.info(
+            f"✅ {action}年報表：{year}年 - {user.fullname} - "
+            f"收入：${total_revenue:,}，訂單：{total_orders}筆"
+        )
+        
+        return report
+    
+    @classmethod
+    def _build_report_fields(cls, monthly_reports, last_year_report=None):
+        """
+        由當年月報表計算年報表欄位
+        
+        Args:
+            monthly_reports: 當年月報表列表（依月份排序）
+            last_year_report: 去年年報表（用於同比），可為 None
+            
+        Returns:
+            dict: 年報表欄位
+        """
+        # 彙總數據
+        total_revenue = sum(report.total_revenue for report in monthly_reports)
+        total_orders = sum(report.total_orders for report in monthly_reports)
+        total_products_sold = sum(report.total_products_sold for report in monthly_reports)
         
         # 活躍月數
-        active_months = monthly_reports.count()
+        active_months = len(monthly_reports)
         
         # 計算月均數據
         avg_monthly_revenue = total_revenue / active_months if active_months > 0 else 0
         avg_monthly_orders = total_orders / active_months if active_months > 0 else 0
         
-        # 找出業績最高和最低的月份
-        peak_report = monthly_reports.order_by('-total_revenue').first()
-        peak_month = peak_report.report_month if peak_report else None
-        peak_month_revenue = peak_report.total_revenue if peak_report else None
-        
-        # 最低月份（排除零收入）
-        lowest_report = monthly_reports.filter(
-            total_revenue__gt=0
-        ).order_by('total_revenue').first()
-        lowest_month = lowest_report.report_month if lowest_report else None
-        lowest_month_revenue = lowest_report.total_revenue if lowest_report else None
+        # 找出業績最高和最低（排除零收入）的月份
+        peak_report = max(monthly_reports, key=lambda report: report.total_revenue, default=None)
+        lowest_report = min(
+            (report for report in monthly_reports if report.total_revenue > 0),
+            key=lambda report: report.total_revenue,
+            default=None
+        )
         
-        # 彙總產品類型統計
+        # 彙總產品類型與訂單來源統計
         product_breakdown = {}
-        for report in monthly_reports:
-            for product_type, data in report.product_breakdown.items():
-                if product_type not in product_breakdown:
-                    product_breakdown[product_type] = {
-                        'quantity': 0,
-                        'revenue': 0
-                    }
-                product_breakdown[product_type]['quantity'] += data['quantity']
-                product_breakdown[product_type]['revenue'] += data['revenue']
-        
-        # 彙總訂單來源統計
         order_source_breakdown = {}
         for report in monthly_reports:
-            for source, data in report.order_source_breakdown.items():
-                if source not in order_source_breakdown:
-                    order_source_breakdown[source] = {
-                        'orders': 0,
-                        'revenue': 0
-                    }
-                order_source_breakdown[source]['orders'] += data['orders']
-                order_source_breakdown[source]['revenue'] += data['revenue']
+            product_breakdown = merge_breakdown(product_breakdown, report.product_breakdown)
+            order_source_breakdown = merge_breakdown(order_source_breakdown, report.order_source_breakdown)
         
         # 每月明細
         monthly_details = [
@@ -1545,74 +2431,30 @@ class AnnualSalesReport(models.Model):
         }
         
         for report in monthly_reports:
-            month = report.report_month
-            if month in [1, 2, 3]:
-                quarter = 'Q1'
-            elif month in [4, 5, 6]:
-                quarter = 'Q2'
-            elif month in [7, 8, 9]:
-                quarter = 'Q3'
-            else:
-                quarter = 'Q4'
-            
+            quarter = f"Q{(report.report_month - 1) // 3 + 1}"
             quarterly_stats[quarter]['revenue'] += float(report.total_revenue)
             quarterly_stats[quarter]['orders'] += report.total_orders
-            quarterly_stats[quarter]['months'].append(month)
-        
-        # 計算同比增長率（去年）
-        last_year_report = cls.objects.filter(
-            user=user,
-            report_year=year - 1
-        ).first()
-        
-        yoy_revenue_growth = None
-        yoy_order_growth = None
-        if last_year_report and last_year_report.total_revenue > 0:
-            yoy_revenue_growth = (
-                (total_revenue - last_year_report.total_revenue) / 
-                last_year_report.total_revenue * 100
-            )
-        if last_year_report and last_year_report.total_orders > 0:
-            yoy_order_growth = (
-                (total_orders - last_year_report.total_orders) / 
-                last_year_report.total_orders * 100
-            )
-        
-        # 分析收入趨勢
-        revenue_trend = cls._analyze_revenue_trend(monthly_details)
-        
-        # 更新或建立報表
-        report, created = cls.objects.update_or_create(
-            user=user,
-            report_year=year,
-            defaults={
-                'total_revenue': total_revenue,
-                'total_orders': total_orders,
-                'total_products_sold': total_products_sold,
-                'avg_monthly_revenue': avg_monthly_revenue,
-                'avg_monthly_orders': avg_monthly_orders,
-                'active_months': active_months,
-                'peak_month': peak_month,
-                'peak_month_revenue': peak_month_revenue,
-                'lowest_month': lowest_month,
-                'lowest_month_revenue': lowest_month_revenue,
-                'product_breakdown': product_breakdown,
-                'order_source_breakdown': order_source_breakdown,
-                'monthly_details': monthly_details,
-                'quarterly_stats': quarterly_stats,
-                'yoy_revenue_growth': yoy_revenue_growth,
-                'yoy_order_growth': yoy_order_growth,
-                'revenue_trend': revenue_trend,
-            }
-        )
-        
-        action = "建立" if created else "更新"
-        logger.info(
-            f"✅ {action}年報表：{year}年 - {user.fullname} - "
-            f"收入：${total_revenue:,}，訂單：{total_orders}筆"
-        )
-        
-        return report
+            quarterly_stats[quarter]['months'].append(report.report_month)
+        
+        return {
+            'total_revenue': total_revenue,
+            'total_orders': total_orders,
+            'total_products_sold': total_products_sold,
+            'avg_monthly_revenue': avg_monthly_revenue,
+            'avg_monthly_orders': avg_monthly_orders,
+            'active_months': active_months,
+            'peak_month': peak_report.report_month if peak_report else None,
+            'peak_month_revenue': peak_report.total_revenue if peak_report else None,
+            'lowest_month': lowest_report.report_month if lowest_report else None,
+            'lowest_month_revenue': lowest_report.total_revenue if lowest_report else None,
+            'product_breakdown': product_breakdown,
+            'order_source_breakdown': order_source_breakdown,
+            'monthly_details': monthly_details,
+            'quarterly_stats': quarterly_stats,
+            'yoy_revenue_growth': growth_rate(total_revenue, last_year_report and last_year_report.total_revenue),
+            'yoy_order_growth': growth_rate(total_orders, last_year_report and last_year_report.total_orders),
+            'revenue_trend': cls._analyze_revenue_trend(monthly_details),
+        }
     
     @staticmethod
     def _analyze_revenue_trend(monthly_details):
@@ -1674,10 +2516,70 @@ class AnnualSalesReport(models.Model):
             report = cls.update_or_create_report(user, year)
             if report:
                 count += 1
+        cls.refresh_ranks([year])
         
         logger.info(f"✅ 生成 {year} 年報表完成，共 {count} 位用戶")
         return count
     
+    @classmethod
+    def bulk_generate(cls, years):
+        """
+        批次重建多個年份所有用戶的年報表
+        
+        一次讀取範圍內的月報表並在記憶體中分組計算，依時間順序處理，
+        同比使用同批次剛計算的結果，最後以 bulk_create 寫入。
+        
+        Args:
+            years: 年份列表
+            
+        Returns:
+            int: 寫入的報表數量
+        """
+        years = sorted(set(years))
+        if not years:
+            return 0
+        
+        # 1. 一次讀取範圍內的月報表，依 (用戶, 年) 分組
+        monthly_by_key = defaultdict(list)
+        for monthly_report in MonthlySalesReport.objects.filter(
+            report_year__in=years
+        ).order_by('user_id', 'report_year', 'report_month'):
+            monthly_by_key[(monthly_report.user_id, monthly_report.report_year)].append(monthly_report)
+        
+        # 2. 讀取既有年報表作為同比比較對象
+        previous = {
+            (report.user_id, report.report_year): report
+            for report in cls.objects.filter(
+                user_id__in={user_id for user_id, _ in monthly_by_key},
+                report_year__range=(years[0] - 1, years[-1])
+            ).only('user_id', 'report_year', 'total_revenue', 'total_orders')
+        }
+        
+        # 3. 依時間順序計算
+        reports = []
+        for user_id, year in sorted(monthly_by_key):
+            fields = cls._build_report_fields(
+                monthly_by_key[(user_id, year)],
+                previous.get((user_id, year - 1))
+            )
+            report = cls(user_id=user_id, report_year=year, **fields)
+            previous[(user_id, year)] = report
+            reports.append(report)
+        
+        # 4. 批次寫入
+        if reports:
+            cls.objects.bulk_create(
+                reports,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['report_year', 'user'],
+                update_fields=list(fields) + ['last_updated']
+            )
+            cls.refresh_ranks(years)
+        
+        logger.info(f"✅ 批次重建年報表：{years[0]} ~ {years[-1]}年，共 {len(reports)} 筆")
+        return len(reports)
+    
     @classmethod
     def get_ranking(cls, year=None, role=None, limit=10):
         """
@@ -1742,33 +2644,32 @@ class AnnualSalesReport(models.Model):
     @classmethod
     def get_multi_year_comparison(cls, user, years=5):
         """
-        獲取多年比較數據
+        獲取多年比較數據（一次查詢，沒有報表的年份補零）
         
         Args:
             user: CustomUser 實例
             years: 比較年數，預設5年
             
         Returns:
-            list: 年度比較數據列表
+            list: 年度比較數據列表（由今年往前）
         """
-        current_year = timezone.now().year
-        comparison_data = []
+        series = TimeSeries.years(
+            cls.objects.filter(user=user),
+            timezone.now().year,
+            length=years,
+            fields=('total_revenue', 'total_orders', 'total_products_sold', 'yoy_revenue_growth', 'revenue_trend')
+        )
         
-        for i in range(years):
-            year = current_year - i
-            report = cls.objects.filter(
-                user=user,
-                report_year=year
-            ).first()
-            
-            if report:
+        comparison_data = []
+        for year, row in reversed(series.items()):
+            if row:
                 comparison_data.append({
                     'year': year,
-                    'revenue': float(report.total_revenue),
-                    'orders': report.total_orders,
-                    'products': report.total_products_sold,
-                    'yoy_growth': float(report.yoy_revenue_growth) if report.yoy_revenue_growth else None,
-                    'trend': report.revenue_trend
+                    'revenue': float(row['total_revenue']),
+                    'orders': row['total_orders'],
+                    'products': row['total_products_sold'],
+                    'yoy_growth': float(row['yoy_revenue_growth']) if row['yoy_revenue_growth'] else None,
+                    'trend': row['revenue_trend']
                 })
             else:
                 comparison_data.append({
@@ -1782,6 +2683,25 @@ class AnnualSalesReport(models.Model):
         
         return comparison_data
     
+    @classmethod
+    def refresh_ranks(cls, years):
+        """
+        重算多個年份的報表排名（一次視窗函數查詢）
+        
+        Args:
+            years: 年份列表
+            
+        Returns:
+            int: 排名有變動的報表數量
+        """
+        years = set(years)
+        if not years:
+            return 0
+        return refresh_report_ranks(
+            cls.objects.filter(report_year__in=years),
+            ['report_year']
+        )
+    
     def get_rank(self):
         """
         獲取該報表在當年所有用戶中的排名
@@ -1789,6 +2709,10 @@ class AnnualSalesReport(models.Model):
         Returns:
             int: 排名（從1開始）
         """
+        if self.revenue_rank is not None:
+            return self.revenue_rank
+        
+        # 尚未計算排名時即時查詢
         higher_revenue_count = AnnualSalesReport.objects.filter(
             report_year=self.report_year,
             total_revenue__gt=self.total_revenue
@@ -1803,6 +2727,10 @@ class AnnualSalesReport(models.Model):
         Returns:
             int: 排名（從1開始）
         """
+        if self.role_rank is not None:
+            return self.role_rank
+        
+        # 尚未計算排名時即時查詢
         higher_revenue_count = AnnualSalesReport.objects.filter(
             report_year=self.report_year,
             user__role=self.user.role,
@@ -1811,6 +2739,21 @@ class AnnualSalesReport(models.Model):
         
         return higher_revenue_count + 1
     
+    def get_role_total(self):
+        """
+        獲取當年同角色用戶的報表數
+        
+        Returns:
+            int: 報表數
+        """
+        if self.role_total is not None:
+            return self.role_total
+        
+        return AnnualSalesReport.objects.filter(
+            report_year=self.report_year,
+            user__role=self.user.role
+        ).count()
+    
     @property
     def report_period(self):
         """返回報表期間的顯示字串"""
@@ -2175,3 +3118,233 @@ class AnnualSalesSummary(models.Model):
             return None
         return max(self.quarterly_comparison, key=self.quarterly_comparison.get)
 
+
+
+# 報表待更新期間
+class ReportDirtyPeriod(models.Model):
+    """
+    報表待更新佇列
+    
+    報表 signal 只寫入待更新的 (用戶, 日期)，由 process_report_queue 指令
+    在背景批次處理。同一批次內重複的期間只會重算一次：
+    - DAY：日報表已更新，需重算該日排名、該月月報表與月度營業總結
+    - MONTH：月報表已更新，需重算該年年報表與年度營業總結
+    
+    月報表重算後會寫入 MONTH 期間，於下一批次更新年報表。
+    
+    重算失敗的期間保留在佇列中並累加嘗試次數，延後 retry_delay 再處理；
+    超過 max_attempts 次後不再自動重試，留待管理員排除問題後重設。
+    """
+    
+    # 失敗後延後重試的時間與最多嘗試次數
+    retry_delay = timedelta(minutes=5)
+    max_attempts = 5
+    
+    class Period(models.TextChoices):
+        DAY = "DAY", "日報表"
+        MONTH = "MONTH", "月報表"
+    
+    user = models.ForeignKey(
+        'accounts.CustomUser',
+        on_delete=models.CASCADE,
+        related_name='report_dirty_periods',
+        verbose_name="用戶"
+    )
+    
+    period = models.CharField(
+        max_length=10,
+        choices=Period.choices,
+        default=Period.DAY,
+        verbose_name="期間類型"
+    )
+    
+    report_date = models.DateField(
+        verbose_name="報表日期"
+    )
+    
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name="失敗次數"
+    )
+    
+    retry_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="下次重試時間"
+    )
+    
+    last_error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name="最後錯誤訊息"
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="建立時間"
+    )
+    
+    class Meta:
+        verbose_name = "報表待更新期間"
+        verbose_name_plural = "報表待更新期間"
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.get_period_display()} - {self.report_date} - {self.user_id}"
+    
+    @classmethod
+    def enqueue(cls, user, report_date, period=Period.DAY):
+        """
+        加入待更新佇列（與呼叫端在同一交易內，交易回滾時一併取消）
+        
+        Args:
+            user: CustomUser 實例
+            report_date: 報表日期（MONTH 期間使用該月任一天）
+            period: 期間類型
+        """
+        return cls.objects.create(user=user, report_date=report_date, period=period)
+    
+    @classmethod
+    def process_batch(cls, batch_size=1000):
+        """
+        處理一批待更新期間
+        
+        同一批次內依 (用戶, 年月) 與 (用戶, 年) 去重，每個期間與營業總結只重算一次。
+        只移除重算成功的項目；失敗的項目累加嘗試次數並延後重試。
+        處理期間新加入的項目保留到下一批次。
+        
+        Args:
+            batch_size: 每批最多讀取的佇列筆數
+            
+        Returns:
+            dict: {'items': 佇列筆數, 'monthly': 重算月報表數, 'annual': 重算年報表數, 'failed': 失敗筆數}
+        """
+        # 1. 讀取一批佇列（略過延後重試中與超過嘗試次數的項目）
+        now = timezone.now()
+        items = list(
+            cls.objects.filter(
+                Q(retry_at__isnull=True) | Q(retry_at__lte=now),
+                attempts__lt=cls.max_attempts
+            ).order_by('id').values('id', 'user_id', 'period', 'report_date')[:batch_size]
+        )
+        if not items:
+            return {'items': 0, 'monthly': 0, 'annual': 0, 'failed': 0}
+        
+        # 2. 去重
+        months = set()
+        years = set()
+        for item in items:
+            report_date = item['report_date']
+            if item['period'] == cls.Period.DAY:
+                months.add((item['user_id'], report_date.year, report_date.month))
+            else:
+                years.add((item['user_id'], report_date.year))
+        
+        users = CustomUser.objects.in_bulk(
+            {user_id for user_id, *_ in months} | {user_id for user_id, _ in years}
+        )
+        
+        # 失敗的期間 {(用戶 ID, 年, 月) 或 (用戶 ID, 年): 錯誤訊息}
+        errors = {}
+        
+        # 3. 重算受影響日期的日報表排名（訂單增量更新時不重算排名）
+        report_dates = {item['report_date'] for item in items if item['period'] == cls.Period.DAY}
+        try:
+            DailySalesReport.refresh_ranks_on(report_dates)
+        except Exception as e:
+            for key in months:
+                errors.setdefault(key, str(e))
+            logger.error(f"❌ 更新日報表排名失敗：{str(e)}", exc_info=True)
+        
+        # 4. 重算月報表與月度營業總結
+        for user_id, year, month in sorted(months):
+            user = users.get(user_id)
+            if user is None:
+                continue
+            try:
+                MonthlySalesReport.update_or_create_report(user=user, year=year, month=month)
+            except Exception as e:
+                errors[(user_id, year, month)] = str(e)
+                logger.error(f"❌ 更新月報表失敗：{year}-{month:02d} - {user_id} - {str(e)}", exc_info=True)
+        
+        month_periods = {(year, month) for _, year, month in months}
+        try:
+            MonthlySalesReport.refresh_ranks(month_periods)
+        except Exception as e:
+            for key in months:
+                errors.setdefault(key, str(e))
+            logger.error(f"❌ 更新月報表排名失敗：{str(e)}", exc_info=True)
+        
+        for year, month in sorted(month_periods):
+            try:
+                MonthlySalesSummary.generate_summary(year, month)
+            except Exception as e:
+                for key in months:
+                    if key[1:] == (year, month):
+                        errors.setdefault(key, str(e))
+                logger.error(f"❌ 更新月度營業總結失敗：{year}-{month:02d} - {str(e)}", exc_info=True)
+        
+        # 5. 重算年報表與年度營業總結
+        for user_id, year in sorted(years):
+            user = users.get(user_id)
+            if user is None:
+                continue
+            try:
+                AnnualSalesReport.update_or_create_report(user=user, year=year)
+            except Exception as e:
+                errors[(user_id, year)] = str(e)
+                logger.error(f"❌ 更新年報表失敗：{year}年 - {user_id} - {str(e)}", exc_info=True)
+        
+        year_periods = {year for _, year in years}
+        try:
+            AnnualSalesReport.refresh_ranks(year_periods)
+        except Exception as e:
+            for key in years:
+                errors.setdefault(key, str(e))
+            logger.error(f"❌ 更新年報表排名失敗：{str(e)}", exc_info=True)
+        
+        for year in sorted(year_periods):
+            try:
+                AnnualSalesSummary.generate_summary(year)
+            except Exception as e:
+                for key in years:
+                    if key[1] == year:
+                        errors.setdefault(key, str(e))
+                logger.error(f"❌ 更新年度營業總結失敗：{year}年 - {str(e)}", exc_info=True)
+        
+        # 6. 移除成功的項目，失敗的項目累加嘗試次數並延後重試
+        failed = defaultdict(list)
+        succeeded = []
+        for item in items:
+            report_date = item['report_date']
+            if item['period'] == cls.Period.DAY:
+                key = (item['user_id'], report_date.year, report_date.month)
+            else:
+                key = (item['user_id'], report_date.year)
+            if key in errors:
+                failed[errors[key]].append(item['id'])
+            else:
+                succeeded.append(item['id'])
+        
+        cls.objects.filter(id__in=succeeded).delete()
+        for error, ids in failed.items():
+            cls.objects.filter(id__in=ids).update(
+                attempts=F('attempts') + 1,
+                retry_at=now + cls.retry_delay,
+                last_error=error[:1000]
+            )
+        
+        failed_count = len(items) - len(succeeded)
+        if failed_count:
+            logger.warning(f"⚠️ 報表佇列 {failed_count} 筆重算失敗，將於 {cls.retry_delay} 後重試")
+        
+        logger.info(
+            f"✅ 處理報表佇列：{len(items)} 筆，"
+            f"重算月報表 {len(months)} 筆、年報表 {len(years)} 筆"
+        )
+        return {
+            'items': len(items),
+            'monthly': len(months),
+            'annual': len(years),
+            'failed': failed_count,
+        }
@@ -1,3 +1,112 @@
+from datetime import timedelta
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+
+from business.constant import OrderSource, OrderStatus, PaymentType
+from business.models import Order, OrderProduct
+from business.tests import create_headquarter
+from products.constant import ProductType
+from products.tests import create_variant
+from reports.models import DailySalesReport, MonthlySalesReport, ReportDirtyPeriod
+
+# 比對增量更新與完整重建的欄位
+REPORT_FIELDS = (
+    'user_id', 'total_revenue', 'total_orders', 'total_products_sold',
+    'product_breakdown', 'order_source_breakdown'
+)
+
+
+class DailySalesReportApplyOrderTests(TestCase):
+    """日報表增量更新與完整重建一致"""
+
+    def setUp(self):
+        self.users = [create_headquarter('hq1'), create_headquarter('hq2')]
+        self.esim = create_variant('日本 5G')
+        self.rechargeable = create_variant('充值卡', product_type=ProductType.RECHARGEABLE)
+
+    def create_order(self, user, lines, order_source=OrderSource.LINE, paid=True):
+        """建立訂單並加入訂單產品，paid 時再改為已付款（觸發增量更新）"""
+        order = Order.objects.create(
+            account=user, created_by=user, payment_type=PaymentType.TOPUP, order_source=order_source
+        )
+        for variant, quantity, unit_price in lines:
+            OrderProduct.objects.create(order=order, variant=variant, quantity=quantity, unit_price=unit_price)
+        if paid:
+            order.status = OrderStatus.PAID
+            order.save()
+        return order
+
+    def snapshot(self):
+        return sorted(
+            DailySalesReport.objects.filter(report_date=timezone.localdate()).values_list(*REPORT_FIELDS)
+        )
+
+    def test_incremental_updates_match_bulk_generate(self):
+        first, second = self.users
+        self.create_order(first, [(self.esim, 2, 300), (self.rechargeable, 1, 500)])
+        self.create_order(first, [(self.esim, 1, 300)], order_source=OrderSource.SHOPEE)
+        self.create_order(second, [(self.rechargeable, 3, 500)], order_source=OrderSource.WEBSITE)
+
+        # 已付款訂單加入產品、修改運費與來源
+        changed = self.create_order(second, [(self.esim, 1, 300)])
+        OrderProduct.objects.create(order=changed, variant=self.rechargeable, quantity=2, unit_price=500)
+        changed.shipping_fee = 60
+        changed.order_source = OrderSource.PEER
+        changed.save()
+
+        # 已付款後取消、刪除，以及未付款訂單
+        cancelled = self.create_order(first, [(self.esim, 4, 300)])
+        cancelled.status = OrderStatus.CANCELLED
+        cancelled.save()
+        self.create_order(second, [(self.esim, 5, 300)]).delete()
+        self.create_order(first, [(self.esim, 6, 300)], paid=False)
+
+        incremental = self.snapshot()
+        today = timezone.localdate()
+        DailySalesReport.bulk_generate(today, today)
+
+        self.assertEqual(incremental, self.snapshot())
+        self.assertEqual(
+            DailySalesReport.objects.get(user=second, report_date=today).total_orders, 2
+        )
+
+    def test_unchanged_contribution_does_not_write_report(self):
+        order = self.create_order(self.users[0], [(self.esim, 1, 300)])
+        order.remark = '只修改備註'
+
+        self.assertFalse(DailySalesReport.apply_order(order))
+
+
+class ReportDirtyPeriodTests(TestCase):
+    """報表待更新佇列"""
+
+    def setUp(self):
+        self.user = create_headquarter()
+        self.item = ReportDirtyPeriod.enqueue(self.user, timezone.localdate())
+
+    def test_failed_items_are_kept_for_retry(self):
+        with mock.patch.object(MonthlySalesReport, 'update_or_create_report', side_effect=RuntimeError('失敗')):
+            result = ReportDirtyPeriod.process_batch()
+
+        self.assertEqual(result['failed'], 1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.attempts, 1)
+        self.assertEqual(self.item.last_error, '失敗')
+        self.assertGreater(self.item.retry_at, timezone.now())
+
+        # 延後重試期間不處理
+        self.assertEqual(ReportDirtyPeriod.process_batch()['items'], 0)
+
+        ReportDirtyPeriod.objects.filter(pk=self.item.pk).update(retry_at=timezone.now() - timedelta(seconds=1))
+        result = ReportDirtyPeriod.process_batch()
+
+        self.assertEqual((result['items'], result['failed']), (1, 0))
+        self.assertFalse(ReportDirtyPeriod.objects.filter(pk=self.item.pk).exists())
+
+    def test_items_past_max_attempts_are_skipped(self):
+        ReportDirtyPeriod.objects.filter(pk=self.item.pk).update(attempts=ReportDirtyPeriod.max_attempts)
 
-# Create your tests here.
+        self.assertEqual(ReportDirtyPeriod.process_batch()['items'], 0)
+        self.assertTrue(ReportDirtyPeriod.objects.filter(pk=self.item.pk).exists())
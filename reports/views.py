@@ -13,7 +13,8 @@ from reports.models import (
     DailySalesReport, 
     DailySalesSummary,
     MonthlySalesReport,
-    AnnualSalesReport
+    AnnualSalesReport,
+    TimeSeries
 )
 from accounts.utils import is_headquarter_admin, is_agent
 from accounts.constant import AccountRole
@@ -21,6 +22,25 @@ from accounts.constant import AccountRole
 logger = logging.getLogger(__name__)
 
 
+def get_trend_length(request, param, options):
+    """
+    讀取儀表板趨勢長度參數
+    
+    Args:
+        request: HttpRequest
+        param: GET 參數名稱
+        options: 可選長度，第一個為預設值
+        
+    Returns:
+        int: 趨勢長度，參數無效時為預設值
+    """
+    try:
+        length = int(request.GET.get(param, options[0]))
+    except ValueError:
+        return options[0]
+    return length if length in options else options[0]
+
+
 # ==================== 日報表 Views ====================
 class DailySalesReportListView(LoginRequiredMixin, ListView):
     """
@@ -175,10 +195,7 @@ class DailySalesReportDetailView(LoginRequiredMixin, DetailView):
         context['role_rank'] = report.get_role_rank()
         
         # 同角色用戶總數
-        context['role_total_users'] = DailySalesReport.objects.filter(
-            report_date=report.report_date,
-            user__role=report.user.role
-        ).count()
+        context['role_total_users'] = report.get_role_total()
         
         # 產品類型統計（轉換為列表）
         product_breakdown = []
@@ -312,17 +329,18 @@ class DailySalesDashboardView(LoginRequiredMixin, ListView):
         if daily_summary:
             context['product_types'] = daily_summary.top_product_types
         
-        # 近7日趨勢
+        # 近 N 日趨勢（預設 7 日）
+        trend_days = get_trend_length(self.request, 'trend_days', TimeSeries.DAY_LENGTHS)
         trend_data = []
-        for i in range(6, -1, -1):
-            date = report_date - timedelta(days=i)
-            summary = DailySalesSummary.objects.filter(report_date=date).first()
+        for date, summary in DailySalesSummary.get_trend(report_date, days=trend_days).items():
             trend_data.append({
                 'date': date.strftime('%m/%d'),
-                'revenue': float(summary.total_revenue) if summary else 0,
-                'orders': summary.total_orders if summary else 0
+                'revenue': float(summary['total_revenue']) if summary else 0,
+                'orders': summary['total_orders'] if summary else 0
             })
         context['trend_data'] = trend_data
+        context['trend_days'] = trend_days
+        context['trend_day_options'] = TimeSeries.DAY_LENGTHS
         
         # 用戶自己的報表
         my_report = DailySalesReport.objects.filter(
@@ -539,11 +557,7 @@ class MonthlySalesReportDetailView(LoginRequiredMixin, DetailView):
         context['role_rank'] = report.get_role_rank()
         
         # 同角色用戶總數
-        context['role_total_users'] = MonthlySalesReport.objects.filter(
-            report_year=report.report_year,
-            report_month=report.report_month,
-            user__role=report.user.role
-        ).count()
+        context['role_total_users'] = report.get_role_total()
         
         # 產品類型統計（轉換為列表）
         product_breakdown = []
@@ -752,29 +766,22 @@ class MonthlySalesDashboardView(LoginRequiredMixin, ListView):
         if monthly_summary and monthly_summary.quarterly_comparison:
             context['quarterly_comparison'] = monthly_summary.quarterly_comparison
         
-        # 近12個月趨勢
+        # 近 N 個月趨勢（預設 12 個月）
+        trend_months = get_trend_length(self.request, 'trend_months', TimeSeries.MONTH_LENGTHS)
         trend_data = []
-        for i in range(11, -1, -1):
-            # 計算月份
-            target_month = month - i
-            target_year = year
-            while target_month < 1:
-                target_month += 12
-                target_year -= 1
-            
-            summary = MonthlySalesSummary.objects.filter(
-                report_year=target_year,
-                report_month=target_month
-            ).first()
-            
+        for (target_year, target_month), summary in MonthlySalesSummary.get_trend(
+            year, month, months=trend_months
+        ).items():
             trend_data.append({
                 'year': target_year,
                 'month': target_month,
                 'label': f"{target_year}/{target_month:02d}",
-                'revenue': float(summary.total_revenue) if summary else 0,
-                'orders': summary.total_orders if summary else 0
+                'revenue': float(summary['total_revenue']) if summary else 0,
+                'orders': summary['total_orders'] if summary else 0
             })
         context['trend_data'] = trend_data
+        context['trend_months'] = trend_months
+        context['trend_month_options'] = TimeSeries.MONTH_LENGTHS
         
         # 用戶自己的報表
         my_report = MonthlySalesReport.objects.filter(
@@ -1,4 +1,4 @@
-import json
+from business.cart import Cart
 from accounts.utils import (
     is_headquarter_admin, 
     is_agent, 
@@ -28,33 +28,11 @@ def user_permissions(request):
 def cart_processor(request):
     """
     全局購物車資訊 context processor
-    讓所有模板都能訪問購物車數據
+    讓所有模板都能訪問購物車數據（讀取 CartMiddleware 已解析的 request.cart）
     """
-    try:
-        # 從 cookie 獲取購物車數據
-        cart_cookie = request.COOKIES.get('cart', '{}')
-        cart = json.loads(cart_cookie)
-        
-        # 計算商品總數
-        cart_count = sum(
-            int(item.get('quantity', 0)) 
-            for item in cart.values()
-        )
-        
-        # 計算總金額
-        cart_total = sum(
-            int(item.get('quantity', 0)) * float(item.get('unit_price', 0))
-            for item in cart.values()
-        )
-        
-        return {
-            'cart_count': cart_count,
-            'cart_total': cart_total,
-            'cart_items_count': len(cart)  # 購物車商品種類數
-        }
-    except Exception as e:
-        return {
-            'cart_count': 0,
-            'cart_total': 0,
-            'cart_items_count': 0
-        }
\ No newline at end of file
+    cart = Cart.from_request(request)
+    return {
+        'cart_count': cart.count,
+        'cart_total': float(cart.total),
+        'cart_items_count': len(cart)  # 購物車商品種類數
+    }